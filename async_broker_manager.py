@@ -0,0 +1,264 @@
+import aio_pika
+
+from broker_manager import RegistryQueries, EXCHANGE_TYPES
+from async_message_utils import get_async_connection_manager
+from message_utils import headers_binding_arguments, queue_arguments
+from topic_history import history_queue_name, history_binding, history_queue_arguments, DEFAULT_HISTORY_BYTES
+
+class AsyncBrokerManager(RegistryQueries):
+    """Versão asyncio do BrokerManager.
+
+    Todas as operações no broker são corrotinas sobre a conexão compartilhada
+    do AsyncConnectionManager; nenhuma delas passa pelo cliente síncrono. Do
+    BrokerManager vêm apenas as consultas ao registro (``RegistryQueries``),
+    que não falam com o broker.
+    """
+
+    def __init__(self, connection_manager=None, registry=None, warm_start=True):
+        super().__init__(registry)
+        self.connection_manager = connection_manager or get_async_connection_manager()
+        if warm_start and self.registry.persistent:
+            self.warm_start()
+
+    def warm_start(self):
+        """Marca filas e tópicos persistidos como declarados na conexão, sem redeclará-los"""
+        queues = topics = 0
+        for queue_name, _ in self.registry.iter_queues():
+            self.connection_manager.remember_queue(queue_name)
+            queues += 1
+        for topic_name, exchange_type in self.registry.iter_topics():
+            self.connection_manager.remember_exchange(topic_name, exchange_type)
+            topics += 1
+        print(f"Registro carregado: {queues} filas e {topics} tópicos.")
+
+    async def add_queue(self, queue_name, **policy):
+        """Adiciona uma nova fila (com as políticas de ``BrokerManager.add_queue``)"""
+        try:
+            arguments = queue_arguments(**policy)
+            await self.connection_manager.declare_queue(queue_name, force=True, arguments=arguments)
+            self.registry.add_queue(queue_name, arguments)
+            self._forget_queue_arguments(queue_name)
+            print(f"Fila '{queue_name}' adicionada com sucesso.")
+            return True
+        except Exception as e:
+            print(f"Erro ao adicionar fila '{queue_name}': {e}")
+            return False
+
+    async def remove_queue(self, queue_name):
+        """Remove uma fila"""
+        try:
+            channel = await self.connection_manager.get_channel()
+            await channel.queue_delete(queue_name)
+            self.connection_manager.forget_queue(queue_name)
+            self.registry.remove_queue(queue_name)
+            self._forget_queue_arguments(queue_name)
+            print(f"Fila '{queue_name}' removida com sucesso.")
+            return True
+        except Exception as e:
+            print(f"Erro ao remover fila '{queue_name}': {e}")
+            return False
+
+    async def add_topic(self, topic_name, exchange_type='fanout', history=False,
+                        history_max_bytes=DEFAULT_HISTORY_BYTES, history_max_age=None):
+        """Adiciona um novo tópico (exchange), com as opções de histórico de ``BrokerManager.add_topic``"""
+        if exchange_type not in EXCHANGE_TYPES:
+            print(f"Tipo de exchange inválido para o tópico '{topic_name}': '{exchange_type}'.")
+            return False
+        binding = history_binding(exchange_type) if history else None
+        if history and binding is None:
+            print(f"Tópicos '{exchange_type}' não suportam histórico: '{topic_name}'.")
+            return False
+        try:
+            if history:
+                history_queue = history_queue_name(topic_name)
+                arguments = history_queue_arguments(history_max_bytes, history_max_age)
+            await self.connection_manager.declare_exchange(topic_name, exchange_type, force=True)
+            if history:
+                # Fila e binding do histórico antes do registro, como no BrokerManager
+                try:
+                    await self.connection_manager.declare_queue(history_queue, force=True, arguments=arguments)
+                    await self.connection_manager.bind_queue(history_queue, topic_name, exchange_type, *binding)
+                except Exception:
+                    await self._discard_history_queue(history_queue)
+                    raise
+            self.registry.add_topic(topic_name, exchange_type)
+            if history:
+                self.registry.add_queue(history_queue, arguments)
+                self._forget_queue_arguments(history_queue)
+                print(f"Tópico '{topic_name}' adicionado com histórico em '{history_queue}'.")
+            else:
+                print(f"Tópico '{topic_name}' adicionado com sucesso.")
+            return True
+        except Exception as e:
+            print(f"Erro ao adicionar tópico '{topic_name}': {e}")
+            return False
+
+    async def _discard_history_queue(self, history_queue):
+        """Remove a fila de histórico de um ``add_topic`` que falhou (melhor esforço)"""
+        self.connection_manager.forget_queue(history_queue)
+        try:
+            channel = await self.connection_manager.get_channel()
+            await channel.queue_delete(history_queue)
+        except Exception:
+            pass
+
+    async def remove_topic(self, topic_name):
+        """Remove um tópico (exchange) e o seu histórico, se houver"""
+        try:
+            channel = await self.connection_manager.get_channel()
+            await channel.exchange_delete(topic_name)
+            self.connection_manager.forget_exchange(topic_name)
+            self.registry.remove_topic(topic_name)
+            if self.has_topic_history(topic_name):
+                await self.remove_queue(history_queue_name(topic_name))
+            print(f"Tópico '{topic_name}' removido com sucesso.")
+            return True
+        except Exception as e:
+            print(f"Erro ao remover tópico '{topic_name}': {e}")
+            return False
+
+    async def _passive_declare(self, declare):
+        """Executa uma declaração passiva num canal próprio; None se o recurso não existe.
+
+        Uma declaração passiva de recurso inexistente fecha o canal, então o
+        canal compartilhado não é usado.
+        """
+        channel = await self.connection_manager.open_consumer_channel()
+        try:
+            return await declare(channel)
+        except aio_pika.exceptions.ChannelNotFoundEntity:
+            return None
+        finally:
+            if not channel.is_closed:
+                await channel.close()
+
+    async def get_queue_message_count(self, queue_name):
+        """Obtém a quantidade de mensagens em uma fila"""
+        try:
+            channel = await self.connection_manager.open_consumer_channel()
+            try:
+                queue = await channel.declare_queue(queue_name, passive=True)
+                message_count = queue.declaration_result.message_count
+            finally:
+                if not channel.is_closed:
+                    await channel.close()
+            print(f"Fila '{queue_name}' tem {message_count} mensagens.")
+            return message_count
+        except Exception as e:
+            print(f"Erro ao obter contagem de mensagens da fila '{queue_name}': {e}")
+            return -1
+
+    async def list_queues(self, verify=False):
+        """Lista todas as filas; com ``verify=True`` mostra profundidade e consumidores no broker"""
+        queues = [queue_name for queue_name, _ in self.registry.iter_queues()]
+        print("Filas disponíveis:")
+        for queue_name in queues:
+            if not verify:
+                print(f"  - {queue_name}")
+                continue
+            try:
+                queue = await self._passive_declare(
+                    lambda channel: channel.declare_queue(queue_name, passive=True))
+            except Exception as e:
+                print(f"  - {queue_name} (erro ao consultar o broker: {e})")
+                continue
+            if queue is None:
+                print(f"  - {queue_name} (não encontrada no broker)")
+            else:
+                result = queue.declaration_result
+                print(f"  - {queue_name} ({result.message_count} mensagens, "
+                      f"{result.consumer_count} consumidores)")
+        return queues
+
+    async def list_topics(self, verify=False):
+        """Lista todos os tópicos; com ``verify=True`` confere se existem no broker"""
+        topics = []
+        print("Tópicos disponíveis:")
+        for topic_name, exchange_type in list(self.registry.iter_topics()):
+            missing = ""
+            if verify:
+                try:
+                    exchange = await self._passive_declare(
+                        lambda channel: channel.declare_exchange(topic_name, passive=True))
+                    missing = " (não encontrado no broker)" if exchange is None else ""
+                except Exception as e:
+                    missing = f" (erro ao consultar o broker: {e})"
+            print(f"  - {topic_name} ({exchange_type}){missing}")
+            topics.append(topic_name)
+        return topics
+
+    async def create_user(self, username, **policy):
+        """Cria um novo usuário e sua fila dedicada (com as políticas de ``add_queue``)"""
+        if self.registry.has_user(username):
+            print(f"Usuário '{username}' já existe.")
+            return False
+
+        user_queue = f"user_{username}"
+        if await self.add_queue(user_queue, **policy):
+            self.registry.add_user(username, user_queue)
+            print(f"Usuário '{username}' criado com fila dedicada '{user_queue}'.")
+            return True
+        else:
+            print(f"Erro ao criar usuário '{username}'.")
+            return False
+
+    async def remove_user(self, username):
+        """Remove um usuário e sua fila dedicada"""
+        user_queue = self.registry.get_user_queue(username)
+        if user_queue is None:
+            print(f"Usuário '{username}' não existe.")
+            return False
+
+        if await self.remove_queue(user_queue):
+            self.registry.remove_user(username)
+            print(f"Usuário '{username}' removido.")
+            return True
+        else:
+            print(f"Erro ao remover usuário '{username}'.")
+            return False
+
+    async def subscribe_user_to_topic(self, username, topic_name, binding_key='', headers=None, match='all'):
+        """Inscreve um usuário em um tópico (binding durável para a fila do usuário)"""
+        user_queue = self.registry.get_user_queue(username)
+        if user_queue is None:
+            print(f"Usuário '{username}' não existe.")
+            return False
+
+        exchange_type = self.registry.get_topic_type(topic_name)
+        if exchange_type is None:
+            print(f"Tópico '{topic_name}' não existe.")
+            return False
+
+        try:
+            arguments = headers_binding_arguments(headers, match)
+            previous = self.registry.get_subscription(username, topic_name)
+            await self.connection_manager.bind_queue(user_queue, topic_name, exchange_type,
+                                                     binding_key, arguments)
+            if previous is not None and previous != (binding_key, arguments or {}):
+                await self.connection_manager.unbind_queue(user_queue, topic_name, *previous)
+        except Exception as e:
+            print(f"Erro ao inscrever usuário '{username}' no tópico '{topic_name}': {e}")
+            return False
+
+        self.registry.subscribe(username, topic_name, binding_key, arguments)
+        print(f"Usuário '{username}' inscrito no tópico '{topic_name}'.")
+        return True
+
+    async def unsubscribe_user_from_topic(self, username, topic_name):
+        """Desinscreve um usuário de um tópico (remove o binding da fila do usuário)"""
+        user_queue = self.registry.get_user_queue(username)
+        if user_queue is None:
+            print(f"Usuário '{username}' não existe.")
+            return False
+
+        subscription = self.registry.get_subscription(username, topic_name)
+        if subscription is not None and self.registry.has_topic(topic_name):
+            try:
+                await self.connection_manager.unbind_queue(user_queue, topic_name, *subscription)
+            except Exception as e:
+                print(f"Erro ao desinscrever usuário '{username}' do tópico '{topic_name}': {e}")
+                return False
+
+        self.registry.unsubscribe(username, topic_name)
+        print(f"Usuário '{username}' desinscrito do tópico '{topic_name}'.")
+        return True
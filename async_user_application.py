@@ -0,0 +1,419 @@
+import asyncio
+import time
+import uuid
+
+import aio_pika
+
+from async_broker_manager import AsyncBrokerManager
+from async_message_utils import get_async_connection_manager
+from dedup import DedupCache, message_key
+from message_codecs import encode_message, decode_message
+from message_utils import headers_binding_arguments
+from metrics import metrics
+from user_application import _is_own_topic_message, _delivery_source
+
+class AsyncUserApplication:
+    """Versão asyncio do UserApplication.
+
+    Usa o mesmo formato de mensagem e a mesma convenção de filas
+    (``user_<nome>``) do UserApplication, de modo que clientes síncronos e
+    assíncronos conversam entre si. Vários usuários podem compartilhar o mesmo
+    AsyncConnectionManager (uma conexão, um event loop). O ``broker_manager``,
+    se informado, precisa ser um AsyncBrokerManager: as operações do
+    BrokerManager síncrono bloqueariam o event loop.
+    """
+
+    def __init__(self, username, broker_manager=None, connection_manager=None):
+        if broker_manager is not None and not isinstance(broker_manager, AsyncBrokerManager):
+            raise TypeError(f"AsyncUserApplication requer um AsyncBrokerManager, não {type(broker_manager).__name__}.")
+        self.username = username
+        self.broker_manager = broker_manager
+        self.connection_manager = connection_manager or get_async_connection_manager()
+        self.user_queue = f"user_{username}"
+        self.subscribed_topics = set()
+        self.topic_bindings = {}  # tópico -> (chave, argumentos), sem broker manager
+        self.listener_tasks = {}  # queue:<nome> -> asyncio.Task
+        self.topic_listeners = set()  # Tópicos ouvidos pelo consumidor da fila do usuário
+        self._implicit_queue_listener = False  # Consumidor da fila iniciado por um tópico
+        self.dedup = None  # DedupCache dos consumidores, se ativado
+
+    def _build_message(self, message, headers=None, priority=None, expiration=None):
+        """Monta a mensagem no mesmo formato do cliente síncrono (remetente também em ``app_id``).
+
+        ``priority`` e ``expiration`` (segundos) funcionam como no cliente síncrono,
+        assim como o ``message_id`` único usado na deduplicação.
+        """
+        body, content_type, content_encoding = encode_message({
+            'from': self.username,
+            'message': message,
+            'timestamp': time.time()
+        })
+        return aio_pika.Message(
+            body=body,
+            content_type=content_type,
+            content_encoding=content_encoding,
+            app_id=self.username,
+            message_id=uuid.uuid4().hex,
+            headers=headers,
+            priority=priority,
+            expiration=expiration,
+            delivery_mode=aio_pika.DeliveryMode.PERSISTENT
+        )
+
+    def enable_dedup(self, cache=None, **options):
+        """Descarta mensagens repetidas antes dos handlers (como ``UserApplication.enable_dedup``)"""
+        self.dedup = cache or DedupCache(**options)
+        return self.dedup
+
+    def disable_dedup(self):
+        dedup, self.dedup = self.dedup, None
+        return dedup
+
+    def _is_duplicate(self, incoming, kind, name):
+        """Verifica (e registra) a mensagem na deduplicação das leituras diretas"""
+        if self.dedup is None or not self.dedup.seen(message_key(incoming, incoming.body)):
+            return False
+        metrics.inc('mom_messages_deduplicated_total', kind=kind, name=name)
+        return True
+
+    def _get_topic_type(self, topic_name):
+        """Tipo do exchange do tópico: registro do broker manager, conexão ou fanout"""
+        exchange_type = None
+        if self.broker_manager:
+            exchange_type = self.broker_manager.get_topic_type(topic_name)
+        return exchange_type or self.connection_manager.get_exchange_type(topic_name) or 'fanout'
+
+    def _get_queue_arguments(self, queue_name):
+        """Argumentos com que a fila foi criada (registro do broker manager), ou None"""
+        if self.broker_manager:
+            return self.broker_manager.get_queue_arguments(queue_name) or None
+        return None
+
+    async def send_message_to_user(self, target_username, message, priority=None, expiration=None):
+        """Envia mensagem diretamente para outro usuário (produtor)"""
+        target_queue = f"user_{target_username}"
+        return await self._send_message_to_queue(target_queue, message, priority, expiration)
+
+    async def send_message_to_queue(self, queue_name, message, priority=None, expiration=None):
+        """Envia mensagem para uma fila específica"""
+        return await self._send_message_to_queue(queue_name, message, priority, expiration)
+
+    async def _send_message_to_queue(self, queue_name, message, priority=None, expiration=None):
+        """Método interno para enviar mensagem para fila"""
+        try:
+            channel = await self.connection_manager.declare_queue(
+                queue_name, arguments=self._get_queue_arguments(queue_name))
+            outgoing = self._build_message(message, priority=priority, expiration=expiration)
+            start = time.perf_counter()
+            await channel.default_exchange.publish(outgoing, routing_key=queue_name, mandatory=False)
+            metrics.record_sent('queue', queue_name, len(outgoing.body), time.perf_counter() - start)
+            print(f"[{self.username}] Mensagem enviada para fila '{queue_name}': {message}")
+            return True
+        except Exception as e:
+            metrics.record_error('publish', 'queue', queue_name)
+            print(f"[{self.username}] Erro ao enviar mensagem para fila '{queue_name}': {e}")
+            return False
+
+    async def receive_message_from_queue(self, queue_name):
+        """Recebe uma mensagem de uma fila específica (consumidor)"""
+        try:
+            channel = await self.connection_manager.declare_queue(
+                queue_name, arguments=self._get_queue_arguments(queue_name))
+            queue = await channel.get_queue(queue_name, ensure=False)
+            incoming = await queue.get(no_ack=True, fail=False)
+
+            if incoming and self._is_duplicate(incoming, 'queue', queue_name):
+                print(f"[{self.username}] Mensagem repetida descartada da fila '{queue_name}'.")
+                return None
+            if incoming:
+                message_data = decode_message(incoming.body, incoming)
+                metrics.record_received('queue', queue_name, len(incoming.body), message_data)
+                print(f"[{self.username}] Mensagem recebida da fila '{queue_name}': {message_data['message']} (de: {message_data['from']})")
+                return message_data
+            else:
+                print(f"[{self.username}] Nenhuma mensagem disponível na fila '{queue_name}'.")
+                return None
+
+        except Exception as e:
+            metrics.record_error('receive', 'queue', queue_name)
+            print(f"[{self.username}] Erro ao receber mensagem da fila '{queue_name}': {e}")
+            return None
+
+    async def receive_messages_from_user_queue(self):
+        """Recebe mensagens da própria fila do usuário"""
+        return await self.receive_message_from_queue(self.user_queue)
+
+    async def publish_message_to_topic(self, topic_name, message, routing_key='', headers=None,
+                                       priority=None, expiration=None):
+        """Publica mensagem em um tópico (publisher), roteada por ``routing_key``/``headers``"""
+        try:
+            exchange = await self.connection_manager.declare_exchange(topic_name, self._get_topic_type(topic_name))
+            outgoing = self._build_message(message, headers, priority, expiration)
+            start = time.perf_counter()
+            await exchange.publish(outgoing, routing_key=routing_key, mandatory=False)
+            metrics.record_sent('topic', topic_name, len(outgoing.body), time.perf_counter() - start)
+            print(f"[{self.username}] Mensagem publicada no tópico '{topic_name}': {message}")
+            return True
+        except Exception as e:
+            metrics.record_error('publish', 'topic', topic_name)
+            print(f"[{self.username}] Erro ao publicar mensagem no tópico '{topic_name}': {e}")
+            return False
+
+    async def subscribe_to_topic(self, topic_name, binding_key='', headers=None, match='all'):
+        """Inscreve-se em um tópico com um binding durável (filtrado por ``binding_key``/``headers``)"""
+        # O broker manager, se disponível, cria o binding e atualiza o registro
+        if self.broker_manager:
+            subscribed = await self.broker_manager.subscribe_user_to_topic(self.username, topic_name,
+                                                                           binding_key, headers, match)
+            if not subscribed:
+                print(f"[{self.username}] Erro ao se inscrever no tópico '{topic_name}'.")
+                return False
+        else:
+            try:
+                arguments = headers_binding_arguments(headers, match)
+                await self.connection_manager.bind_queue(self.user_queue, topic_name,
+                                                         self._get_topic_type(topic_name),
+                                                         binding_key, arguments)
+                previous = self.topic_bindings.get(topic_name)
+                if previous is not None and previous != (binding_key, arguments):
+                    await self.connection_manager.unbind_queue(self.user_queue, topic_name, *previous)
+                self.topic_bindings[topic_name] = (binding_key, arguments)
+            except Exception as e:
+                print(f"[{self.username}] Erro ao se inscrever no tópico '{topic_name}': {e}")
+                return False
+
+        self.subscribed_topics.add(topic_name)
+        print(f"[{self.username}] Inscrito no tópico '{topic_name}'.")
+        return True
+
+    async def unsubscribe_from_topic(self, topic_name):
+        """Desinscreve-se de um tópico (remove o binding da fila do usuário)"""
+        # O broker manager, se disponível, remove o binding e atualiza o registro
+        if self.broker_manager:
+            unsubscribed = await self.broker_manager.unsubscribe_user_from_topic(self.username, topic_name)
+            if not unsubscribed:
+                print(f"[{self.username}] Erro ao se desinscrever do tópico '{topic_name}'.")
+                return False
+        else:
+            try:
+                await self.connection_manager.unbind_queue(self.user_queue, topic_name,
+                                                           *self.topic_bindings.pop(topic_name, ('', None)))
+            except Exception as e:
+                print(f"[{self.username}] Erro ao se desinscrever do tópico '{topic_name}': {e}")
+                return False
+
+        self.subscribed_topics.discard(topic_name)
+        self.topic_listeners.discard(topic_name)
+        print(f"[{self.username}] Desinscrito do tópico '{topic_name}'.")
+        return True
+
+    async def iter_queue(self, queue_name=None):
+        """Iterador assíncrono sobre as mensagens de uma fila (padrão: fila do usuário).
+
+        As mensagens dos tópicos inscritos que chegam na fila do usuário trazem
+        ``topic`` e ``routing_key``; as próprias e as repetidas são descartadas.
+        """
+        if queue_name is None:
+            queue_name = self.user_queue
+
+        channel = await self.connection_manager.open_consumer_channel()
+        try:
+            queue = await channel.declare_queue(queue_name, durable=True,
+                                                arguments=self._get_queue_arguments(queue_name))
+            async with queue.iterator(no_ack=True) as messages:
+                async for incoming in messages:
+                    if _is_own_topic_message(incoming, incoming, self.username):
+                        continue  # Não processa suas próprias mensagens
+                    kind, name = _delivery_source(incoming, queue_name)
+                    if self._is_duplicate(incoming, kind, name):
+                        continue
+                    try:
+                        message_data = decode_message(incoming.body, incoming)
+                    except Exception as e:
+                        metrics.record_error('receive', kind, name)
+                        print(f"[{self.username}] Erro ao processar mensagem da fila '{queue_name}': {e}")
+                        continue
+                    metrics.record_received(kind, name, len(incoming.body), message_data)
+                    if incoming.exchange:
+                        message_data['topic'] = incoming.exchange
+                        message_data['routing_key'] = incoming.routing_key
+                    yield message_data
+        finally:
+            if not channel.is_closed:
+                await channel.close()
+
+    async def iter_topic(self, topic_name, binding_key='', headers=None, match='all'):
+        """Iterador assíncrono sobre as mensagens novas de um tópico, sem inscrição (exceto as próprias).
+
+        Como ``UserApplication.iter_topic``, usa uma fila temporária exclusiva:
+        nada fica retido entre leituras. Para receber também as mensagens
+        publicadas enquanto offline, use ``start_topic_listener``.
+        """
+        channel = await self.connection_manager.open_consumer_channel()
+        try:
+            exchange = await channel.declare_exchange(topic_name, self._get_topic_type(topic_name), durable=True)
+
+            # Cria uma fila temporária exclusiva e a vincula ao exchange
+            queue = await channel.declare_queue(exclusive=True)
+            await queue.bind(exchange, routing_key=binding_key,
+                             arguments=headers_binding_arguments(headers, match))
+
+            async with queue.iterator(no_ack=True) as messages:
+                async for incoming in messages:
+                    if incoming.app_id == self.username:
+                        continue  # Não processa suas próprias mensagens
+                    try:
+                        message_data = decode_message(incoming.body, incoming)
+                    except Exception as e:
+                        metrics.record_error('receive', 'topic', topic_name)
+                        print(f"[{self.username}] Erro ao processar mensagem do tópico '{topic_name}': {e}")
+                        continue
+                    metrics.record_received('topic', topic_name, len(incoming.body), message_data)
+                    message_data['topic'] = topic_name
+                    message_data['routing_key'] = incoming.routing_key
+                    yield message_data
+        finally:
+            if not channel.is_closed:
+                await channel.close()
+
+    def _is_subscribed(self, topic_name):
+        """Indica se já existe um binding do tópico para a fila do usuário"""
+        if self.broker_manager:
+            return self.broker_manager.registry.get_subscription(self.username, topic_name) is not None
+        return topic_name in self.topic_bindings
+
+    async def start_topic_listener(self, topic_name, handler=None, prefetch_count=0,
+                                   binding_key=None, headers=None, match='all'):
+        """Ouve um tópico pela fila do usuário, como ``UserApplication.start_topic_listener``.
+
+        Inscreve o usuário no tópico (binding durável para ``user_<nome>``;
+        sem ``binding_key``/``headers``, uma inscrição existente é mantida) e
+        garante uma tarefa consumindo a fila do usuário, que recebe as
+        mensagens de todos os tópicos inscritos. Retorna a tarefa, ou None se
+        a inscrição falhar.
+        """
+        if binding_key is not None or headers or not self._is_subscribed(topic_name):
+            if not await self.subscribe_to_topic(topic_name, binding_key or '', headers, match):
+                return None
+
+        key = f"queue:{self.user_queue}"
+        task = self.listener_tasks.get(key)
+        if task is None or task.done():
+            task = self.start_queue_listener(handler=handler, prefetch_count=prefetch_count)
+            self._implicit_queue_listener = True
+
+        self.topic_listeners.add(topic_name)
+        print(f"[{self.username}] Ouvindo tópico '{topic_name}' pela fila '{self.user_queue}'.")
+        return task
+
+    def stop_topic_listener(self, topic_name=None):
+        """Para de ouvir um tópico (ou todos); a inscrição continua e as mensagens aguardam na fila"""
+        if topic_name is None:
+            stopped = len(self.topic_listeners)
+            self.topic_listeners.clear()
+        else:
+            stopped = 1 if topic_name in self.topic_listeners else 0
+            self.topic_listeners.discard(topic_name)
+
+        if not self.topic_listeners and self._implicit_queue_listener:
+            self._implicit_queue_listener = False
+            self.stop_listener(f"queue:{self.user_queue}")
+        return stopped
+
+    def start_queue_listener(self, queue_name=None, handler=None, prefetch_count=0):
+        """Inicia uma tarefa que consome uma fila (padrão: fila do usuário).
+
+        Na fila do usuário também chegam as mensagens dos tópicos inscritos
+        (``message_data['topic']`` indica a origem). Com ``handler`` (corrotina)
+        cada mensagem é confirmada depois de processada e rejeitada se ele falhar.
+        """
+        if queue_name is None:
+            queue_name = self.user_queue
+        return self._start_listener(f"queue:{queue_name}", self._consume(queue_name, handler, prefetch_count))
+
+    async def _consume(self, queue_name, handler=None, prefetch_count=0):
+        """Consome a fila com ack manual, com as métricas e a deduplicação do listener síncrono"""
+        dedup = self.dedup
+        channel = await self.connection_manager.open_consumer_channel(prefetch_count)
+        try:
+            queue = await channel.declare_queue(queue_name, durable=True,
+                                                arguments=self._get_queue_arguments(queue_name))
+            async with queue.iterator() as messages:
+                async for incoming in messages:
+                    if _is_own_topic_message(incoming, incoming, self.username):
+                        await incoming.ack()
+                        continue  # Não processa suas próprias mensagens
+                    key = None
+                    if dedup is not None:
+                        key = message_key(incoming, incoming.body)
+                        if not dedup.claim(key):
+                            metrics.inc('mom_messages_deduplicated_total', kind='queue', name=queue_name)
+                            await incoming.ack()
+                            continue
+                    kind, name = _delivery_source(incoming, queue_name)
+                    try:
+                        message_data = decode_message(incoming.body, incoming)
+                        metrics.record_received(kind, name, len(incoming.body), message_data)
+                        if incoming.exchange:
+                            # Mensagem de tópico entregue pelo binding na fila do usuário
+                            message_data['topic'] = incoming.exchange
+                            message_data['routing_key'] = incoming.routing_key
+                        start = time.perf_counter()
+                        if handler:
+                            await handler(message_data)
+                            metrics.observe('mom_handler_seconds', time.perf_counter() - start,
+                                            kind=kind, name=name)
+                        elif incoming.exchange:
+                            print(f"[{self.username}] Mensagem recebida do tópico '{incoming.exchange}': {message_data['message']} (de: {message_data['from']})")
+                        else:
+                            print(f"[{self.username}] Mensagem recebida da fila '{queue_name}': {message_data['message']} (de: {message_data['from']})")
+                    except Exception as e:
+                        if key is not None:
+                            dedup.release(key)
+                        metrics.record_error('listener', kind, name)
+                        print(f"[{self.username}] Erro ao processar mensagem da fila '{queue_name}': {e}")
+                        await incoming.reject()
+                        continue
+                    except BaseException:
+                        # Tarefa cancelada: a mensagem volta para a fila com o fechamento do canal
+                        if key is not None:
+                            dedup.release(key)
+                        raise
+                    # Só um processamento bem-sucedido torna o ID conhecido
+                    if key is not None:
+                        dedup.commit(key)
+                    await incoming.ack()
+        finally:
+            if not channel.is_closed:
+                await channel.close()
+
+    def _start_listener(self, key, coroutine):
+        self.stop_listener(key)
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self.listener_tasks[key] = task
+        print(f"[{self.username}] Ouvindo {key}.")
+        return task
+
+    def stop_listener(self, key):
+        """Cancela o listener ``queue:<nome>``"""
+        task = self.listener_tasks.pop(key, None)
+        if task and not task.done():
+            task.cancel()
+        if key == f"queue:{self.user_queue}":
+            # Sem consumidor na fila do usuário não há tópicos sendo ouvidos
+            self.topic_listeners.clear()
+            self._implicit_queue_listener = False
+
+    async def stop_listeners(self):
+        """Cancela todos os listeners e aguarda o encerramento"""
+        tasks = list(self.listener_tasks.values())
+        self.listener_tasks.clear()
+        self.topic_listeners.clear()
+        self._implicit_queue_listener = False
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def get_subscribed_topics(self):
+        """Retorna a lista de tópicos inscritos"""
+        return list(self.subscribed_topics)
@@ -0,0 +1,6 @@
+"""Benchmarks reprodutíveis dos caminhos de envio, publicação, recebimento e listeners.
+
+Uso: ``python -m benchmarks [cenário ...] [--broker auto|rabbitmq|memory]``.
+Sem RabbitMQ local, os cenários rodam sobre o broker em memória (``in_memory_broker``).
+Os resultados são salvos em JSON para comparação entre commits (``--compare``).
+"""
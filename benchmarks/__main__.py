@@ -0,0 +1,41 @@
+import argparse
+import json
+
+from benchmarks.runner import run_benchmarks, save_results, compare_results
+from benchmarks.scenarios import SCENARIOS, DEFAULT_MESSAGES, DEFAULT_SUBSCRIBERS, DEFAULT_USERS
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                     description="Benchmarks de envio, publicação, recebimento e listeners do MOM")
+    parser.add_argument('scenarios', nargs='*', metavar='cenário',
+                        help=f"cenários a executar (padrão: todos): {', '.join(SCENARIOS)}")
+    parser.add_argument('--broker', choices=('auto', 'rabbitmq', 'memory'), default='auto',
+                        help="RabbitMQ local, broker em memória ou auto (padrão)")
+    parser.add_argument('--messages', type=int, default=DEFAULT_MESSAGES, help="mensagens por cenário")
+    parser.add_argument('--subscribers', type=int, default=DEFAULT_SUBSCRIBERS, help="assinantes no fanout")
+    parser.add_argument('--users', type=int, default=DEFAULT_USERS, help="pares no cenário concorrente")
+    parser.add_argument('--payload-sizes', default='64,1024,65536', help="tamanhos (bytes) separados por vírgula")
+    parser.add_argument('--output', help="arquivo JSON de saída (padrão: benchmarks/results/)")
+    parser.add_argument('--compare', help="relatório JSON anterior para comparação")
+    args = parser.parse_args()
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"cenário(s) desconhecido(s): {', '.join(unknown)} (opções: {', '.join(SCENARIOS)})")
+
+    report = run_benchmarks(
+        args.scenarios or None,
+        mode=args.broker,
+        messages=args.messages,
+        subscribers=args.subscribers,
+        users=args.users,
+        payload_sizes=tuple(int(size) for size in args.payload_sizes.split(',')),
+    )
+    print(f"Resultados salvos em {save_results(report, args.output)}")
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare_results(json.load(baseline), report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+import multiprocessing
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from contextlib import redirect_stdout
+
+from broker_manager import BrokerManager
+from user_application import UserApplication
+from message_utils import configure_transport, get_transport, declaration_cache
+from metrics import Histogram
+from benchmarks.scenarios import percentile
+
+DEFAULT_LOAD_USERS = 10  # Usuários simulados
+DEFAULT_LOAD_RATE = 500.0  # Mensagens por segundo, somando todos os workers
+DEFAULT_LOAD_DURATION = 10.0  # Segundos de envio
+DEFAULT_LOAD_WORKERS = 4  # Threads (ou processos) que enviam e recebem
+DEFAULT_TOPIC_RATIO = 0.2  # Fração das mensagens publicadas no tópico (o resto é envio direto)
+DEFAULT_LOAD_PAYLOAD = 64  # Bytes de conteúdo por mensagem
+DEFAULT_REPORT_INTERVAL = 1.0  # Segundos entre as linhas de progresso
+DEFAULT_DRAIN_TIME = 2.0  # Segundos recebendo após o fim dos envios
+MAX_CATCH_UP = 1.0  # Atraso máximo (s) recuperado em rajada quando o envio fica para trás
+FLUSH_INTERVAL = 0.1  # Segundos entre os relatórios parciais de cada worker ao agregador
+
+
+def load_routing_key(username):
+    """Chave de roteamento que entrega uma publicação no tópico de carga só a ``username``"""
+    return f"load.{username}"
+
+
+def _load_worker(index, usernames, all_usernames, topic, rate, topic_ratio, payload_size,
+                 duration, drain, reports, stop, transport=None):
+    """Simula ``usernames``: cada um ouve a sua fila e envia em rodízio, a ``rate`` msg/s no total.
+
+    Cada mensagem vai a outro usuário sorteado entre todos, direto na fila
+    dele ou pelo tópico (com a chave que só ele assina), na proporção
+    ``topic_ratio``. A cada ``FLUSH_INTERVAL`` segundos um relatório parcial
+    vai para ``reports``; o último tem ``done=True``. Em um processo separado,
+    ``transport`` é o nome do transporte a configurar.
+    """
+    if transport is not None:
+        configure_transport(transport)
+        sys.stdout = open(os.devnull, 'w')  # Processo próprio: silencia os prints por mensagem
+    declaration_cache.remember_exchange(topic, 'topic')
+    lock = threading.Lock()
+    counters = {'sent': 0, 'received': 0, 'errors': 0, 'latencies': []}
+
+    def handler(message_data):
+        latency = time.time() - message_data['timestamp']
+        with lock:
+            counters['received'] += 1
+            counters['latencies'].append(latency)
+
+    def report(done=False):
+        with lock:
+            partial = dict(counters, worker=index, done=done)
+            counters.update(sent=0, received=0, errors=0, latencies=[])
+        reports.put(partial)
+
+    payload = 'x' * payload_size
+    rng = random.Random(index)
+    apps = [UserApplication(username) for username in usernames]
+    for app in apps:
+        app.start_queue_listener(handler=handler)
+    try:
+        start = next_send = time.monotonic()
+        next_report = start + FLUSH_INTERVAL
+        deadline = start + duration
+        sent = 0
+        while not stop.is_set():
+            now = time.monotonic()
+            if now >= next_report:
+                report()
+                next_report += FLUSH_INTERVAL
+            if now >= deadline:
+                break
+            if now < next_send:
+                time.sleep(min(next_send, next_report, deadline) - now)
+                continue
+            app = apps[sent % len(apps)]
+            target = rng.choice(all_usernames)
+            while target == app.username and len(all_usernames) > 1:
+                target = rng.choice(all_usernames)  # As próprias publicações seriam descartadas
+            if rng.random() < topic_ratio:
+                ok = app.publish_message_to_topic(topic, payload, load_routing_key(target))
+            else:
+                ok = app.send_message_to_user(target, payload)
+            sent += 1
+            with lock:
+                counters['sent' if ok else 'errors'] += 1
+            next_send = max(next_send + 1.0 / rate, now - MAX_CATCH_UP)
+        drain_until = time.monotonic() + drain
+        while not stop.is_set() and time.monotonic() < drain_until:
+            time.sleep(min(FLUSH_INTERVAL, max(0.0, drain_until - time.monotonic())))
+            report()
+    finally:
+        for app in apps:
+            app.stop_listeners()
+    report(done=True)
+
+
+class LoadGenerator:
+    """Gera carga com usuários simulados e mostra vazão e latência ao vivo.
+
+    Cria ``users`` usuários temporários (``load_<execução>_<i>``) e um tópico
+    ``topic`` em que cada um assina só a própria chave, divididos entre
+    ``workers`` threads ou, com ``processes=True``, processos (necessário
+    para passar do limite do GIL; não funciona com o broker em memória,
+    que é do processo). Ao final remove tudo o que criou.
+    """
+
+    def __init__(self, users=DEFAULT_LOAD_USERS, rate=DEFAULT_LOAD_RATE, duration=DEFAULT_LOAD_DURATION,
+                 workers=DEFAULT_LOAD_WORKERS, processes=False, topic_ratio=DEFAULT_TOPIC_RATIO,
+                 payload_size=DEFAULT_LOAD_PAYLOAD, interval=DEFAULT_REPORT_INTERVAL,
+                 drain=DEFAULT_DRAIN_TIME, output=None):
+        if users < 1 or rate <= 0 or duration <= 0:
+            raise ValueError("users, rate e duration devem ser positivos.")
+        if not 0 <= topic_ratio <= 1:
+            raise ValueError("topic_ratio deve estar entre 0 e 1.")
+        if processes and get_transport().name == 'memory':
+            raise ValueError("O broker em memória não é compartilhado entre processos: use threads.")
+        self.run_id = uuid.uuid4().hex[:6]
+        self.usernames = [f"load_{self.run_id}_{i}" for i in range(users)]
+        self.topic = f"load_{self.run_id}"
+        self.rate = rate
+        self.duration = duration
+        self.workers = max(1, min(workers, users))
+        self.processes = processes
+        self.topic_ratio = topic_ratio
+        self.payload_size = payload_size
+        self.interval = interval
+        self.drain = drain
+        self.output = output or sys.stdout
+        self.latency = Histogram()
+        self.totals = {'sent': 0, 'received': 0, 'errors': 0}
+
+    def _print(self, line):
+        print(line, file=self.output, flush=True)
+
+    def setup(self, broker_manager):
+        broker_manager.create_users(self.usernames)
+        broker_manager.add_topic(self.topic, 'topic')
+        for username in self.usernames:
+            broker_manager.subscribe_user_to_topic(username, self.topic, load_routing_key(username))
+
+    def cleanup(self, broker_manager):
+        broker_manager.remove_topic(self.topic)
+        for username in self.usernames:
+            broker_manager.remove_user(username)
+
+    def _spawn(self, reports, stop):
+        if self.processes:
+            context = multiprocessing.get_context('spawn')  # Sem herdar conexões abertas do pai
+            reports, stop = context.Queue(), context.Event()
+            start, transport = context.Process, get_transport().name
+        else:
+            start, transport = threading.Thread, None
+        workers = []
+        for index in range(self.workers):
+            worker = start(target=_load_worker, daemon=True, args=(
+                index, self.usernames[index::self.workers], self.usernames, self.topic,
+                self.rate / self.workers, self.topic_ratio, self.payload_size, self.duration,
+                self.drain, reports, stop, transport))
+            worker.start()
+            workers.append(worker)
+        return workers, reports, stop
+
+    def _collect(self, reports, workers, stop):
+        """Agrega os relatórios dos workers e imprime uma linha a cada ``interval`` segundos"""
+        started = window_start = time.monotonic()
+        running = len(workers)
+        window = {'sent': 0, 'received': 0, 'errors': 0, 'latencies': []}
+        timeout = self.duration + self.drain + 30.0
+        while running:
+            try:
+                partial = reports.get(timeout=FLUSH_INTERVAL)
+            except queue.Empty:
+                partial = None
+            if partial is not None:
+                for key in ('sent', 'received', 'errors'):
+                    window[key] += partial[key]
+                    self.totals[key] += partial[key]
+                window['latencies'].extend(partial['latencies'])
+                for latency in partial['latencies']:
+                    self.latency.observe(latency)
+                running -= partial['done']
+            now = time.monotonic()
+            finished = not running and (window['sent'] or window['received'])
+            if now - window_start >= self.interval or finished:
+                self._print_interval(now - started, now - window_start, window)
+                window = {'sent': 0, 'received': 0, 'errors': 0, 'latencies': []}
+                window_start = now
+            if now - started > timeout:
+                stop.set()
+                self._print("Workers não terminaram a tempo; interrompendo.")
+                break
+
+    def _print_interval(self, elapsed, seconds, window):
+        seconds = max(seconds, 1e-9)
+        latencies = window['latencies']
+        self._print(f"{elapsed:7.1f}s  enviadas {window['sent'] / seconds:9.0f} msg/s  "
+                    f"recebidas {window['received'] / seconds:9.0f} msg/s  "
+                    f"p50 {percentile(latencies, 0.5) * 1000:8.2f}ms  "
+                    f"p99 {percentile(latencies, 0.99) * 1000:8.2f}ms  erros {window['errors']}")
+    def run(self, broker_manager=None):
+        """Executa a carga e retorna o resumo (totais, vazão e latências em ms)"""
+        broker_manager = broker_manager or BrokerManager()
+        mode = 'processos' if self.processes else 'threads'
+        self._print(f"Carga {self.run_id}: {len(self.usernames)} usuários em {self.workers} {mode}, "
+                    f"{self.rate:.0f} msg/s por {self.duration:.0f}s, "
+                    f"{self.topic_ratio:.0%} no tópico, {self.payload_size}B")
+        # Os prints por mensagem dos usuários simulados vão para o devnull; o progresso, para ``output``
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            self.setup(broker_manager)
+            stop = threading.Event()
+            workers = []
+            started = time.monotonic()
+            try:
+                workers, reports, stop = self._spawn(queue.Queue(), stop)
+                self._collect(reports, workers, stop)
+            except KeyboardInterrupt:
+                self._print("Interrompido; aguardando os workers.")
+            finally:
+                stop.set()
+                for worker in workers:
+                    worker.join(timeout=self.drain + 5.0)
+                elapsed = time.monotonic() - started
+                self.cleanup(broker_manager)
+        sending = max(min(elapsed, self.duration), 1e-9)
+        summary = dict(self.totals, seconds=elapsed,
+                       sent_per_second=self.totals['sent'] / sending,
+                       received_per_second=self.totals['received'] / sending,
+                       latency_ms={key: value * 1000 for key, value in self.latency.snapshot().items()
+                                   if key != 'count'})
+        latency = summary['latency_ms']
+        self._print(f"Total: {summary['sent']} enviadas, {summary['received']} recebidas, "
+                    f"{summary['errors']} erros em {elapsed:.1f}s "
+                    f"({summary['sent_per_second']:.0f} msg/s); latência p50 {latency['p50']:.2f}ms "
+                    f"p90 {latency['p90']:.2f}ms p99 {latency['p99']:.2f}ms máx {latency['max']:.2f}ms")
+        return summary
+
+
+def run_loadgen(broker_manager=None, **options):
+    """Atalho: ``run_loadgen(users=50, rate=2000, duration=30, processes=True)``"""
+    return LoadGenerator(**options).run(broker_manager)
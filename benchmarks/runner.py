@@ -0,0 +1,108 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from message_utils import PikaTransport, InMemoryTransport, configure_transport
+from listener_manager import configure_listener_manager, shutdown_listener_manager
+from in_memory_broker import InMemoryBroker
+from benchmarks.scenarios import Scenarios, SCENARIOS
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def setup_broker(mode='auto'):
+    """Configura o transporte para ``'rabbitmq'``, ``'memory'`` ou ``'auto'``.
+
+    No modo ``auto`` usa o RabbitMQ local se ele aceitar conexões e, caso
+    contrário, um broker em memória novo. Retorna o nome do transporte.
+    """
+    if mode in ('auto', 'rabbitmq'):
+        transport = PikaTransport()
+        try:
+            transport.connect().close()
+        except Exception as e:
+            if mode == 'rabbitmq':
+                raise
+            print(f"RabbitMQ indisponível ({e.__class__.__name__}); usando o broker em memória.")
+        else:
+            configure_transport(transport)
+            configure_listener_manager()
+            return transport.name
+
+    # Um broker novo por execução: os cenários não herdam filas de outras execuções
+    transport = configure_transport(InMemoryTransport(InMemoryBroker()))
+    configure_listener_manager()
+    return transport.name
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(RESULTS_DIR), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(names=None, mode='auto', **options):
+    """Executa os cenários ``names`` (padrão: todos) e retorna o relatório"""
+    broker = setup_broker(mode)
+    scenarios = Scenarios(**options)
+    results = []
+    try:
+        for name in names or SCENARIOS:
+            for result in SCENARIOS[name](scenarios):
+                results.append(result)
+                print_result(result)
+    finally:
+        scenarios.cleanup()
+        shutdown_listener_manager()
+    return {
+        'commit': _git_commit(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'broker': broker,
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'options': options,
+        'results': results,
+    }
+
+def print_result(result):
+    status = f"ERRO: {result['error']}" if result['error'] else ''
+    print(f"{result['scenario']:<18} {result['params'].get('payload_size', ''):>6}B "
+          f"{result['messages']:>7} msgs {result['throughput_msg_s']:>10.0f} msg/s "
+          f"p50 {result['latency_p50_ms']:>8.2f}ms p99 {result['latency_p99_ms']:>8.2f}ms "
+          f"CPU {result['cpu_percent']:>5.0f}% RSS {result['rss_kb'] or 0:>7}KB {status}")
+
+def save_results(report, path=None):
+    """Salva o relatório em JSON (padrão: ``benchmarks/results/<data>-<commit>.json``)"""
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = report['created_at'].replace(':', '').replace('-', '')
+        path = os.path.join(RESULTS_DIR, f"{stamp}-{report['commit'] or 'local'}-{report['broker']}.json")
+    with open(path, 'w') as output:
+        json.dump(report, output, indent=2, sort_keys=True)
+    return path
+
+def _result_key(result):
+    # O número de mensagens não entra na chave: execuções curtas e longas são comparáveis
+    params = {key: value for key, value in result['params'].items() if key != 'messages'}
+    return (result['scenario'],) + tuple(sorted(params.items()))
+
+def compare_results(baseline, current):
+    """Compara dois relatórios cenário a cenário (razão de throughput e de p99)"""
+    previous = {_result_key(result): result for result in baseline['results']}
+    print(f"Comparação: {baseline.get('commit')} ({baseline.get('broker')}) -> "
+          f"{current.get('commit')} ({current.get('broker')})")
+    comparison = []
+    for result in current['results']:
+        old = previous.get(_result_key(result))
+        if old is None or not old['throughput_msg_s'] or not old['latency_p99_ms']:
+            continue
+        throughput = result['throughput_msg_s'] / old['throughput_msg_s']
+        p99 = result['latency_p99_ms'] / old['latency_p99_ms']
+        comparison.append({'scenario': result['scenario'], 'params': result['params'],
+                           'throughput_ratio': throughput, 'p99_ratio': p99})
+        print(f"  {result['scenario']:<18} {result['params'].get('payload_size', ''):>6}B "
+              f"throughput x{throughput:.2f}  p99 x{p99:.2f}")
+    return comparison
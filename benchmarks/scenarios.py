@@ -0,0 +1,281 @@
+import gc
+import os
+import threading
+import time
+import uuid
+from contextlib import redirect_stdout
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from broker_manager import BrokerManager
+from user_application import UserApplication
+
+DEFAULT_MESSAGES = 2000  # Mensagens por cenário
+DEFAULT_PAYLOAD_SIZES = (64, 1024, 65536)  # Bytes por mensagem no cenário de tamanhos
+DEFAULT_SUBSCRIBERS = 4  # Assinantes no cenário de fanout
+DEFAULT_USERS = 4  # Pares remetente/destinatário no cenário concorrente
+RECEIVE_TIMEOUT = 30.0  # Segundos sem mensagens antes de desistir de um cenário
+
+
+def percentile(values, fraction):
+    """Percentil exato (interpolação linear) de uma lista de valores"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def current_rss_kb():
+    """RSS atual do processo em KB (None se indisponível)"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def max_rss_kb():
+    """Pico de RSS do processo em KB (None se indisponível)"""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Sample:
+    """Mensagens, bytes e latências fim a fim coletados durante um cenário"""
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+        self.latencies = []
+        self._lock = threading.Lock()
+
+    def record(self, message_data, size):
+        latency = time.time() - message_data['timestamp']
+        with self._lock:
+            self.messages += 1
+            self.bytes += size
+            self.latencies.append(latency)
+
+
+class Scenarios:
+    """Cenários de produtor/consumidor sobre a API pública do MOM.
+
+    Cada cenário cria usuários, filas e tópicos com nomes únicos, mede o
+    tempo de parede, a CPU do processo e a memória, e remove o que criou.
+    A saída das aplicações (um ``print`` por mensagem) é descartada durante
+    a medição, mas o custo de formatá-la faz parte do caminho medido.
+    """
+
+    def __init__(self, messages=DEFAULT_MESSAGES, payload_sizes=DEFAULT_PAYLOAD_SIZES,
+                 subscribers=DEFAULT_SUBSCRIBERS, users=DEFAULT_USERS):
+        self.messages = messages
+        self.payload_sizes = payload_sizes
+        self.subscribers = subscribers
+        self.users = users
+        self.broker_manager = BrokerManager()
+        self._created_users = []
+        self._created_topics = []
+
+    # Infraestrutura
+
+    def _name(self, prefix):
+        return f"bench_{prefix}_{uuid.uuid4().hex[:8]}"
+
+    def _create_users(self, count, prefix):
+        names = [self._name(prefix) for _ in range(count)]
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            self.broker_manager.create_users(names)
+        self._created_users.extend(names)
+        return [UserApplication(name, self.broker_manager) for name in names]
+
+    def _create_topic(self):
+        topic_name = self._name('topic')
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            self.broker_manager.add_topic(topic_name)
+        self._created_topics.append(topic_name)
+        return topic_name
+
+    def cleanup(self):
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            for username in self._created_users:
+                self.broker_manager.remove_user(username)
+            for topic_name in self._created_topics:
+                self.broker_manager.remove_topic(topic_name)
+        self._created_users.clear()
+        self._created_topics.clear()
+
+    def _measure(self, name, params, run):
+        """Executa ``run(sample)`` e devolve o resultado do cenário"""
+        gc.collect()
+        sample = Sample()
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            cpu_start = time.process_time()
+            start = time.perf_counter()
+            try:
+                run(sample)
+                error = None
+            except Exception as e:
+                error = str(e)
+            elapsed = time.perf_counter() - start
+            cpu = time.process_time() - cpu_start
+        self.cleanup()
+        return {
+            'scenario': name,
+            'params': params,
+            'messages': sample.messages,
+            'bytes': sample.bytes,
+            'elapsed_s': elapsed,
+            'throughput_msg_s': sample.messages / elapsed if elapsed > 0 else 0.0,
+            'throughput_mb_s': sample.bytes / elapsed / 1e6 if elapsed > 0 else 0.0,
+            'latency_p50_ms': percentile(sample.latencies, 0.50) * 1000,
+            'latency_p99_ms': percentile(sample.latencies, 0.99) * 1000,
+            'cpu_s': cpu,
+            'cpu_percent': 100.0 * cpu / elapsed if elapsed > 0 else 0.0,
+            'rss_kb': current_rss_kb(),
+            'max_rss_kb': max_rss_kb(),
+            'error': error,
+        }
+
+    def _consume(self, user_app, expected, sample, payload_size):
+        """Consome ``expected`` mensagens da fila do usuário num único canal"""
+        received = 0
+        for message_data in user_app.iter_messages(inactivity_timeout=RECEIVE_TIMEOUT,
+                                                   max_messages=expected):
+            sample.record(message_data, payload_size)
+            received += 1
+        if received < expected:
+            raise TimeoutError(f"{received}/{expected} mensagens recebidas por {user_app.username}")
+
+    def _run_threads(self, targets):
+        errors = []
+
+        def guard(target):
+            try:
+                target()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=guard, args=(target,), daemon=True) for target in targets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    # Cenários
+
+    def queue_1to1(self, payload_size=64):
+        """Um remetente envia com ``send_message_to_user`` enquanto o destinatário consome"""
+        def run(sample):
+            sender, receiver = self._create_users(2, 'queue')
+            payload = 'x' * payload_size
+            self._run_threads([
+                lambda: [sender.send_message_to_user(receiver.username, payload)
+                         for _ in range(self.messages)],
+                lambda: self._consume(receiver, self.messages, sample, payload_size),
+            ])
+        return self._measure('queue_1to1', {'messages': self.messages, 'payload_size': payload_size}, run)
+
+    def queue_basic_get(self, payload_size=64):
+        """Esvazia com ``receive_message_from_queue`` (um basic_get por mensagem) uma fila pré-carregada"""
+        sender, receiver = self._create_users(2, 'get')
+        payload = 'x' * payload_size
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            sender.send_messages_to_user(receiver.username, [payload] * self.messages)
+
+        def run(sample):
+            for _ in range(self.messages):
+                message_data = receiver.receive_message_from_queue(receiver.user_queue)
+                if message_data is None:
+                    raise TimeoutError("Fila esvaziada antes do esperado")
+                sample.record(message_data, payload_size)
+        return self._measure('queue_basic_get', {'messages': self.messages, 'payload_size': payload_size}, run)
+
+    def batch_send(self, payload_size=64):
+        """Envia um lote com confirmações do broker (``send_messages_to_user``) enquanto o destinatário consome"""
+        def run(sample):
+            sender, receiver = self._create_users(2, 'batch')
+            payload = 'x' * payload_size
+            self._run_threads([
+                lambda: sender.send_messages_to_user(receiver.username, [payload] * self.messages),
+                lambda: self._consume(receiver, self.messages, sample, payload_size),
+            ])
+        return self._measure('batch_send', {'messages': self.messages, 'payload_size': payload_size}, run)
+
+    def topic_fanout(self, payload_size=64):
+        """Um publicador em ``publish_message_to_topic`` e N assinantes consumindo suas filas"""
+        def run(sample):
+            publisher, *subscribers = self._create_users(self.subscribers + 1, 'fanout')
+            topic_name = self._create_topic()
+            for subscriber in subscribers:
+                subscriber.subscribe_to_topic(topic_name)
+            payload = 'x' * payload_size
+            self._run_threads(
+                [lambda: [publisher.publish_message_to_topic(topic_name, payload)
+                          for _ in range(self.messages)]] +
+                [lambda subscriber=subscriber: self._consume(subscriber, self.messages, sample, payload_size)
+                 for subscriber in subscribers]
+            )
+        return self._measure('topic_fanout', {'messages': self.messages, 'payload_size': payload_size,
+                                              'subscribers': self.subscribers}, run)
+
+    def concurrent_users(self, payload_size=64):
+        """N pares remetente/destinatário trocando mensagens ao mesmo tempo"""
+        per_user = max(1, self.messages // self.users)
+
+        def run(sample):
+            senders = self._create_users(self.users, 'csend')
+            receivers = self._create_users(self.users, 'crecv')
+            payload = 'x' * payload_size
+            targets = []
+            for sender, receiver in zip(senders, receivers):
+                targets.append(lambda sender=sender, receiver=receiver: [
+                    sender.send_message_to_user(receiver.username, payload) for _ in range(per_user)])
+                targets.append(lambda receiver=receiver: self._consume(receiver, per_user, sample, payload_size))
+            self._run_threads(targets)
+        return self._measure('concurrent_users', {'messages': per_user * self.users,
+                                                  'payload_size': payload_size, 'users': self.users}, run)
+
+    def queue_listener(self, payload_size=64):
+        """Um remetente envia enquanto o listener do destinatário processa num handler"""
+        def run(sample):
+            sender, receiver = self._create_users(2, 'listener')
+            done = threading.Event()
+
+            def handler(message_data):
+                sample.record(message_data, payload_size)
+                if sample.messages >= self.messages:
+                    done.set()
+
+            if receiver.start_queue_listener(handler=handler) is None:
+                raise RuntimeError("Listener não iniciado")
+            try:
+                payload = 'x' * payload_size
+                for _ in range(self.messages):
+                    sender.send_message_to_user(receiver.username, payload)
+                if not done.wait(RECEIVE_TIMEOUT):
+                    raise TimeoutError(f"{sample.messages}/{self.messages} mensagens processadas pelo listener")
+            finally:
+                receiver.stop_listeners()
+        return self._measure('queue_listener', {'messages': self.messages, 'payload_size': payload_size}, run)
+
+    def payload_sizes_1to1(self):
+        """``queue_1to1`` com cada tamanho de mensagem"""
+        return [self.queue_1to1(payload_size) for payload_size in self.payload_sizes]
+
+
+SCENARIOS = {
+    'queue_1to1': lambda scenarios: [scenarios.queue_1to1()],
+    'queue_basic_get': lambda scenarios: [scenarios.queue_basic_get()],
+    'batch_send': lambda scenarios: [scenarios.batch_send()],
+    'topic_fanout': lambda scenarios: [scenarios.topic_fanout()],
+    'concurrent_users': lambda scenarios: [scenarios.concurrent_users()],
+    'queue_listener': lambda scenarios: [scenarios.queue_listener()],
+    'payload_sizes': lambda scenarios: scenarios.payload_sizes_1to1(),
+}
@@ -1,170 +1,731 @@
-import pika
 import json
-from message_utils import get_rabbitmq_connection, close_rabbitmq_connection
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from message_utils import (
+    pooled_channel, get_channel_pool, declaration_cache, bind_queue, unbind_queue,
+    headers_binding_arguments, queue_arguments, DEFAULT_CONFIRM_WINDOW
+)
+from subscription_registry import InMemoryRegistry
+from metrics import metrics
+from broker_monitor import (
+    QueueMonitor, collect_broker_stats, DEFAULT_MONITOR_INTERVAL, DEFAULT_MONITOR_HISTORY
+)
+from topic_history import (
+    history_queue_name, history_binding, history_queue_arguments, DEFAULT_HISTORY_BYTES
+)
+from sharding import (
+    ShardedQueue, register_sharded_queue, unregister_sharded_queue, get_sharded_queue,
+    list_sharded_queues, get_endpoint_pool, DEFAULT_SHARDS, SHARD_KEY_HEADER
+)
 
-class BrokerManager:
-    def __init__(self):
-        self.users = {}  # Dicionário para armazenar usuários
-        self.queues = set()  # Conjunto de filas
-        self.topics = set()  # Conjunto de tópicos
-        
-    def add_queue(self, queue_name):
-        """Adiciona uma nova fila"""
-        try:
-            connection = get_rabbitmq_connection()
-            channel = connection.channel()
-            channel.queue_declare(queue=queue_name, durable=True)
-            self.queues.add(queue_name)
-            close_rabbitmq_connection(connection)
-            print(f"Fila '{queue_name}' adicionada com sucesso.")
+DEFAULT_PROVISION_PARALLELISM = 4  # Canais usados em paralelo no provisionamento em lote
+EXCHANGE_TYPES = ('fanout', 'direct', 'topic', 'headers')  # Tipos aceitos para tópicos
+_UNKNOWN = object()  # Fila ainda não consultada no registro
+
+class RegistryQueries:
+    """Consultas ao registro de usuários, filas, tópicos e inscrições.
+
+    Base comum do BrokerManager e do AsyncBrokerManager: nada aqui fala com o
+    broker, então os métodos servem tanto ao cliente síncrono quanto ao asyncio.
+    """
+
+    def __init__(self, registry=None):
+        # Registro de usuários, filas, tópicos e inscrições (memória ou SQLite)
+        self.registry = registry or InMemoryRegistry()
+        self._queue_arguments = {}  # fila -> argumentos do registro (None se desconhecida), memorizados
+        self._queue_arguments_lock = threading.Lock()
+    
+    @property
+    def users(self):
+        """Cópia dos usuários no formato antigo ``{nome: {'queue', 'subscribed_topics'}}``"""
+        return {username: {'queue': queue_name,
+                           'subscribed_topics': set(self.registry.topics_of(username))}
+                for username, queue_name in self.registry.iter_users()}
+    
+    @property
+    def queues(self):
+        """Conjunto das filas registradas"""
+        return {queue_name for queue_name, _ in self.registry.iter_queues()}
+    
+    @property
+    def topics(self):
+        """Conjunto dos tópicos registrados"""
+        return {topic_name for topic_name, _ in self.registry.iter_topics()}
+    
+    def has_user(self, username):
+        return self.registry.has_user(username)
+    
+    def has_queue(self, queue_name):
+        return self.registry.has_queue(queue_name)
+    
+    def has_topic(self, topic_name):
+        return self.registry.has_topic(topic_name)
+    
+    def has_topic_history(self, topic_name):
+        """Indica se o tópico retém histórico (fila stream registrada)"""
+        return self.registry.has_queue(history_queue_name(topic_name))
+    
+    def get_queue_arguments(self, queue_name):
+        """Argumentos com que a fila foi criada (None se desconhecida), memorizados por fila.
+
+        Remetentes e consumidores consultam a cada mensagem; com o
+        SQLiteRegistry seria uma consulta SQL por mensagem. A memória de uma
+        fila é descartada quando ela é adicionada ou removida por este
+        gerenciador.
+        """
+        arguments = self._queue_arguments.get(queue_name, _UNKNOWN)
+        if arguments is _UNKNOWN:
+            with self._queue_arguments_lock:
+                if queue_name not in self._queue_arguments:
+                    self._queue_arguments[queue_name] = self.registry.get_queue_arguments(queue_name)
+                arguments = self._queue_arguments[queue_name]
+        return arguments
+    
+    def _forget_queue_arguments(self, *queue_names):
+        with self._queue_arguments_lock:
+            for queue_name in queue_names:
+                self._queue_arguments.pop(queue_name, None)
+    
+    def get_topic_type(self, topic_name):
+        """Obtém o tipo do exchange de um tópico (None se não estiver registrado)"""
+        return self.registry.get_topic_type(topic_name)
+    
+    def list_users(self):
+        """Lista todos os usuários"""
+        print("Usuários registrados:")
+        usernames = []
+        for username, user_queue in self.registry.iter_users():
+            print(f"  - {username} (fila: {user_queue})")
+            usernames.append(username)
+        return usernames
+    
+    def get_user_queue(self, username):
+        """Obtém a fila de um usuário"""
+        return self.registry.get_user_queue(username)
+    
+    def get_user_subscribed_topics(self, username):
+        """Obtém os tópicos inscritos por um usuário"""
+        return self.registry.topics_of(username)
+    
+    def get_topic_subscribers(self, topic_name):
+        """Obtém os usuários inscritos em um tópico (consulta indexada)"""
+        return self.registry.subscribers_of(topic_name)
+    
+    def get_metrics(self):
+        """Histogramas e contadores do processo (publicações, recebimentos, listeners e operações)"""
+        return metrics.snapshot()
+    
+    def export_metrics(self):
+        """Métricas do processo no formato texto do Prometheus"""
+        return metrics.to_prometheus()
+
+class BrokerManager(RegistryQueries):
+    def __init__(self, registry=None, warm_start=True):
+        super().__init__(registry)
+        self.monitor = None  # QueueMonitor criado por start_monitoring/snapshot
+        if warm_start and self.registry.persistent:
+            self.warm_start()
+    
+    def warm_start(self):
+        """Carrega filas e tópicos persistidos no cache de declarações, sem redeclará-los.
+
+        O registro é lido em páginas; se algum recurso tiver sido apagado no
+        broker, o erro NOT_FOUND no primeiro uso invalida o cache e o redeclara.
+        """
+        queues = topics = 0
+        for queue_name, arguments in self.registry.iter_queues():
+            declaration_cache.remember_queue(queue_name, arguments)
+            queues += 1
+        for topic_name, exchange_type in self.registry.iter_topics():
+            declaration_cache.remember_exchange(topic_name, exchange_type)
+            topics += 1
+        print(f"Registro carregado: {queues} filas e {topics} tópicos.")
+    
+    def add_queue(self, queue_name, **policy):
+        """Adiciona uma nova fila.
+
+        ``policy`` aceita as opções de ``queue_arguments`` (``max_length``,
+        ``max_length_bytes``, ``overflow``, ``message_ttl``, ``dead_letter_exchange``,
+        ``dead_letter_routing_key``, ``queue_type``, ``lazy``, ``max_priority``).
+        Os argumentos ficam no registro e são usados por quem declara a fila
+        depois. O RabbitMQ não altera os argumentos de uma fila existente:
+        redeclará-la com outros falha com PRECONDITION_FAILED.
+        """
+        try:
+            arguments = queue_arguments(**policy)
+            with metrics.timer('mom_roundtrip_seconds', operation='add_queue'), pooled_channel() as channel:
+                declaration_cache.declare_queue(channel, queue_name, arguments=arguments, force=True)
+            self.registry.add_queue(queue_name, arguments)
+            self._forget_queue_arguments(queue_name)
+            if arguments:
+                print(f"Fila '{queue_name}' adicionada com sucesso ({arguments}).")
+            else:
+                print(f"Fila '{queue_name}' adicionada com sucesso.")
             return True
         except Exception as e:
             print(f"Erro ao adicionar fila '{queue_name}': {e}")
             return False
     
+    def add_queues(self, queue_names, parallelism=DEFAULT_PROVISION_PARALLELISM, verbose=True, **policy):
+        """Adiciona várias filas (com as mesmas políticas) em paralelo e retorna um relatório por fila"""
+        try:
+            arguments = queue_arguments(**policy)
+        except (TypeError, ValueError) as e:
+            report = {name: {'ok': False, 'error': f"política inválida: {e}"} for name in dict.fromkeys(queue_names)}
+            if verbose:
+                self._print_report("Filas", report)
+            return report
+        report = self._provision(
+            queue_names,
+            lambda channel, queue_name: declaration_cache.declare_queue(
+                channel, queue_name, arguments=arguments, force=True),
+            parallelism,
+            'add_queue'
+        )
+        self.registry.add_queues([(name, arguments) for name, result in report.items() if result['ok']])
+        self._forget_queue_arguments(*report)
+        if verbose:
+            self._print_report("Filas", report)
+        return report
+    
     def remove_queue(self, queue_name):
         """Remove uma fila"""
         try:
-            connection = get_rabbitmq_connection()
-            channel = connection.channel()
-            channel.queue_delete(queue=queue_name)
-            self.queues.discard(queue_name)
-            close_rabbitmq_connection(connection)
+            with metrics.timer('mom_roundtrip_seconds', operation='remove_queue'), pooled_channel() as channel:
+                channel.queue_delete(queue=queue_name)
+            declaration_cache.forget_queue(queue_name)
+            self.registry.remove_queue(queue_name)
+            self._forget_queue_arguments(queue_name)
             print(f"Fila '{queue_name}' removida com sucesso.")
             return True
         except Exception as e:
             print(f"Erro ao remover fila '{queue_name}': {e}")
             return False
     
-    def add_topic(self, topic_name):
-        """Adiciona um novo tópico (exchange)"""
+    def add_topic(self, topic_name, exchange_type='fanout', history=False,
+                  history_max_bytes=DEFAULT_HISTORY_BYTES, history_max_age=None):
+        """Adiciona um novo tópico (exchange).
+
+        Com ``exchange_type='topic'`` os inscritos escolhem as mensagens por
+        chave de ligação (ex.: ``noticias.esporte.*``) e com ``'headers'`` por
+        cabeçalhos; o broker só entrega a cada fila o que casa com o binding.
+
+        Com ``history=True`` o tópico retém as mensagens publicadas numa fila
+        stream (``history_<tópico>``), um log com offsets limitado a
+        ``history_max_bytes`` e, se informado, ``history_max_age`` segundos.
+        Inscritos que chegam depois reproduzem o histórico com
+        ``UserApplication.start_topic_replay``/``read_topic_history``.
+        """
+        if exchange_type not in EXCHANGE_TYPES:
+            print(f"Tipo de exchange inválido para o tópico '{topic_name}': '{exchange_type}'.")
+            return False
+        binding = history_binding(exchange_type) if history else None
+        if history and binding is None:
+            print(f"Tópicos '{exchange_type}' não suportam histórico: '{topic_name}'.")
+            return False
         try:
-            connection = get_rabbitmq_connection()
-            channel = connection.channel()
-            channel.exchange_declare(exchange=topic_name, exchange_type='fanout', durable=True)
-            self.topics.add(topic_name)
-            close_rabbitmq_connection(connection)
-            print(f"Tópico '{topic_name}' adicionado com sucesso.")
+            if history:
+                history_queue = history_queue_name(topic_name)
+                arguments = history_queue_arguments(history_max_bytes, history_max_age)
+            with metrics.timer('mom_roundtrip_seconds', operation='add_topic'), pooled_channel() as channel:
+                declaration_cache.declare_exchange(channel, topic_name, exchange_type, force=True)
+            if history:
+                # Fila e binding do histórico antes do registro: uma falha aqui não deixa um tópico pela metade
+                try:
+                    with metrics.timer('mom_roundtrip_seconds', operation='add_queue'), pooled_channel() as channel:
+                        declaration_cache.declare_queue(channel, history_queue, arguments=arguments, force=True)
+                    bind_queue(history_queue, topic_name, exchange_type, *binding)
+                except Exception:
+                    self._discard_history_queue(history_queue)
+                    raise
+            self.registry.add_topic(topic_name, exchange_type)
+            if history:
+                self.registry.add_queue(history_queue, arguments)
+                self._forget_queue_arguments(history_queue)
+                print(f"Tópico '{topic_name}' adicionado com histórico em '{history_queue}'.")
+            else:
+                print(f"Tópico '{topic_name}' adicionado com sucesso.")
             return True
         except Exception as e:
             print(f"Erro ao adicionar tópico '{topic_name}': {e}")
             return False
     
+    def _discard_history_queue(self, history_queue):
+        """Remove a fila de histórico de um ``add_topic`` que falhou (melhor esforço)"""
+        declaration_cache.forget_queue(history_queue)
+        try:
+            with pooled_channel() as channel:
+                channel.queue_delete(queue=history_queue)
+        except Exception:
+            pass
+    
+    def add_topics(self, topic_names, exchange_type='fanout', parallelism=DEFAULT_PROVISION_PARALLELISM, verbose=True):
+        """Adiciona vários tópicos (do mesmo tipo) em paralelo e retorna um relatório por tópico"""
+        if exchange_type not in EXCHANGE_TYPES:
+            report = {name: {'ok': False, 'error': f"tipo de exchange inválido: '{exchange_type}'"}
+                      for name in dict.fromkeys(topic_names)}
+            if verbose:
+                self._print_report("Tópicos", report)
+            return report
+        report = self._provision(
+            topic_names,
+            lambda channel, topic_name: declaration_cache.declare_exchange(channel, topic_name, exchange_type, force=True),
+            parallelism,
+            'add_topic'
+        )
+        self.registry.add_topics([(name, exchange_type) for name, result in report.items() if result['ok']])
+        if verbose:
+            self._print_report("Tópicos", report)
+        return report
+    
     def remove_topic(self, topic_name):
-        """Remove um tópico (exchange)"""
+        """Remove um tópico (exchange) e o seu histórico, se houver"""
         try:
-            connection = get_rabbitmq_connection()
-            channel = connection.channel()
-            channel.exchange_delete(exchange=topic_name)
-            self.topics.discard(topic_name)
-            close_rabbitmq_connection(connection)
+            with metrics.timer('mom_roundtrip_seconds', operation='remove_topic'), pooled_channel() as channel:
+                channel.exchange_delete(exchange=topic_name)
+            declaration_cache.forget_exchange(topic_name)
+            self.registry.remove_topic(topic_name)
+            if self.has_topic_history(topic_name):
+                self.remove_queue(history_queue_name(topic_name))
             print(f"Tópico '{topic_name}' removido com sucesso.")
             return True
         except Exception as e:
             print(f"Erro ao remover tópico '{topic_name}': {e}")
             return False
     
-    def list_queues(self):
-        """Lista todas as filas"""
+    def list_queues(self, verify=False):
+        """Lista todas as filas; com ``verify=True`` mostra profundidade e consumidores no broker"""
+        queues = [queue_name for queue_name, _ in self.registry.iter_queues()]
+        stats = self._verify(queues, ())['queues'] if verify else {}
         print("Filas disponíveis:")
-        for queue in self.queues:
-            print(f"  - {queue}")
-        return list(self.queues)
+        for queue in queues:
+            if not verify:
+                print(f"  - {queue}")
+            elif stats.get(queue) is None:
+                print(f"  - {queue} (não encontrada no broker)")
+            else:
+                print(f"  - {queue} ({stats[queue]['messages']} mensagens, "
+                      f"{stats[queue]['consumers']} consumidores)")
+        return queues
     
-    def list_topics(self):
-        """Lista todos os tópicos"""
+    def list_topics(self, verify=False):
+        """Lista todos os tópicos; com ``verify=True`` confere se existem no broker"""
+        registered = list(self.registry.iter_topics())
+        found = self._verify((), [topic_name for topic_name, _ in registered])['topics'] if verify else {}
+        topics = []
         print("Tópicos disponíveis:")
-        for topic in self.topics:
-            print(f"  - {topic}")
-        return list(self.topics)
+        for topic_name, exchange_type in registered:
+            missing = " (não encontrado no broker)" if verify and not found.get(topic_name) else ""
+            print(f"  - {topic_name} ({exchange_type}){missing}")
+            topics.append(topic_name)
+        return topics
+    
+    def _verify(self, queue_names, topic_names):
+        try:
+            with metrics.timer('mom_roundtrip_seconds', operation='collect_stats'):
+                return collect_broker_stats(queue_names, topic_names)
+        except Exception as e:
+            print(f"Erro ao consultar o broker: {e}")
+            return {'queues': {}, 'topics': {}}
     
     def get_queue_message_count(self, queue_name):
         """Obtém a quantidade de mensagens em uma fila"""
         try:
-            connection = get_rabbitmq_connection()
-            channel = connection.channel()
-            method = channel.queue_declare(queue=queue_name, passive=True)
+            with metrics.timer('mom_roundtrip_seconds', operation='message_count'), pooled_channel() as channel:
+                method = channel.queue_declare(queue=queue_name, passive=True)
             message_count = method.method.message_count
-            close_rabbitmq_connection(connection)
             print(f"Fila '{queue_name}' tem {message_count} mensagens.")
             return message_count
         except Exception as e:
             print(f"Erro ao obter contagem de mensagens da fila '{queue_name}': {e}")
             return -1
     
-    def create_user(self, username):
-        """Cria um novo usuário e sua fila dedicada"""
-        if username in self.users:
+    def create_user(self, username, **policy):
+        """Cria um novo usuário e sua fila dedicada (com as políticas de ``add_queue``).
+
+        Ex.: ``create_user('ana', max_length=10000, overflow='reject-publish')``
+        impede que a fila de um usuário inativo cresça sem limite.
+        """
+        if self.registry.has_user(username):
             print(f"Usuário '{username}' já existe.")
             return False
         
         user_queue = f"user_{username}"
-        if self.add_queue(user_queue):
-            self.users[username] = {
-                'queue': user_queue,
-                'subscribed_topics': set()
-            }
+        if self.add_queue(user_queue, **policy):
+            self.registry.add_user(username, user_queue)
             print(f"Usuário '{username}' criado com fila dedicada '{user_queue}'.")
             return True
         else:
             print(f"Erro ao criar usuário '{username}'.")
             return False
     
+    def create_users(self, usernames, parallelism=DEFAULT_PROVISION_PARALLELISM, verbose=True, **policy):
+        """Cria vários usuários (e suas filas) em paralelo e retorna um relatório por usuário"""
+        usernames = list(dict.fromkeys(usernames))
+        try:
+            arguments = queue_arguments(**policy)
+        except (TypeError, ValueError) as e:
+            report = {username: {'ok': False, 'error': f"política inválida: {e}"} for username in usernames}
+            if verbose:
+                self._print_report("Usuários", report)
+            return report
+        report = {}
+        new_users = []
+        for username in usernames:
+            if self.registry.has_user(username):
+                report[username] = {'ok': False, 'error': 'usuário já existe'}
+            else:
+                new_users.append(username)
+        
+        queue_report = self._provision(
+            [f"user_{username}" for username in new_users],
+            lambda channel, queue_name: declaration_cache.declare_queue(
+                channel, queue_name, arguments=arguments, force=True),
+            parallelism,
+            'add_queue'
+        )
+        created = []
+        for username in new_users:
+            user_queue = f"user_{username}"
+            report[username] = queue_report[user_queue]
+            if queue_report[user_queue]['ok']:
+                created.append((username, user_queue))
+        self.registry.add_queues([(user_queue, arguments) for _, user_queue in created])
+        self._forget_queue_arguments(*queue_report)
+        self.registry.add_users(created)
+        if verbose:
+            self._print_report("Usuários", report)
+        return report
+    
+    def _provision(self, names, declare, parallelism, operation='provision'):
+        """Distribui as declarações entre alguns canais do pool, executados em paralelo.
+
+        Cada thread mantém o seu canal enquanto as declarações têm sucesso; se
+        o broker fechar o canal por um erro, ele é trocado por outro do pool.
+        """
+        names = list(dict.fromkeys(names))
+        if not names:
+            return {}
+        parallelism = max(1, min(parallelism, len(names)))
+        pool = get_channel_pool()
+        
+        def declare_chunk(chunk):
+            results = {}
+            pooled = None
+            try:
+                for name in chunk:
+                    try:
+                        if pooled is None:
+                            pooled = pool.acquire()
+                        with metrics.timer('mom_roundtrip_seconds', operation=operation):
+                            declare(pooled.channel, name)
+                        results[name] = {'ok': True, 'error': None}
+                    except Exception as e:
+                        results[name] = {'ok': False, 'error': str(e)}
+                        if pooled is not None:
+                            pool.release(pooled, discard=True)
+                            pooled = None
+            finally:
+                if pooled is not None:
+                    pool.release(pooled)
+            return results
+        
+        report = {}
+        chunks = [names[i::parallelism] for i in range(parallelism)]
+        with ThreadPoolExecutor(max_workers=parallelism) as executor:
+            for results in executor.map(declare_chunk, chunks):
+                report.update(results)
+        # Mantém a ordem de entrada no relatório
+        return {name: report[name] for name in names}
+    
+    def _print_report(self, description, report):
+        failed = {name: result['error'] for name, result in report.items() if not result['ok']}
+        print(f"{description}: {len(report) - len(failed)}/{len(report)} provisionados com sucesso.")
+        for name, error in failed.items():
+            print(f"  - Erro em '{name}': {error}")
+    
     def remove_user(self, username):
         """Remove um usuário e sua fila dedicada"""
-        if username not in self.users:
+        user_queue = self.registry.get_user_queue(username)
+        if user_queue is None:
             print(f"Usuário '{username}' não existe.")
             return False
         
-        user_queue = self.users[username]['queue']
         if self.remove_queue(user_queue):
-            del self.users[username]
+            self.registry.remove_user(username)
             print(f"Usuário '{username}' removido.")
             return True
         else:
             print(f"Erro ao remover usuário '{username}'.")
             return False
     
-    def list_users(self):
-        """Lista todos os usuários"""
-        print("Usuários registrados:")
-        for username, user_info in self.users.items():
-            print(f"  - {username} (fila: {user_info['queue']})")
-        return list(self.users.keys())
-    
-    def get_user_queue(self, username):
-        """Obtém a fila de um usuário"""
-        if username in self.users:
-            return self.users[username]['queue']
-        return None
-    
-    def subscribe_user_to_topic(self, username, topic_name):
-        """Inscreve um usuário em um tópico"""
-        if username not in self.users:
+    def subscribe_user_to_topic(self, username, topic_name, binding_key='', headers=None, match='all'):
+        """Inscreve um usuário em um tópico.
+
+        A inscrição é um binding durável do exchange do tópico para a fila do
+        usuário: as mensagens publicadas enquanto ele está offline ficam na fila.
+        ``binding_key`` (exchanges ``direct``/``topic``, aceita ``*`` e ``#``) e
+        ``headers``/``match`` (exchanges ``headers``) filtram no broker o que
+        chega à fila. Inscrever-se de novo substitui o binding anterior.
+        """
+        user_queue = self.registry.get_user_queue(username)
+        if user_queue is None:
             print(f"Usuário '{username}' não existe.")
             return False
         
-        if topic_name not in self.topics:
+        exchange_type = self.registry.get_topic_type(topic_name)
+        if exchange_type is None:
             print(f"Tópico '{topic_name}' não existe.")
             return False
         
-        self.users[username]['subscribed_topics'].add(topic_name)
+        try:
+            arguments = headers_binding_arguments(headers, match)
+            previous = self.registry.get_subscription(username, topic_name)
+            with metrics.timer('mom_roundtrip_seconds', operation='bind'):
+                bind_queue(user_queue, topic_name, exchange_type, binding_key, arguments)
+            if previous is not None and previous != (binding_key, arguments or {}):
+                # O novo binding já existe: remove o anterior sem perder mensagens
+                with metrics.timer('mom_roundtrip_seconds', operation='unbind'):
+                    unbind_queue(user_queue, topic_name, *previous)
+        except Exception as e:
+            print(f"Erro ao inscrever usuário '{username}' no tópico '{topic_name}': {e}")
+            return False
+        
+        self.registry.subscribe(username, topic_name, binding_key, arguments)
         print(f"Usuário '{username}' inscrito no tópico '{topic_name}'.")
         return True
     
     def unsubscribe_user_from_topic(self, username, topic_name):
-        """Desinscreve um usuário de um tópico"""
-        if username not in self.users:
+        """Desinscreve um usuário de um tópico (remove o binding da fila do usuário)"""
+        user_queue = self.registry.get_user_queue(username)
+        if user_queue is None:
             print(f"Usuário '{username}' não existe.")
             return False
         
-        self.users[username]['subscribed_topics'].discard(topic_name)
+        subscription = self.registry.get_subscription(username, topic_name)
+        if subscription is not None and self.registry.has_topic(topic_name):
+            try:
+                with metrics.timer('mom_roundtrip_seconds', operation='unbind'):
+                    unbind_queue(user_queue, topic_name, *subscription)
+            except Exception as e:
+                print(f"Erro ao desinscrever usuário '{username}' do tópico '{topic_name}': {e}")
+                return False
+        
+        self.registry.unsubscribe(username, topic_name)
         print(f"Usuário '{username}' desinscrito do tópico '{topic_name}'.")
         return True
     
-    def get_user_subscribed_topics(self, username):
-        """Obtém os tópicos inscritos por um usuário"""
-        if username in self.users:
-            return list(self.users[username]['subscribed_topics'])
-        return []
+    def collect_queue_stats(self, queue_names=None):
+        """Profundidade e consumidores das filas (todas as registradas por padrão) numa só passada.
+
+        Retorna ``{fila: {'messages', 'consumers'}}``, com ``None`` para filas
+        que não existem no broker.
+        """
+        if queue_names is None:
+            queue_names = [queue_name for queue_name, _ in self.registry.iter_queues()]
+        return self._verify(queue_names, ())['queues']
+    
+    def start_monitoring(self, interval=DEFAULT_MONITOR_INTERVAL, history=DEFAULT_MONITOR_HISTORY):
+        """Inicia a amostragem periódica das filas e tópicos registrados numa thread de fundo"""
+        if self.monitor is None:
+            self.monitor = QueueMonitor(self.registry, interval, history)
+        else:
+            self.monitor.interval = interval
+            self.monitor.history = history
+        self.monitor.start()
+        print(f"Monitoramento iniciado (a cada {interval}s, {history} amostras por fila).")
+        return self.monitor
+    
+    def stop_monitoring(self):
+        if self.monitor is not None and self.monitor.is_running():
+            self.monitor.stop()
+            print("Monitoramento encerrado.")
+    
+    def snapshot(self):
+        """Estado das filas e tópicos com histórico e taxas de crescimento.
+
+        Com o monitoramento ativo, devolve a última amostra sem acessar o
+        broker; caso contrário, coleta uma amostra na hora.
+        """
+        if self.monitor is None:
+            self.monitor = QueueMonitor(self.registry)
+        if not self.monitor.is_running():
+            try:
+                self.monitor.sample()
+            except Exception as e:
+                print(f"Erro ao consultar o broker: {e}")
+        return self.monitor.snapshot()
+    
+    def add_sharded_queue(self, queue_name, shards=DEFAULT_SHARDS, endpoints=None, **policy):
+        """Cria uma fila lógica distribuída em ``shards`` filas físicas (``<nome>.<i>``).
 
+        ``endpoints`` são nomes registrados com ``sharding.register_endpoint``
+        (padrão: só o broker do processo); os fragmentos são distribuídos entre
+        eles em rodízio. ``policy`` vale para cada fragmento, como em
+        ``add_queue``. A definição fica neste processo: outro processo que
+        chama ``add_sharded_queue`` com os mesmos parâmetros obtém o mesmo
+        anel, e as declarações repetidas não têm efeito.
+        """
+        try:
+            sharded_queue = ShardedQueue(queue_name, shards, endpoints, queue_arguments(**policy))
+            for shard, endpoint in sharded_queue.shards.items():
+                self._declare_shard(sharded_queue, shard, endpoint)
+        except Exception as e:
+            print(f"Erro ao adicionar fila fragmentada '{queue_name}': {e}")
+            return None
+        register_sharded_queue(sharded_queue)
+        print(f"Fila fragmentada '{queue_name}' adicionada com {shards} fragmentos "
+              f"em {len(sharded_queue.endpoints)} broker(s).")
+        return sharded_queue
+    
+    def _declare_shard(self, sharded_queue, shard, endpoint):
+        with metrics.timer('mom_roundtrip_seconds', operation='add_queue'), \
+                get_endpoint_pool(endpoint).channel() as channel:
+            declaration_cache.declare_queue(channel, shard, arguments=sharded_queue.arguments, force=True)
+    
+    def get_sharded_queue(self, queue_name):
+        return get_sharded_queue(queue_name)
+    
+    def list_sharded_queues(self):
+        """Lista as filas fragmentadas e os seus fragmentos"""
+        print("Filas fragmentadas:")
+        names = list_sharded_queues()
+        for queue_name in names:
+            shards = get_sharded_queue(queue_name).shards
+            print(f"  - {queue_name}: " + ", ".join(f"{shard}@{endpoint}" for shard, endpoint in shards.items()))
+        return names
+    
+    def add_shard(self, queue_name, endpoint=None):
+        """Acrescenta um fragmento à fila; só as chaves que caem nos arcos dele mudam de fragmento.
+
+        Mensagens dessas chaves já enfileiradas no fragmento antigo continuam
+        lá e são consumidas normalmente (a ordem por chave vale a partir daqui).
+        """
+        sharded_queue = get_sharded_queue(queue_name)
+        if sharded_queue is None:
+            print(f"Fila fragmentada '{queue_name}' não existe.")
+            return None
+        shard, endpoint = sharded_queue.next_shard(endpoint)
+        try:
+            # Declara antes de entrar no anel, para nenhum produtor publicar numa fila inexistente
+            self._declare_shard(sharded_queue, shard, endpoint)
+        except Exception as e:
+            print(f"Erro ao adicionar fragmento à fila '{queue_name}': {e}")
+            return None
+        shard = sharded_queue.add_shard(endpoint)
+        print(f"Fragmento '{shard}' adicionado à fila '{queue_name}' ({endpoint}).")
+        return shard
+    
+    def remove_shard(self, queue_name, shard):
+        """Tira um fragmento do anel, move as mensagens restantes para os novos donos e apaga a fila.
+
+        As mensagens são redistribuídas pela chave em ``x-shard-key``; cada uma
+        só recebe ack no fragmento antigo depois que o broker do novo dono
+        confirma a publicação. Se alguma não for confirmada, o fragmento volta
+        ao anel com as mensagens restantes e a remoção pode ser repetida.
+        Retorna a quantidade de mensagens movidas (None em caso de erro).
+        """
+        sharded_queue = get_sharded_queue(queue_name)
+        if sharded_queue is None or shard not in sharded_queue.shards:
+            print(f"Fragmento '{shard}' não existe na fila '{queue_name}'.")
+            return None
+        try:
+            endpoint = sharded_queue.remove_shard(shard)
+        except ValueError as e:
+            print(f"Erro ao remover fragmento '{shard}': {e}")
+            return None
+        try:
+            moved = self._drain_shard(sharded_queue, shard, endpoint)
+        except Exception as e:
+            sharded_queue.restore_shard(shard, endpoint)
+            print(f"Erro ao esvaziar fragmento '{shard}' (mantido no anel): {e}")
+            return None
+        try:
+            with get_endpoint_pool(endpoint).channel() as channel:
+                channel.queue_delete(queue=shard)
+            declaration_cache.forget_queue(shard)
+        except Exception as e:
+            print(f"Erro ao apagar fragmento '{shard}': {e}")
+            return None
+        print(f"Fragmento '{shard}' removido; {moved} mensagens redistribuídas.")
+        return moved
+    
+    def _drain_shard(self, sharded_queue, shard, endpoint, batch=DEFAULT_CONFIRM_WINDOW):
+        """Move as mensagens do fragmento para os novos donos, em lotes confirmados.
+
+        Cada mensagem só recebe ack no fragmento antigo depois que o broker do
+        novo dono confirma a publicação; as não confirmadas voltam para o
+        fragmento (nack com requeue) e o erro é repassado.
+        """
+        moved = 0
+        with ExitStack() as stack:
+            source = stack.enter_context(get_endpoint_pool(endpoint).channel())
+            publishers = {}  # endpoint -> ConfirmPublisher do pool do broker
+            while True:
+                deliveries = {}  # endpoint -> [(delivery tag no fragmento, publicação)]
+                for _ in range(batch):
+                    method, properties, body = source.basic_get(queue=shard, auto_ack=False)
+                    if method is None:
+                        break
+                    key = (properties.headers or {}).get(SHARD_KEY_HEADER, '')
+                    target_shard, target_endpoint = sharded_queue.shard_for(key)
+                    deliveries.setdefault(target_endpoint, []).append(
+                        (method.delivery_tag, ('', target_shard, body, properties)))
+                if not deliveries:
+                    return moved
+                
+                failed = 0
+                error = None
+                for target_endpoint, items in deliveries.items():
+                    if target_endpoint not in publishers:
+                        publishers[target_endpoint] = stack.enter_context(
+                            get_endpoint_pool(target_endpoint).confirm_publisher())
+                    publisher = publishers[target_endpoint]
+                    results = publisher.publish_batch([publish for _, publish in items])
+                    error = error or publisher.error
+                    for index, (delivery_tag, _) in enumerate(items):
+                        if index < len(results) and results[index]:
+                            source.basic_ack(delivery_tag)
+                            moved += 1
+                        else:
+                            source.basic_nack(delivery_tag, requeue=True)
+                            failed += 1
+                if failed:
+                    raise RuntimeError(f"{failed} mensagens não confirmadas pelo novo fragmento "
+                                       f"({moved} movidas)" + (f": {error}" if error else ""))
+    
+    def remove_sharded_queue(self, queue_name):
+        """Apaga todos os fragmentos e a definição da fila fragmentada"""
+        sharded_queue = get_sharded_queue(queue_name)
+        if sharded_queue is None:
+            print(f"Fila fragmentada '{queue_name}' não existe.")
+            return False
+        try:
+            for shard, endpoint in list(sharded_queue.shards.items()):
+                with get_endpoint_pool(endpoint).channel() as channel:
+                    channel.queue_delete(queue=shard)
+                declaration_cache.forget_queue(shard)
+        except Exception as e:
+            print(f"Erro ao remover fila fragmentada '{queue_name}': {e}")
+            return False
+        unregister_sharded_queue(queue_name)
+        print(f"Fila fragmentada '{queue_name}' removida.")
+        return True
+    
+    def sharded_queue_stats(self, queue_name):
+        """Profundidade e consumidores de cada fragmento, consultando cada broker uma vez"""
+        sharded_queue = get_sharded_queue(queue_name)
+        if sharded_queue is None:
+            return {}
+        by_endpoint = {}
+        for shard, endpoint in sharded_queue.shards.items():
+            by_endpoint.setdefault(endpoint, []).append(shard)
+        stats = {}
+        for endpoint, shards in by_endpoint.items():
+            try:
+                with metrics.timer('mom_roundtrip_seconds', operation='collect_stats'):
+                    stats.update(collect_broker_stats(shards, pool=get_endpoint_pool(endpoint))['queues'])
+            except Exception as e:
+                print(f"Erro ao consultar o broker '{endpoint}': {e}")
+        return stats
@@ -0,0 +1,207 @@
+import threading
+import time
+from collections import deque
+from functools import partial
+
+from message_utils import _async_channel, get_channel_pool
+
+DEFAULT_MONITOR_INTERVAL = 5.0  # Segundos entre amostras
+DEFAULT_MONITOR_HISTORY = 60  # Amostras guardadas por fila
+DEFAULT_STATS_LANES = 8  # Canais com uma declaração passiva em andamento cada
+DEFAULT_STATS_TIMEOUT = 10.0  # Segundos para concluir uma coleta
+
+
+def collect_broker_stats(queue_names=(), topic_names=(), lanes=DEFAULT_STATS_LANES,
+                         timeout=DEFAULT_STATS_TIMEOUT, pool=None):
+    """Coleta profundidade e consumidores das filas, e a existência dos tópicos, numa só passada.
+
+    Usa uma conexão do pool e declarações passivas pela API assíncrona do
+    canal (veja ``message_utils._async_channel``), sem esperar cada
+    resposta na thread que chama: ``lanes`` canais da mesma conexão mantêm
+    uma declaração em andamento cada, e a próxima é enviada no callback da
+    anterior. O pika
+    só permite uma operação síncrona pendente por canal, por isso o
+    paralelismo vem dos canais. Um recurso inexistente faz o broker fechar
+    o canal (NOT_FOUND); ele é marcado como ausente e o canal é reaberto.
+
+    Retorna ``{'queues': {nome: {'messages', 'consumers'} ou None},
+    'topics': {nome: True/False}}``; ``None``/``False`` indicam recurso
+    ausente no broker. Recursos sem resposta até ``timeout`` ficam de fora.
+    ``pool`` permite consultar outro broker (padrão: o pool do processo).
+    """
+    items = [('queue', name) for name in dict.fromkeys(queue_names)]
+    items += [('topic', name) for name in dict.fromkeys(topic_names)]
+    result = {'queues': {}, 'topics': {}}
+    if not items:
+        return result
+
+    pool = pool or get_channel_pool()
+    pooled = pool.acquire()
+    connection = pooled.connection
+    lanes = [{'items': iter(items[i::lanes]), 'channel': None, 'async': None, 'current': None}
+             for i in range(max(1, min(lanes, len(items))))]
+
+    def on_declare_ok(lane, kind, name, method_frame):
+        if kind == 'queue':
+            result['queues'][name] = {'messages': method_frame.method.message_count,
+                                      'consumers': method_frame.method.consumer_count}
+        else:
+            result['topics'][name] = True
+        send_next(lane)
+
+    def open_channel(lane):
+        lane['channel'] = connection.channel()
+        lane['async'] = _async_channel(lane['channel'])
+
+    def send_next(lane):
+        lane['current'] = next(lane['items'], None)
+        if lane['current'] is None:
+            return
+        kind, name = lane['current']
+        callback = partial(on_declare_ok, lane, kind, name)
+        if kind == 'queue':
+            lane['async'].queue_declare(name, passive=True, callback=callback)
+        else:
+            lane['async'].exchange_declare(name, passive=True, callback=callback)
+
+    broken = False
+    try:
+        for lane in lanes:
+            open_channel(lane)
+            send_next(lane)
+        deadline = time.monotonic() + timeout
+        while any(lane['current'] is not None for lane in lanes) and time.monotonic() < deadline:
+            connection.process_data_events(time_limit=0.05)
+            for lane in lanes:
+                if lane['current'] is not None and not lane['channel'].is_open:
+                    # O broker fechou o canal: o recurso em andamento não existe
+                    kind, name = lane['current']
+                    if kind == 'queue':
+                        result['queues'][name] = None
+                    else:
+                        result['topics'][name] = False
+                    open_channel(lane)
+                    send_next(lane)
+    except Exception:
+        broken = True
+        raise
+    finally:
+        for lane in lanes:
+            try:
+                if lane['channel'] is not None and lane['channel'].is_open:
+                    lane['channel'].close()
+            except Exception:
+                broken = True
+        pool.release(pooled, discard=broken)
+    return result
+
+
+class QueueMonitor:
+    """Amostra periodicamente as filas e tópicos registrados numa thread de fundo.
+
+    Cada amostra é uma única passada de ``collect_broker_stats``; por fila
+    é mantido um buffer circular com as últimas ``history`` amostras
+    ``(timestamp, mensagens, consumidores)``, de onde saem as estimativas
+    de crescimento. Painéis e alertas leem ``snapshot()``, que não acessa
+    o broker.
+    """
+
+    def __init__(self, registry, interval=DEFAULT_MONITOR_INTERVAL, history=DEFAULT_MONITOR_HISTORY,
+                 lanes=DEFAULT_STATS_LANES):
+        self.registry = registry
+        self.interval = interval
+        self.history = history
+        self.lanes = lanes
+        self.thread = None
+        self.last_error = None
+        self._queues = {}  # fila -> deque de (timestamp, mensagens, consumidores)
+        self._missing_queues = set()
+        self._topics = {}  # tópico -> existe no broker
+        self._sampled_at = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self):
+        """Inicia a thread de amostragem (se ainda não estiver rodando)"""
+        if self.is_running():
+            return
+        self._stop.clear()
+        self.thread = threading.Thread(target=self._run, name='mom-monitor', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.sample()
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Erro ao amostrar o broker: {e}")
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def sample(self):
+        """Coleta uma amostra agora e a acrescenta ao histórico"""
+        queue_names = [queue_name for queue_name, _ in self.registry.iter_queues()]
+        topic_names = [topic_name for topic_name, _ in self.registry.iter_topics()]
+        stats = collect_broker_stats(queue_names, topic_names, self.lanes)
+        timestamp = time.time()
+        with self._lock:
+            # Filas e tópicos removidos do registro saem do histórico
+            for queue_name in set(self._queues) - set(queue_names):
+                del self._queues[queue_name]
+            self._missing_queues.clear()
+            for queue_name, queue_stats in stats['queues'].items():
+                if queue_stats is None:
+                    self._missing_queues.add(queue_name)
+                    self._queues.pop(queue_name, None)
+                    continue
+                history = self._queues.get(queue_name)
+                if history is None or history.maxlen != self.history:
+                    history = self._queues[queue_name] = deque(history or (), maxlen=self.history)
+                history.append((timestamp, queue_stats['messages'], queue_stats['consumers']))
+            self._topics = stats['topics']
+            self._sampled_at = timestamp
+            self.last_error = None
+        return stats
+
+    @staticmethod
+    def _describe(history):
+        timestamp, messages, consumers = history[-1]
+        first_timestamp, first_messages, _ = history[0]
+        elapsed = timestamp - first_timestamp
+        return {
+            'messages': messages,
+            'consumers': consumers,
+            'sampled_at': timestamp,
+            # Variação desde a amostra anterior e taxa média na janela (mensagens/s)
+            'delta': messages - history[-2][1] if len(history) > 1 else 0,
+            'growth_per_s': (messages - first_messages) / elapsed if elapsed > 0 else 0.0,
+            'history': list(history),
+        }
+
+    def snapshot(self):
+        """Último estado conhecido, sem acessar o broker.
+
+        ``{'sampled_at', 'interval', 'running', 'error', 'queues': {nome: {'messages',
+        'consumers', 'delta', 'growth_per_s', 'history', ...}}, 'missing_queues',
+        'topics': {nome: existe}}``
+        """
+        with self._lock:
+            return {
+                'sampled_at': self._sampled_at,
+                'interval': self.interval,
+                'running': self.is_running(),
+                'error': self.last_error,
+                'queues': {name: self._describe(history) for name, history in self._queues.items()},
+                'missing_queues': sorted(self._missing_queues),
+                'topics': dict(self._topics),
+            }
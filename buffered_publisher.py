@@ -0,0 +1,418 @@
+import os
+import pickle
+import re
+import struct
+import threading
+import time
+from collections import deque
+
+from message_utils import (
+    get_rabbitmq_connection, close_rabbitmq_connection, declaration_cache, is_precondition_failed_error,
+    ConfirmPublisher, DEFAULT_CONFIRM_WINDOW, DEFAULT_CONFIRM_TIMEOUT
+)
+from metrics import metrics
+
+DEFAULT_BUFFER_SIZE = 10000  # Mensagens mantidas em memória aguardando envio
+DEFAULT_FLUSH_BATCH = 200  # Mensagens publicadas por lote com confirmação
+DEFAULT_RETRY_DELAY = 1.0  # Segundos antes de reenviar mensagens recusadas ou reconectar
+DEFAULT_POLL_INTERVAL = 0.2  # Segundos entre verificações da thread de envio
+OVERFLOW_POLICIES = ('block', 'drop_oldest', 'spill')
+
+_RECORD_HEADER = struct.Struct('>I')
+_REPLY_DESTINATION = re.compile(r"\b(queue|exchange) '([^']*)'")  # Ex.: "NOT_FOUND - no queue 'x' in vhost '/'"
+
+
+class SpillJournal:
+    """Arquivo local onde as mensagens excedentes esperam, em ordem, pelo envio.
+
+    Cada registro é ``tamanho (4 bytes) + pickle(mensagem)``. Os registros são
+    lidos a partir de um deslocamento e o arquivo é truncado quando esvazia;
+    um journal que já existe ao abrir (ex.: após uma queda do processo) é
+    reenviado desde o início. Só leia journals gravados pelo próprio MOM.
+    """
+
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        self.file = open(path, 'a+b')
+        self.read_offset = 0
+        self.count = self._count_records()
+
+    def _count_records(self):
+        count = 0
+        self.file.seek(0)
+        while True:
+            header = self.file.read(_RECORD_HEADER.size)
+            if len(header) < _RECORD_HEADER.size:
+                break
+            (size,) = _RECORD_HEADER.unpack(header)
+            self.file.seek(size, os.SEEK_CUR)
+            count += 1
+        return count
+
+    def __len__(self):
+        return self.count
+
+    def append(self, record):
+        data = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        self.file.seek(0, os.SEEK_END)
+        self.file.write(_RECORD_HEADER.pack(len(data)) + data)
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self.count += 1
+
+    def pop(self, limit):
+        """Lê até ``limit`` registros, na ordem em que foram gravados"""
+        records = []
+        self.file.seek(self.read_offset)
+        while len(records) < limit and self.count:
+            (size,) = _RECORD_HEADER.unpack(self.file.read(_RECORD_HEADER.size))
+            records.append(pickle.loads(self.file.read(size)))
+            self.count -= 1
+        self.read_offset = self.file.tell()
+        if not self.count:
+            self.file.truncate(0)
+            self.read_offset = 0
+        return records
+
+    def close(self):
+        self.file.close()
+
+
+class BufferedPublisher:
+    """Publica de forma assíncrona a partir de um buffer local limitado.
+
+    ``publish`` apenas coloca a mensagem no buffer e retorna; uma thread de
+    envio com conexão própria publica em lotes num canal em modo confirm e
+    devolve ao início do buffer o que o broker recusar ou não confirmar.
+    Quando o RabbitMQ dispara um alarme de memória/disco, a conexão recebe
+    ``Connection.Blocked`` e a thread para de publicar até o
+    ``Connection.Unblocked``; se a conexão cair, ela reconecta e continua.
+
+    Com o buffer cheio, ``overflow`` decide o que fazer:
+
+    - ``block``: quem publica espera por espaço (até ``block_timeout``);
+    - ``drop_oldest``: descarta a mensagem mais antiga do buffer;
+    - ``spill``: grava a mensagem no journal em disco (``journal_path``), lido
+      de volta em ordem assim que o buffer esvaziar.
+
+    A entrega é "ao menos uma vez": um lote interrompido é reenviado.
+    """
+
+    def __init__(self, max_buffer=DEFAULT_BUFFER_SIZE, overflow='block', journal_path=None,
+                 batch_size=DEFAULT_FLUSH_BATCH, window=DEFAULT_CONFIRM_WINDOW,
+                 confirm_timeout=DEFAULT_CONFIRM_TIMEOUT, block_timeout=None,
+                 retry_delay=DEFAULT_RETRY_DELAY, connection_factory=None, fsync=False):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Política de estouro inválida: '{overflow}' (use {', '.join(OVERFLOW_POLICIES)}).")
+        if overflow == 'spill' and not journal_path:
+            raise ValueError("A política 'spill' exige journal_path.")
+        self.max_buffer = max_buffer
+        self.overflow = overflow
+        self.batch_size = batch_size
+        self.window = window
+        self.confirm_timeout = confirm_timeout
+        self.block_timeout = block_timeout
+        self.retry_delay = retry_delay
+        self.connection_factory = connection_factory or get_rabbitmq_connection
+        self.journal = SpillJournal(journal_path, fsync) if journal_path else None
+        self.blocked = None  # Motivo do bloqueio informado pelo broker
+        self.blocked_since = None
+        self.thread = None
+        self._buffer = deque()  # (exchange, routing_key, corpo, propriedades, tipo do exchange)
+        self._in_flight = 0
+        self._connection = None
+        self._publisher = None
+        self._declaring = None  # Mensagem cujo destino está sendo declarado (para isolar falhas)
+        self._running = False
+        self._condition = threading.Condition()
+        self._stats = {'published': 0, 'confirmed': 0, 'retried': 0, 'dropped': 0,
+                       'spilled': 0, 'blocked_count': 0}
+
+    # Produtores
+
+    def publish(self, exchange, routing_key, body, properties=None, exchange_type='fanout'):
+        """Coloca a mensagem no buffer; retorna False se ela não puder ser aceita"""
+        record = (exchange, routing_key, body, properties, exchange_type)
+        kind, name = ('topic', exchange) if exchange else ('queue', routing_key)
+        with self._condition:
+            if not self._running:
+                self._start_locked()
+            if self.journal is not None and len(self.journal):
+                # Com mensagens no journal, as novas vão para o fim dele (ordem FIFO)
+                self._spill_locked(record, kind, name)
+            elif len(self._buffer) < self.max_buffer:
+                self._buffer.append(record)
+            elif self.overflow == 'spill':
+                self._spill_locked(record, kind, name)
+            elif self.overflow == 'drop_oldest':
+                dropped = self._buffer.popleft()
+                self._buffer.append(record)
+                self._stats['dropped'] += 1
+                dropped_kind, dropped_name = ('topic', dropped[0]) if dropped[0] else ('queue', dropped[1])
+                metrics.inc('mom_messages_dropped_total', kind=dropped_kind, name=dropped_name)
+            else:
+                deadline = None if self.block_timeout is None else time.monotonic() + self.block_timeout
+                while len(self._buffer) >= self.max_buffer:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if (remaining is not None and remaining <= 0) or not self._running:
+                        metrics.record_error('buffer_full', kind, name)
+                        return False
+                    self._condition.wait(remaining)
+                self._buffer.append(record)
+            self._stats['published'] += 1
+            self._condition.notify_all()
+        return True
+
+    def _spill_locked(self, record, kind, name):
+        self.journal.append(record)
+        self._stats['spilled'] += 1
+        metrics.inc('mom_messages_spilled_total', kind=kind, name=name)
+
+    def flush(self, timeout=None):
+        """Aguarda o envio de tudo o que está no buffer e no journal; retorna False se esgotar o tempo"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._pending_locked() or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if (remaining is not None and remaining <= 0) or not self._running:
+                    return False
+                self._condition.wait(remaining if remaining is not None else DEFAULT_POLL_INTERVAL)
+        return True
+
+    def _pending_locked(self):
+        return len(self._buffer) + (len(self.journal) if self.journal is not None else 0)
+
+    def close(self, timeout=10.0):
+        """Tenta esvaziar o buffer e encerra a thread de envio.
+
+        O que não for enviado a tempo vai para o journal, se houver; senão é
+        descartado e contado em ``dropped``.
+        """
+        self.flush(timeout)
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        with self._condition:
+            leftover = list(self._buffer)
+            self._buffer.clear()
+            if leftover and self.journal is not None:
+                # As mensagens do buffer são mais antigas que as do journal: vão à frente
+                leftover.extend(self.journal.pop(len(self.journal)))
+                for record in leftover:
+                    self.journal.append(record)
+            elif leftover:
+                self._stats['dropped'] += len(leftover)
+                print(f"Publicador encerrado com {len(leftover)} mensagens não enviadas.")
+            if self.journal is not None:
+                self.journal.close()
+
+    def stats(self):
+        with self._condition:
+            return {
+                **self._stats,
+                'buffered': len(self._buffer),
+                'journal': len(self.journal) if self.journal is not None else 0,
+                'in_flight': self._in_flight,
+                'blocked': self.blocked,
+                'blocked_since': self.blocked_since,
+                'running': self._running,
+            }
+
+    # Thread de envio
+
+    def _start_locked(self):
+        self._running = True
+        self.thread = threading.Thread(target=self._run, name='mom-publisher', daemon=True)
+        self.thread.start()
+
+    def _on_blocked(self, connection, method_frame):
+        reason = getattr(method_frame.method, 'reason', None) or 'recursos'
+        with self._condition:
+            self.blocked = reason
+            self.blocked_since = time.time()
+            self._stats['blocked_count'] += 1
+        print(f"Broker bloqueou as publicações ({reason}); mensagens ficam no buffer.")
+
+    def _on_unblocked(self, connection, method_frame):
+        with self._condition:
+            self.blocked = None
+            self.blocked_since = None
+            self._condition.notify_all()
+        print("Broker liberou as publicações; enviando o buffer.")
+
+    def _connect(self):
+        self._connection = self.connection_factory()
+        self._connection.add_on_connection_blocked_callback(self._on_blocked)
+        self._connection.add_on_connection_unblocked_callback(self._on_unblocked)
+        self._publisher = ConfirmPublisher(self._connection, self.window)
+
+    def _disconnect(self):
+        connection, self._connection, self._publisher = self._connection, None, None
+        with self._condition:
+            # Um alarme não sobrevive à conexão; a nova o informa de novo se ainda valer
+            self.blocked = None
+            self.blocked_since = None
+        try:
+            if connection is not None and connection.is_open:
+                close_rabbitmq_connection(connection)
+        except Exception:
+            pass
+
+    def _run(self):
+        while self._running:
+            try:
+                if self._connection is None:
+                    self._connect()
+                self._flush_pending()
+            except Exception as e:
+                metrics.record_error('publisher_connection')
+                print(f"Erro na conexão do publicador: {e}")
+                self._disconnect()
+                self._wait(self.retry_delay)
+        self._disconnect()
+
+    def _wait(self, seconds):
+        with self._condition:
+            if self._running:
+                self._condition.wait(seconds)
+
+    def _take_batch(self):
+        """Retira o próximo lote do buffer e o repõe a partir do journal"""
+        with self._condition:
+            if self._running and self.blocked is None and not self._pending_locked():
+                self._condition.wait(DEFAULT_POLL_INTERVAL)
+            if not self._running or self.blocked is not None or not self._pending_locked():
+                return []
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            if self.journal is not None and len(self.journal):
+                # O journal só recebe mensagens mais novas que as do buffer
+                if len(batch) < self.batch_size:
+                    batch.extend(self.journal.pop(self.batch_size - len(batch)))
+                room = self.max_buffer - len(self._buffer)
+                if room > 0 and len(self.journal):
+                    self._buffer.extend(self.journal.pop(room))
+            self._in_flight = len(batch)
+            self._condition.notify_all()
+        return batch
+
+    def _requeue(self, records):
+        """Devolve mensagens não confirmadas ao início do buffer, na ordem original"""
+        with self._condition:
+            self._buffer.extendleft(reversed(records))
+            self._stats['retried'] += len(records)
+            self._in_flight = 0
+            self._condition.notify_all()
+
+    def _flush_pending(self):
+        while self._running:
+            # Processa heartbeats e as notificações de bloqueio/desbloqueio
+            self._connection.process_data_events(time_limit=0)
+            batch = self._take_batch()
+            if not batch:
+                if self.blocked is not None:
+                    self._connection.process_data_events(time_limit=DEFAULT_POLL_INTERVAL)
+                continue
+            try:
+                results = self._publish(batch)
+                error = self._publisher.error
+            except Exception as e:
+                results, error = [], e  # Falha nas declarações, antes de publicar
+            # Só o que não foi confirmado volta ao buffer (com erro no meio do lote, o resto já chegou)
+            failed = [record for record, ok in zip(batch, results) if not ok]
+            failed.extend(batch[len(results):])
+            with self._condition:
+                self._stats['confirmed'] += len(batch) - len(failed)
+                self._in_flight = 0
+                self._condition.notify_all()
+            if error is not None:
+                self._requeue(failed)
+                if not self._publisher.is_open:
+                    self._invalidate_destination(error, failed[0] if failed else None)
+                    if self._connection.is_open:
+                        self._publisher = ConfirmPublisher(self._connection, self.window)
+                        self._wait(self.retry_delay)
+                        continue
+                raise error
+            if self._publisher.broken:
+                # Tempo esgotado com confirmações pendentes: elas não podem contar para o próximo lote
+                self._publisher.close()
+                self._publisher = ConfirmPublisher(self._connection, self.window)
+            if failed:
+                self._requeue(failed)
+                self._wait(self.retry_delay)
+
+    def _invalidate_destination(self, error, record):
+        """Ajusta o cache de declarações só para o destino que fechou o canal.
+
+        O destino vem da resposta do broker (``no queue 'x'``...) ou, sem ele,
+        da mensagem em que a declaração ou a publicação falhou.
+        """
+        match = _REPLY_DESTINATION.search(str(getattr(error, 'reply_text', '') or ''))
+        if match is not None:
+            kind, name = match.groups()
+        elif self._declaring is not None or record is not None:
+            exchange, routing_key = (self._declaring or record)[:2]
+            kind, name = ('exchange', exchange) if exchange else ('queue', routing_key)
+        else:
+            return
+        if kind == 'queue' and is_precondition_failed_error(error):
+            # Fila criada com outros argumentos: publica sem redeclará-la
+            declaration_cache.remember_queue(name)
+        elif kind == 'exchange':
+            # Destino removido no broker: redeclara no próximo lote, num canal novo
+            declaration_cache.forget_exchange(name)
+        else:
+            declaration_cache.forget_queue(name)
+
+    def _publish(self, batch):
+        channel = self._publisher.channel
+        for record in batch:
+            exchange, routing_key, _, _, exchange_type = record
+            self._declaring = record
+            if exchange:
+                declaration_cache.declare_exchange(channel, exchange, exchange_type)
+            else:
+                declaration_cache.declare_queue(channel, routing_key)
+        self._declaring = None
+        start = time.perf_counter()
+        results = self._publisher.publish_batch(
+            [(exchange, routing_key, body, properties) for exchange, routing_key, body, properties, _ in batch],
+            self.confirm_timeout
+        )
+        elapsed = time.perf_counter() - start
+        if metrics.enabled:
+            for (exchange, routing_key, body, _, _), ok in zip(batch, results):
+                kind, name = ('topic', exchange) if exchange else ('queue', routing_key)
+                if ok:
+                    metrics.record_sent(kind, name, len(body))
+                else:
+                    metrics.record_error('publish', kind, name)
+            metrics.observe('mom_publish_seconds', elapsed, operation='buffered_batch')
+        return results
+
+
+_buffered_publisher = None
+_buffered_publisher_lock = threading.Lock()
+
+def get_buffered_publisher():
+    """Retorna o publicador com buffer do processo, criando-o na primeira chamada"""
+    global _buffered_publisher
+    if _buffered_publisher is None:
+        with _buffered_publisher_lock:
+            if _buffered_publisher is None:
+                _buffered_publisher = BufferedPublisher()
+    return _buffered_publisher
+
+def configure_buffered_publisher(**options):
+    """Substitui o publicador com buffer do processo, encerrando o anterior"""
+    global _buffered_publisher
+    with _buffered_publisher_lock:
+        old_publisher, _buffered_publisher = _buffered_publisher, BufferedPublisher(**options)
+    if old_publisher is not None:
+        old_publisher.close()
+    return _buffered_publisher
@@ -0,0 +1,283 @@
+import hashlib
+import mmap
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from message_utils import message_properties
+
+DEFAULT_CHUNK_SIZE = 256 * 1024  # Bytes por mensagem (bem abaixo do limite de mensagem do broker)
+DEFAULT_TRANSFER_PREFETCH = 16  # Pedaços em memória no receptor (prefetch do consumidor)
+DEFAULT_TRANSFER_TIMEOUT = 600.0  # Segundos para publicar e confirmar todos os pedaços
+DEFAULT_TRANSFER_MAX_AGE = 3600.0  # Segundos sem pedaços novos antes de abandonar uma transferência
+CHUNK_MESSAGE_TYPE = 'mom.chunk'  # Valor de ``type`` nas mensagens de transferência
+COMPLETED_HISTORY = 1024  # Transferências concluídas lembradas para detectar reentregas
+
+
+def transfer_queue_name(username):
+    """Fila em que ``username`` recebe os pedaços das transferências"""
+    return f"transfer_{username}"
+
+
+def iter_file_chunks(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Fatias ``memoryview`` de ``chunk_size`` bytes do arquivo mapeado em memória.
+
+    O arquivo não é lido para a memória do processo: cada fatia aponta para
+    as páginas do mapeamento, carregadas sob demanda pelo sistema. As fatias
+    continuam válidas enquanto referenciadas (``iter_chunk_messages`` retém
+    uma até saber se há outra); o mapeamento é desfeito quando a última
+    deixa de ser usada.
+    """
+    with open(path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size == 0:
+            return  # mmap não aceita arquivos vazios
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    for offset in range(0, size, chunk_size):
+        yield view[offset:offset + chunk_size]
+
+
+def iter_stream_chunks(stream, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Reagrupa um iterável de bytes em pedaços de ``chunk_size`` (o último pode ser menor)"""
+    buffer = bytearray()
+    for data in stream:
+        view = memoryview(data)
+        while len(buffer) + len(view) >= chunk_size:
+            if not buffer and len(view) >= chunk_size:
+                yield view[:chunk_size]  # Sem cópia quando o dado já vem grande
+                view = view[chunk_size:]
+                continue
+            missing = chunk_size - len(buffer)
+            buffer += view[:missing]
+            view = view[missing:]
+            yield bytes(buffer)
+            buffer.clear()
+        buffer += view
+    if buffer:
+        yield bytes(buffer)
+
+
+def iter_chunk_messages(sender, transfer_id, chunks, name, size=None):
+    """Monta ``(corpo, propriedades)`` de cada pedaço, com número de sequência e deslocamento.
+
+    O último pedaço leva a contagem total e o SHA-256 do conteúdo; por isso
+    um pedaço é retido (sem cópia) até se saber se há um seguinte. Um
+    conteúdo vazio gera um único pedaço vazio. O corpo é convertido em
+    ``bytes`` só ao montar a mensagem, porque o pika exige ``bytes`` na
+    publicação.
+    """
+    digest = hashlib.sha256()
+    index = offset = 0
+    previous = None
+    for chunk in chunks:
+        if previous is not None:
+            yield _chunk_message(sender, transfer_id, name, size, index, offset, bytes(previous))
+            index += 1
+            offset += len(previous)
+        digest.update(chunk)
+        previous = chunk
+    if previous is None:
+        previous = b''
+    yield _chunk_message(sender, transfer_id, name, size, index, offset, bytes(previous),
+                         last={'x-chunk-count': index + 1, 'x-transfer-sha256': digest.hexdigest(),
+                               'x-transfer-size': offset + len(previous)})
+
+
+def _chunk_message(sender, transfer_id, name, size, index, offset, body, last=None):
+    headers = {
+        'x-transfer-id': transfer_id,
+        'x-transfer-name': name,
+        'x-chunk-index': index,
+        'x-chunk-offset': offset,
+    }
+    if size is not None:
+        headers['x-transfer-size'] = size
+    if last:
+        headers.update(last)
+    return body, message_properties(
+        delivery_mode=2,
+        content_type='application/octet-stream',
+        app_id=sender,
+        type=CHUNK_MESSAGE_TYPE,
+        message_id=f"{transfer_id}:{index}",
+        timestamp=int(time.time()),
+        headers=headers
+    )
+
+
+def new_transfer_id():
+    return uuid.uuid4().hex
+
+
+class ChunkReassembler:
+    """Grava os pedaços recebidos direto no disco e monta os arquivos das transferências.
+
+    Cada pedaço é escrito na sua posição (``os.pwrite``) num arquivo
+    ``<id>.part`` em ``directory``, em qualquer ordem; na memória ficam só os
+    índices recebidos. Quando todos chegam, o conteúdo é conferido pelo
+    SHA-256 (lendo o arquivo em blocos) e renomeado para ``<id>_<nome>``.
+    Pedaços repetidos (reentregas) são contados e ignorados. Seguro para
+    ser chamado de várias threads do executor ao mesmo tempo.
+    """
+
+    def __init__(self, directory, max_age=DEFAULT_TRANSFER_MAX_AGE):
+        self.directory = directory
+        self.max_age = max_age
+        os.makedirs(directory, exist_ok=True)
+        self._transfers = {}  # id -> estado da transferência em andamento
+        self._completed = OrderedDict()  # id -> resultado, das últimas concluídas
+        self._lock = threading.Lock()
+
+    def feed(self, properties, body):
+        """Grava um pedaço; retorna o resultado da transferência quando ela termina (senão None)"""
+        headers = properties.headers or {}
+        transfer_id = headers['x-transfer-id']
+        index = headers['x-chunk-index']
+        with self._lock:
+            if transfer_id in self._completed:
+                self._completed[transfer_id]['duplicates'] += 1
+                return None
+            transfer = self._transfers.get(transfer_id)
+            if transfer is None:
+                transfer = self._transfers[transfer_id] = self._open(transfer_id, properties)
+            transfer['updated_at'] = time.time()
+            if index in transfer['received']:
+                transfer['duplicates'] += 1
+                return None
+            transfer['received'].add(index)
+            transfer['writing'] += 1
+            if 'x-chunk-count' in headers:
+                transfer['count'] = headers['x-chunk-count']
+                transfer['size'] = headers['x-transfer-size']
+                transfer['sha256'] = headers['x-transfer-sha256']
+        try:
+            os.pwrite(transfer['fd'], body, headers['x-chunk-offset'])
+        except Exception:
+            with self._lock:
+                transfer['received'].discard(index)  # A reentrega grava de novo
+                transfer['writing'] -= 1
+            raise
+        with self._lock:
+            transfer['writing'] -= 1
+            transfer['bytes'] += len(body)
+            if (transfer['count'] is None or len(transfer['received']) < transfer['count']
+                    or transfer['writing'] or transfer_id not in self._transfers):
+                return None
+            del self._transfers[transfer_id]  # Só uma thread conclui
+        return self._complete(transfer)
+
+    def _open(self, transfer_id, properties):
+        headers = properties.headers or {}
+        part_path = os.path.join(self.directory, f"{transfer_id}.part")
+        return {
+            'id': transfer_id,
+            'from': properties.app_id,
+            'name': os.path.basename(str(headers.get('x-transfer-name') or 'transfer')),
+            'part_path': part_path,
+            'fd': os.open(part_path, os.O_WRONLY | os.O_CREAT, 0o644),
+            'received': set(),
+            'writing': 0,
+            'count': None,
+            'size': headers.get('x-transfer-size'),
+            'sha256': None,
+            'bytes': 0,
+            'duplicates': 0,
+            'started_at': time.time(),
+            'updated_at': time.time(),
+        }
+
+    def _complete(self, transfer):
+        result = {
+            'transfer_id': transfer['id'],
+            'from': transfer['from'],
+            'name': transfer['name'],
+            'path': None,
+            'size': transfer['size'],
+            'chunks': transfer['count'],
+            'duplicates': transfer['duplicates'],
+            'seconds': time.time() - transfer['started_at'],
+            'ok': False,
+            'error': None,
+        }
+        try:
+            os.ftruncate(transfer['fd'], transfer['size'])
+            os.fsync(transfer['fd'])
+        finally:
+            os.close(transfer['fd'])
+        if self._file_digest(transfer['part_path']) != transfer['sha256']:
+            result['error'] = 'SHA-256 não confere'
+            result['path'] = transfer['part_path']
+        else:
+            result['path'] = os.path.join(self.directory, f"{transfer['id']}_{transfer['name']}")
+            os.replace(transfer['part_path'], result['path'])
+            result['ok'] = True
+        with self._lock:
+            self._completed[transfer['id']] = result
+            while len(self._completed) > COMPLETED_HISTORY:
+                self._completed.popitem(last=False)
+        return result
+
+    @staticmethod
+    def _file_digest(path, block_size=DEFAULT_CHUNK_SIZE):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(block_size), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _missing(transfer):
+        received = transfer['received']
+        expected = transfer['count'] if transfer['count'] is not None else max(received, default=-1) + 1
+        return [index for index in range(expected) if index not in received]
+
+    def status(self):
+        """Transferências em andamento: pedaços recebidos, faltantes (conhecidos até agora) e repetidos"""
+        with self._lock:
+            return {transfer_id: {
+                'from': transfer['from'],
+                'name': transfer['name'],
+                'received': len(transfer['received']),
+                'chunks': transfer['count'],
+                'bytes': transfer['bytes'],
+                'missing': self._missing(transfer),
+                'duplicates': transfer['duplicates'],
+                'updated_at': transfer['updated_at'],
+            } for transfer_id, transfer in self._transfers.items()}
+
+    def completed(self):
+        with self._lock:
+            return list(self._completed.values())
+
+    def expire(self, max_age=None):
+        """Abandona transferências sem pedaços novos há ``max_age`` segundos e apaga os parciais.
+
+        Retorna um relatório por transferência, com os pedaços que faltaram.
+        """
+        max_age = self.max_age if max_age is None else max_age
+        now = time.time()
+        with self._lock:
+            expired = [transfer for transfer in self._transfers.values()
+                       if not transfer['writing'] and now - transfer['updated_at'] > max_age]
+            for transfer in expired:
+                del self._transfers[transfer['id']]
+        reports = []
+        for transfer in expired:
+            os.close(transfer['fd'])
+            try:
+                os.remove(transfer['part_path'])
+            except OSError:
+                pass
+            reports.append({'transfer_id': transfer['id'], 'from': transfer['from'], 'name': transfer['name'],
+                            'missing': self._missing(transfer), 'duplicates': transfer['duplicates']})
+        return reports
+
+    def close(self):
+        """Fecha os arquivos das transferências em andamento (os parciais ficam no disco)"""
+        with self._lock:
+            transfers, self._transfers = list(self._transfers.values()), {}
+        for transfer in transfers:
+            os.close(transfer['fd'])
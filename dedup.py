@@ -0,0 +1,216 @@
+import hashlib
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_DEDUP_ENTRIES = 100000  # IDs lembrados na memória (ou capacidade do filtro por janela)
+DEFAULT_DEDUP_WINDOW = 3600.0  # Segundos em que uma reentrega ainda é reconhecida
+DEFAULT_BLOOM_ERROR_RATE = 0.001  # Falsos positivos aceitos no modo probabilístico
+DEFAULT_PRUNE_EVERY = 1000  # IDs gravados no disco entre limpezas das entradas antigas
+
+
+def message_key(properties, body):
+    """Identidade da mensagem para deduplicação.
+
+    Usa o ``message_id`` carimbado pelo produtor; mensagens sem ele (produtores
+    antigos) são identificadas pelo hash do corpo, que inclui remetente e
+    timestamp, então só uma republicação da mesma mensagem tem o mesmo hash.
+    """
+    if properties is not None and properties.message_id:
+        return properties.message_id
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+class BloomFilter:
+    """Filtro de Bloom de tamanho fixo (sem falsos negativos)"""
+
+    def __init__(self, capacity, error_rate=DEFAULT_BLOOM_ERROR_RATE):
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        # Hashing duplo: k posições a partir de dois hashes de 64 bits
+        first, second = int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+
+class RotatingBloomFilter:
+    """Dois filtros de Bloom em rodízio: lembra cada chave por pelo menos meia janela.
+
+    O filtro atual é promovido a anterior a cada ``window / 2`` segundos ou
+    quando atinge a capacidade; a memória fica fixa em dois filtros.
+    """
+
+    def __init__(self, capacity, error_rate=DEFAULT_BLOOM_ERROR_RATE, window=DEFAULT_DEDUP_WINDOW):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.window = window
+        self.current = BloomFilter(capacity, error_rate)
+        self.previous = None
+        self.rotated_at = time.monotonic()
+
+    def _rotate(self):
+        if self.current.count >= self.capacity or time.monotonic() - self.rotated_at >= self.window / 2:
+            self.previous = self.current
+            self.current = BloomFilter(self.capacity, self.error_rate)
+            self.rotated_at = time.monotonic()
+
+    def __contains__(self, key):
+        self._rotate()
+        return key in self.current or (self.previous is not None and key in self.previous)
+
+    def add(self, key):
+        self._rotate()
+        self.current.add(key)
+
+    def memory_bytes(self):
+        return len(self.current.bits) * 2
+
+
+class SQLiteDedupStore:
+    """IDs já processados em SQLite, para reconhecer reentregas após reiniciar o processo"""
+
+    def __init__(self, path='mom_dedup.db'):
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript("""
+                CREATE TABLE IF NOT EXISTS seen (
+                    message_id TEXT PRIMARY KEY,
+                    seen_at REAL NOT NULL
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS idx_seen_at ON seen (seen_at);
+            """)
+
+    def contains(self, key, since):
+        with self._lock:
+            row = self._connection.execute("SELECT 1 FROM seen WHERE message_id = ? AND seen_at >= ?",
+                                           (key, since)).fetchone()
+        return row is not None
+
+    def add(self, key, seen_at):
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO seen (message_id, seen_at) VALUES (?, ?)",
+                                     (key, seen_at))
+
+    def prune(self, before):
+        with self._lock, self._connection:
+            return self._connection.execute("DELETE FROM seen WHERE seen_at < ?", (before,)).rowcount
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class DedupCache:
+    """Memória limitada dos IDs de mensagens já processadas.
+
+    Por padrão guarda até ``max_entries`` IDs, por no máximo ``window``
+    segundos (o que vencer primeiro), num ``OrderedDict`` em ordem de chegada.
+    Com ``probabilistic=True`` usa filtros de Bloom em rodízio, de memória
+    fixa e independente do tamanho dos IDs, ao custo de descartar uma fração
+    ``error_rate`` de mensagens novas como se fossem repetidas. Com ``path``
+    os IDs também vão para um SQLite, consultado quando a memória não
+    conhece o ID (no modo probabilístico, o disco confirma os positivos).
+
+    ``claim``/``commit``/``release`` protegem o processamento: uma cópia que
+    chega enquanto a original está em andamento é descartada, e um ID só
+    fica lembrado se o processamento terminar com sucesso.
+    """
+
+    def __init__(self, max_entries=DEFAULT_DEDUP_ENTRIES, window=DEFAULT_DEDUP_WINDOW,
+                 probabilistic=False, error_rate=DEFAULT_BLOOM_ERROR_RATE, path=None):
+        self.max_entries = max_entries
+        self.window = window
+        self.duplicates = 0
+        self._seen = OrderedDict()  # id -> instante em que foi processado
+        self._bloom = RotatingBloomFilter(max_entries, error_rate, window) if probabilistic else None
+        self._store = SQLiteDedupStore(path) if path else None
+        self._stored = 0
+        self._claimed = set()  # IDs em processamento
+        self._lock = threading.Lock()
+
+    def _contains(self, key, now):
+        if self._bloom is not None:
+            if key not in self._bloom:
+                return False  # Bloom não tem falsos negativos: nem precisa do disco
+            return self._store is None or self._store.contains(key, now - self.window)
+        seen_at = self._seen.get(key)
+        if seen_at is not None and now - seen_at <= self.window:
+            return True
+        return self._store is not None and self._store.contains(key, now - self.window)
+
+    def _add(self, key, now):
+        if self._bloom is not None:
+            self._bloom.add(key)
+        else:
+            self._seen[key] = now
+            self._seen.move_to_end(key)
+            while self._seen and (len(self._seen) > self.max_entries
+                                  or now - next(iter(self._seen.values())) > self.window):
+                self._seen.popitem(last=False)
+        if self._store is not None:
+            self._store.add(key, now)
+            self._stored += 1
+            if self._stored % DEFAULT_PRUNE_EVERY == 0:
+                self._store.prune(now - self.window)
+
+    def claim(self, key):
+        """Reserva o ID para processamento; False se já foi processado ou está em andamento"""
+        now = time.time()
+        with self._lock:
+            if key in self._claimed or self._contains(key, now):
+                self.duplicates += 1
+                return False
+            self._claimed.add(key)
+            return True
+
+    def commit(self, key):
+        """Marca o ID como processado (após o sucesso do handler)"""
+        with self._lock:
+            self._claimed.discard(key)
+            self._add(key, time.time())
+
+    def release(self, key):
+        """Libera o ID sem lembrá-lo (falha no processamento: a reentrega será processada)"""
+        with self._lock:
+            self._claimed.discard(key)
+
+    def seen(self, key):
+        """Verifica e registra numa só operação: True se o ID é repetido"""
+        if not self.claim(key):
+            return True
+        self.commit(key)
+        return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'mode': 'probabilistic' if self._bloom is not None else 'exact',
+                'entries': len(self._seen) if self._bloom is None else None,
+                'memory_bytes': self._bloom.memory_bytes() if self._bloom is not None else None,
+                'in_progress': len(self._claimed),
+                'duplicates': self.duplicates,
+                'persistent': self._store is not None,
+            }
+
+    def close(self):
+        if self._store is not None:
+            self._store.close()
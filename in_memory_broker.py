@@ -0,0 +1,847 @@
+import copy
+import itertools
+import threading
+import time
+import uuid
+import weakref
+from collections import deque
+from datetime import datetime
+
+from pika import frame, spec
+from pika.exceptions import ChannelClosedByBroker, ChannelWrongStateError, ConnectionWrongStateError
+
+from message_utils import topic_matches
+
+EXCHANGE_TYPES = ('fanout', 'direct', 'topic', 'headers')
+DIRECT_REPLY_TO = 'amq.rabbitmq.reply-to'  # Pseudo-fila de respostas diretas do RabbitMQ
+AGE_UNITS = {'Y': 365 * 86400, 'M': 30 * 86400, 'D': 86400, 'h': 3600, 'm': 60, 's': 1}  # x-max-age
+
+
+def headers_match(arguments, headers):
+    """Casamento de um binding ``headers`` (``x-match`` 'all' ou 'any') com os cabeçalhos da mensagem"""
+    headers = headers or {}
+    expected = {key: value for key, value in (arguments or {}).items() if not key.startswith('x-')}
+    if not expected:
+        return True
+    matches = (key in headers and (value is None or headers[key] == value)
+               for key, value in expected.items())
+    if (arguments or {}).get('x-match', 'all') == 'any':
+        return any(matches)
+    return all(matches)
+
+
+def parse_max_age(value):
+    """Segundos de um ``x-max-age`` do RabbitMQ (ex.: ``'7D'``, ``'12h'``, ``'90s'``)"""
+    value = str(value)
+    return int(value[:-1]) * AGE_UNITS[value[-1]]
+
+
+class _Message:
+    __slots__ = ('exchange', 'routing_key', 'properties', 'body', 'redelivered', 'priority', 'expires_at',
+                 'offset', 'stored_at')
+
+    def __init__(self, exchange, routing_key, properties, body, redelivered=False):
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.properties = properties
+        self.body = body
+        self.redelivered = redelivered
+        self.priority = 0
+        self.expires_at = None  # time.monotonic() em que a mensagem expira na fila
+        self.offset = None  # Posição no log (filas stream)
+        self.stored_at = None  # time.time() em que entrou no log (filas stream)
+
+
+class _Queue:
+    def __init__(self, name, durable, exclusive_owner, arguments):
+        self.name = name
+        self.durable = durable
+        self.exclusive_owner = exclusive_owner
+        self.arguments = arguments
+        self.messages = deque()
+        self.bytes = 0  # Soma dos corpos em ``messages``, mantida a cada entrada e saída
+        self.consumers = deque()  # Rodízio entre os consumidores
+        # Fila stream: log só de acréscimo; as mensagens não saem ao serem consumidas
+        self.stream = arguments.get('x-queue-type') == 'stream'
+        self.first_offset = 0  # Offset de messages[0]
+        self.next_offset = 0  # Offset da próxima mensagem
+
+    def append(self, message):
+        self.messages.append(message)
+        self.bytes += len(message.body)
+
+    def appendleft(self, message):
+        self.messages.appendleft(message)
+        self.bytes += len(message.body)
+
+    def insert(self, index, message):
+        self.messages.insert(index, message)
+        self.bytes += len(message.body)
+
+    def popleft(self):
+        message = self.messages.popleft()
+        self.bytes -= len(message.body)
+        return message
+
+    def clear(self):
+        self.messages.clear()
+        self.bytes = 0
+
+
+class _Exchange:
+    def __init__(self, name, exchange_type, durable, arguments):
+        self.name = name
+        self.type = exchange_type
+        self.durable = durable
+        self.arguments = arguments
+        self.bindings = []  # (fila, chave de ligação, argumentos)
+
+
+class _Consumer:
+    __slots__ = ('tag', 'queue', 'channel', 'callback', 'auto_ack', 'unacked', 'active', 'offset')
+
+    def __init__(self, tag, queue, channel, callback, auto_ack):
+        self.tag = tag
+        self.queue = queue
+        self.channel = channel
+        self.callback = callback
+        self.auto_ack = auto_ack
+        self.unacked = 0
+        self.active = True
+        self.offset = None  # Próximo offset a entregar (consumidores de filas stream)
+
+    def has_capacity(self):
+        prefetch = self.channel.prefetch_count
+        return self.auto_ack or not prefetch or self.unacked < prefetch
+
+
+class InMemoryBroker:
+    """Broker AMQP em memória, com a semântica do RabbitMQ usada pelo MOM.
+
+    Implementa a parte da API do ``pika.BlockingConnection`` usada pelo MOM:
+    filas, exchanges ``fanout``/``direct``/``topic``/``headers``, bindings,
+    ``basic_get``, consumidores com prefetch, acks, contagem de mensagens e
+    confirmações de publicação. Usuários no mesmo processo trocam mensagens
+    sem socket nem serialização de frames, e testes e benchmarks rodam sem
+    RabbitMQ. As filas vivem enquanto o broker existir (duráveis dentro do
+    processo); nada é persistido em disco. Os argumentos ``x-max-length``,
+    ``x-max-length-bytes``, ``x-overflow``, ``x-message-ttl``, dead-letter e
+    ``x-max-priority`` são respeitados; ``x-queue-mode`` é aceito e ignorado.
+    Filas ``x-queue-type: stream`` são logs com offsets, retenção por
+    ``x-max-length-bytes``/``x-max-age`` (por mensagem, não por segmento) e
+    leitura a partir de ``x-stream-offset``.
+
+    As filas e as caixas de eventos das conexões são ``deque``s; um único lock
+    protege apenas o roteamento e a distribuição aos consumidores.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.queues = {}
+        self.exchanges = {'': _Exchange('', 'direct', True, {})}
+        self.blocked = None  # Motivo do alarme de recursos ativo (None se não houver)
+        self._connections = weakref.WeakSet()
+        self._reply_queues = {}  # amq.rabbitmq.reply-to.<id> -> fila privada do canal consumidor
+
+    def connect(self):
+        connection = InMemoryConnection(self)
+        with self._lock:
+            self._connections.add(connection)
+        return connection
+
+    def set_alarm(self, reason='low on memory'):
+        """Simula um alarme de memória/disco do RabbitMQ.
+
+        As conexões recebem ``Connection.Blocked`` e as publicações ficam
+        retidas (sem roteamento nem confirmação) até ``clear_alarm()``.
+        """
+        with self._lock:
+            if self.blocked is not None:
+                return
+            self.blocked = reason
+            connections = list(self._connections)
+        for connection in connections:
+            connection._notify_blocked(reason)
+
+    def clear_alarm(self):
+        """Encerra o alarme: as publicações retidas seguem e as conexões recebem ``Connection.Unblocked``"""
+        with self._lock:
+            if self.blocked is None:
+                return
+            self.blocked = None
+            connections = list(self._connections)
+        for connection in connections:
+            if connection.is_open:
+                # Na thread dona da conexão, preservando a ordem das publicações
+                connection._post(connection._unblock)
+
+    # Chamados pelos canais com o lock do broker
+
+    def _enqueue(self, queue, message):
+        """Coloca a mensagem na fila aplicando TTL, prioridade e limites.
+
+        Retorna False se a fila recusou a mensagem (``x-overflow`` ``reject-publish``).
+        """
+        if queue.stream:
+            self._append(queue, message)
+            return True
+        arguments = queue.arguments
+        self._expire(queue)
+        max_length = arguments.get('x-max-length')
+        max_bytes = arguments.get('x-max-length-bytes')
+
+        def is_full():
+            if max_length is not None and len(queue.messages) + 1 > max_length:
+                return True
+            return max_bytes is not None and queue.bytes + len(message.body) > max_bytes
+
+        if is_full():
+            overflow = arguments.get('x-overflow', 'drop-head')
+            if overflow != 'drop-head':
+                if overflow == 'reject-publish-dlx':
+                    self._dead_letter(queue, message, 'maxlen')
+                return False
+            while queue.messages and is_full():
+                self._dead_letter(queue, queue.popleft(), 'maxlen')
+            if is_full():
+                self._dead_letter(queue, message, 'maxlen')  # Maior que o limite sozinha
+                return True
+
+        ttls = [float(arguments['x-message-ttl'])] if 'x-message-ttl' in arguments else []
+        if message.properties.expiration is not None:
+            ttls.append(float(message.properties.expiration))
+        if ttls:
+            message.expires_at = time.monotonic() + min(ttls) / 1000
+
+        max_priority = arguments.get('x-max-priority')
+        if max_priority:
+            message.priority = min(message.properties.priority or 0, max_priority)
+            # Ordem decrescente de prioridade, FIFO entre mensagens de mesma prioridade
+            index = len(queue.messages)
+            while index and queue.messages[index - 1].priority < message.priority:
+                index -= 1
+            queue.insert(index, message)
+        else:
+            queue.append(message)
+        return True
+
+    def _append(self, queue, message):
+        """Acrescenta ao log da fila stream, com o offset no cabeçalho ``x-stream-offset``"""
+        message.offset = queue.next_offset
+        message.stored_at = time.time()
+        message.properties = copy.copy(message.properties)
+        message.properties.headers = dict(message.properties.headers or {}, **{'x-stream-offset': message.offset})
+        queue.append(message)
+        queue.next_offset += 1
+        max_bytes = queue.arguments.get('x-max-length-bytes')
+        max_age = queue.arguments.get('x-max-age')
+        oldest = message.stored_at - parse_max_age(max_age) if max_age else None
+        while len(queue.messages) > 1:
+            head = queue.messages[0]
+            if not ((max_bytes is not None and queue.bytes > max_bytes) or (oldest is not None and head.stored_at < oldest)):
+                break
+            queue.popleft()
+            queue.first_offset += 1
+
+    def stream_offset(self, queue, spec_value):
+        """Offset inicial de um consumidor a partir do seu ``x-stream-offset``"""
+        if spec_value is None or spec_value == 'next':
+            return queue.next_offset
+        if spec_value == 'first':
+            return queue.first_offset
+        if spec_value == 'last':
+            return max(queue.first_offset, queue.next_offset - 1)
+        if isinstance(spec_value, datetime):
+            since = spec_value.timestamp()
+            for message in queue.messages:
+                if message.stored_at >= since:
+                    return message.offset
+            return queue.next_offset
+        return max(queue.first_offset, int(spec_value))
+
+    def _expire(self, queue):
+        """Remove as mensagens expiradas do início da fila (como o RabbitMQ)"""
+        now = None
+        while queue.messages and queue.messages[0].expires_at is not None:
+            now = now or time.monotonic()
+            if queue.messages[0].expires_at > now:
+                break
+            self._dead_letter(queue, queue.popleft(), 'expired')
+
+    def _dead_letter(self, queue, message, reason):
+        """Republica a mensagem no ``x-dead-letter-exchange`` da fila, se houver"""
+        exchange = self.exchanges.get(queue.arguments.get('x-dead-letter-exchange'))
+        if exchange is None:
+            return
+        routing_key = queue.arguments.get('x-dead-letter-routing-key', message.routing_key)
+        properties = copy.copy(message.properties)
+        properties.expiration = None
+        properties.headers = dict(properties.headers or {},
+                                  **{'x-first-death-queue': queue.name, 'x-first-death-reason': reason,
+                                     'x-first-death-exchange': message.exchange})
+        for target in self._route(exchange, routing_key, properties):
+            if target is not queue:
+                self._enqueue(target, _Message(exchange.name, routing_key, properties, message.body))
+                self._dispatch(target)
+
+    def _route(self, exchange, routing_key, properties):
+        if exchange.name == '':
+            queue = self.queues.get(routing_key) or self._reply_queues.get(routing_key)
+            return [queue] if queue is not None else []
+        targets = {}
+        for queue_name, binding_key, arguments in exchange.bindings:
+            if exchange.type == 'fanout':
+                matched = True
+            elif exchange.type == 'direct':
+                matched = binding_key == routing_key
+            elif exchange.type == 'topic':
+                matched = topic_matches(binding_key, routing_key)
+            else:
+                matched = headers_match(arguments, properties.headers)
+            if matched and queue_name in self.queues:
+                targets[queue_name] = self.queues[queue_name]
+        return list(targets.values())
+
+    def _dispatch(self, queue):
+        """Entrega as mensagens prontas aos consumidores com capacidade (rodízio)"""
+        consumers = queue.consumers
+        if queue.stream:
+            # Cada consumidor lê o log a partir do seu próprio offset
+            for consumer in list(consumers):
+                while consumer.has_capacity() and consumer.offset < queue.next_offset:
+                    consumer.offset = max(consumer.offset, queue.first_offset)
+                    message = queue.messages[consumer.offset - queue.first_offset]
+                    consumer.offset += 1
+                    consumer.channel._deliver(consumer, message)
+            return
+        if consumers:
+            self._expire(queue)
+        while queue.messages and consumers:
+            for _ in range(len(consumers)):
+                consumer = consumers[0]
+                consumers.rotate(-1)
+                if consumer.has_capacity():
+                    break
+            else:
+                return  # Todos os consumidores atingiram o prefetch
+            message = queue.popleft()
+            consumer.channel._deliver(consumer, message)
+
+    def _delete_queue(self, queue):
+        del self.queues[queue.name]
+        for exchange in self.exchanges.values():
+            exchange.bindings = [binding for binding in exchange.bindings if binding[0] != queue.name]
+        for consumer in list(queue.consumers):
+            consumer.active = False
+            consumer.channel._consumers.pop(consumer.tag, None)
+        queue.consumers.clear()
+        return len(queue.messages)
+
+
+class InMemoryConnection:
+    """Conexão em memória com a interface do ``pika.BlockingConnection`` usada pelo MOM"""
+
+    _channel_numbers = itertools.count(1)
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.is_open = True
+        self._channels = []
+        self._events = deque()  # (função, argumentos) a executar em process_data_events
+        self._wakeup = threading.Event()
+        self._blocked_callbacks = []
+        self._unblocked_callbacks = []
+        self._held = deque()  # (canal, argumentos) de publicações retidas pelo alarme
+
+    @property
+    def is_closed(self):
+        return not self.is_open
+
+    def channel(self, channel_number=None):
+        if not self.is_open:
+            raise ConnectionWrongStateError('Conexão fechada.')
+        channel = InMemoryChannel(self, channel_number or next(self._channel_numbers))
+        self._channels.append(channel)
+        return channel
+
+    def _post(self, function, *args):
+        self._events.append((function, args))
+        self._wakeup.set()
+
+    def add_callback_threadsafe(self, callback):
+        if not self.is_open:
+            raise ConnectionWrongStateError('Conexão fechada.')
+        self._post(callback)
+
+    def add_on_connection_blocked_callback(self, callback):
+        self._blocked_callbacks.append(callback)
+        reason = self.broker.blocked
+        if reason is not None:
+            # Alarme já ativo: o RabbitMQ bloqueia a conexão na primeira publicação
+            self._post(callback, self, frame.Method(0, spec.Connection.Blocked(reason)))
+
+    def add_on_connection_unblocked_callback(self, callback):
+        self._unblocked_callbacks.append(callback)
+
+    def _notify_blocked(self, reason):
+        if not self.is_open:
+            return
+        method_frame = frame.Method(0, spec.Connection.Blocked(reason))
+        for callback in self._blocked_callbacks:
+            self._post(callback, self, method_frame)
+
+    def _unblock(self):
+        if self.broker.blocked is not None:
+            return  # Novo alarme antes de a conexão ser liberada
+        while self._held:
+            channel, args = self._held.popleft()
+            if channel.is_open:
+                try:
+                    channel._publish(*args)
+                except ChannelClosedByBroker:
+                    pass  # Exchange inexistente: o canal foi fechado, como no RabbitMQ
+        method_frame = frame.Method(0, spec.Connection.Unblocked())
+        for callback in self._unblocked_callbacks:
+            callback(self, method_frame)
+
+    def process_data_events(self, time_limit=0):
+        """Executa os eventos pendentes; espera até ``time_limit`` segundos se não houver nenhum"""
+        if not self.is_open:
+            raise ConnectionWrongStateError('Conexão fechada.')
+        deadline = None if time_limit is None else time.monotonic() + time_limit
+        while not self._events:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return
+            self._wakeup.wait(remaining)
+            self._wakeup.clear()
+        for _ in range(len(self._events)):
+            function, args = self._events.popleft()
+            function(*args)
+
+    def sleep(self, duration):
+        self.process_data_events(time_limit=duration)
+
+    def close(self, reply_code=200, reply_text='Normal shutdown'):
+        if not self.is_open:
+            return
+        for channel in list(self._channels):
+            channel.close()
+        with self.broker._lock:
+            for queue in list(self.broker.queues.values()):
+                if queue.exclusive_owner is self:
+                    self.broker._delete_queue(queue)
+        self.is_open = False
+        self._events.clear()
+        self._wakeup.set()
+
+
+class _ChannelImpl:
+    """Parte da API assíncrona (``channel._impl``) usada pelo ConfirmPublisher"""
+
+    def __init__(self, channel):
+        self._channel = channel
+
+    def confirm_delivery(self, ack_nack_callback, callback=None):
+        self._channel._confirm_callback = ack_nack_callback
+        if callback is not None:
+            self._channel.connection._post(callback, frame.Method(self._channel.channel_number,
+                                                                  spec.Confirm.SelectOk()))
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        self._channel.basic_publish(exchange, routing_key, body, properties, mandatory)
+
+    def _call(self, declare, callback, *args, **kwargs):
+        """Executa a declaração e agenda ``callback``; se o broker fechar o canal, não há resposta"""
+        try:
+            result = declare(*args, **kwargs)
+        except ChannelClosedByBroker:
+            return
+        if callback is not None:
+            self._channel.connection._post(callback, result)
+
+    def queue_declare(self, queue, passive=False, durable=False, exclusive=False,
+                      auto_delete=False, arguments=None, callback=None):
+        self._call(self._channel.queue_declare, callback, queue, passive, durable,
+                   exclusive, auto_delete, arguments)
+
+    def exchange_declare(self, exchange, exchange_type='direct', passive=False, durable=False,
+                         auto_delete=False, internal=False, arguments=None, callback=None):
+        self._call(self._channel.exchange_declare, callback, exchange, exchange_type, passive,
+                   durable, auto_delete, internal, arguments)
+
+
+class InMemoryChannel:
+    """Canal em memória com a interface do ``pika.BlockingChannel`` usada pelo MOM"""
+
+    def __init__(self, connection, channel_number):
+        self.connection = connection
+        self.broker = connection.broker
+        self.channel_number = channel_number
+        self.is_open = True
+        self.prefetch_count = 0
+        self._impl = _ChannelImpl(self)
+        self._consumers = {}  # consumer tag -> _Consumer
+        self._unacked = {}  # delivery tag -> (consumidor ou None, fila, mensagem)
+        self._delivery_tags = itertools.count(1)
+        self._publish_tags = itertools.count(1)
+        self._confirm_callback = None
+        self._generator = None  # (consumer tag, mensagens recebidas ainda não entregues)
+        self._generator_tag = 0  # Última entrega de ``consume()`` passada à aplicação
+        self._reply_queue = None  # Fila privada do consumidor de amq.rabbitmq.reply-to
+
+    @property
+    def is_closed(self):
+        return not self.is_open
+
+    def _check_open(self):
+        if not self.is_open:
+            raise ChannelWrongStateError('Canal fechado.')
+
+    def _fail(self, reply_code, reply_text):
+        """Fecha o canal como o broker faria e levanta o erro correspondente"""
+        self._close(requeue=True)
+        raise ChannelClosedByBroker(reply_code, reply_text)
+
+    def _get_queue(self, queue_name):
+        queue = self.broker.queues.get(queue_name)
+        if queue is None:
+            self._fail(404, f"NOT_FOUND - no queue '{queue_name}' in vhost '/'")
+        return queue
+
+    def _get_exchange(self, exchange_name):
+        exchange = self.broker.exchanges.get(exchange_name)
+        if exchange is None:
+            self._fail(404, f"NOT_FOUND - no exchange '{exchange_name}' in vhost '/'")
+        return exchange
+
+    # Declarações
+
+    def queue_declare(self, queue='', passive=False, durable=False, exclusive=False,
+                      auto_delete=False, arguments=None):
+        self._check_open()
+        arguments = dict(arguments or {})
+        with self.broker._lock:
+            existing = self.broker.queues.get(queue) if queue else None
+            if passive:
+                existing = self._get_queue(queue)
+            elif existing is None:
+                queue = queue or f"amq.gen-{uuid.uuid4().hex}"
+                owner = self.connection if exclusive else None
+                existing = self.broker.queues[queue] = _Queue(queue, durable, owner, arguments)
+            elif existing.durable != durable or existing.arguments != arguments:
+                self._fail(406, f"PRECONDITION_FAILED - inequivalent arg for queue '{queue}' in vhost '/'")
+            self.broker._expire(existing)
+            return frame.Method(self.channel_number, spec.Queue.DeclareOk(
+                existing.name, len(existing.messages), len(existing.consumers)))
+
+    def exchange_declare(self, exchange, exchange_type='direct', passive=False, durable=False,
+                         auto_delete=False, internal=False, arguments=None):
+        self._check_open()
+        exchange_type = getattr(exchange_type, 'value', exchange_type)
+        arguments = dict(arguments or {})
+        with self.broker._lock:
+            existing = self.broker.exchanges.get(exchange)
+            if passive:
+                self._get_exchange(exchange)
+            elif existing is None:
+                if exchange_type not in EXCHANGE_TYPES:
+                    self._fail(503, f"COMMAND_INVALID - unknown exchange type '{exchange_type}'")
+                self.broker.exchanges[exchange] = _Exchange(exchange, exchange_type, durable, arguments)
+            elif existing.type != exchange_type or existing.durable != durable:
+                self._fail(406, f"PRECONDITION_FAILED - inequivalent arg 'type' for exchange '{exchange}' in vhost '/'")
+            return frame.Method(self.channel_number, spec.Exchange.DeclareOk())
+
+    def queue_delete(self, queue, if_unused=False, if_empty=False):
+        self._check_open()
+        with self.broker._lock:
+            existing = self.broker.queues.get(queue)
+            message_count = self.broker._delete_queue(existing) if existing is not None else 0
+            return frame.Method(self.channel_number, spec.Queue.DeleteOk(message_count))
+
+    def exchange_delete(self, exchange=None, if_unused=False):
+        self._check_open()
+        with self.broker._lock:
+            if exchange:
+                self.broker.exchanges.pop(exchange, None)
+            return frame.Method(self.channel_number, spec.Exchange.DeleteOk())
+
+    def queue_purge(self, queue):
+        self._check_open()
+        with self.broker._lock:
+            existing = self._get_queue(queue)
+            message_count = len(existing.messages)
+            existing.clear()
+            return frame.Method(self.channel_number, spec.Queue.PurgeOk(message_count))
+
+    def queue_bind(self, queue, exchange, routing_key=None, arguments=None):
+        self._check_open()
+        routing_key = queue if routing_key is None else routing_key
+        with self.broker._lock:
+            self._get_queue(queue)
+            target = self._get_exchange(exchange)
+            binding = (queue, routing_key, dict(arguments or {}))
+            if binding not in target.bindings:
+                target.bindings.append(binding)
+            return frame.Method(self.channel_number, spec.Queue.BindOk())
+
+    def queue_unbind(self, queue, exchange=None, routing_key=None, arguments=None):
+        self._check_open()
+        routing_key = queue if routing_key is None else routing_key
+        with self.broker._lock:
+            target = self.broker.exchanges.get(exchange)
+            if target is not None:
+                binding = (queue, routing_key, dict(arguments or {}))
+                target.bindings = [item for item in target.bindings if item != binding]
+            return frame.Method(self.channel_number, spec.Queue.UnbindOk())
+
+    # Publicação
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        self._check_open()
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        properties = properties or spec.BasicProperties()
+        if properties.reply_to == DIRECT_REPLY_TO:
+            # Direct reply-to: a resposta volta direto ao consumidor deste canal
+            if self._reply_queue is None:
+                self._fail(406, "PRECONDITION_FAILED - fast reply consumer does not exist")
+            properties = copy.copy(properties)
+            properties.reply_to = self._reply_queue.name
+        if self.broker.blocked is not None or self.connection._held:
+            # Conexão bloqueada pelo alarme: o broker deixa de ler as publicações
+            self.connection._held.append((self, (exchange, routing_key, body, properties)))
+            return
+        self._publish(exchange, routing_key, body, properties)
+
+    def _publish(self, exchange, routing_key, body, properties):
+        with self.broker._lock:
+            target = self._get_exchange(exchange)
+            queues = self.broker._route(target, routing_key, properties)
+            accepted = True
+            for queue in queues:
+                accepted &= self.broker._enqueue(queue, _Message(exchange, routing_key, properties, body))
+                self.broker._dispatch(queue)
+        if self._confirm_callback is not None:
+            # Uma fila cheia com reject-publish recusa a mensagem: Basic.Nack
+            confirm = spec.Basic.Ack if accepted else spec.Basic.Nack
+            self.connection._post(self._confirm_callback, frame.Method(
+                self.channel_number, confirm(delivery_tag=next(self._publish_tags))))
+
+    def confirm_delivery(self):
+        self._check_open()
+        self._confirm_callback = lambda method_frame: None
+
+    # Consumo
+
+    def basic_qos(self, prefetch_size=0, prefetch_count=0, global_qos=False):
+        self._check_open()
+        with self.broker._lock:
+            self.prefetch_count = prefetch_count
+            for consumer in self._consumers.values():
+                self.broker._dispatch(consumer.queue)
+
+    def basic_get(self, queue, auto_ack=False):
+        self._check_open()
+        with self.broker._lock:
+            existing = self._get_queue(queue)
+            if existing.stream:
+                self._fail(540, f"NOT_IMPLEMENTED - queue '{queue}' in vhost '/' does not support basic.get")
+            self.broker._expire(existing)
+            if not existing.messages:
+                return None, None, None
+            message = existing.popleft()
+            delivery_tag = next(self._delivery_tags)
+            if not auto_ack:
+                self._unacked[delivery_tag] = (None, existing, message)
+            method = spec.Basic.GetOk(delivery_tag, message.redelivered, message.exchange,
+                                      message.routing_key, len(existing.messages))
+        return method, message.properties, message.body
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False, exclusive=False,
+                      consumer_tag=None, arguments=None):
+        self._check_open()
+        if queue == DIRECT_REPLY_TO:
+            return self._consume_replies(on_message_callback, auto_ack, consumer_tag)
+        with self.broker._lock:
+            existing = self._get_queue(queue)
+            consumer_tag = consumer_tag or f"ctag{self.channel_number}.{uuid.uuid4().hex}"
+            consumer = _Consumer(consumer_tag, existing, self, on_message_callback, auto_ack)
+            if existing.stream:
+                if auto_ack:
+                    self._fail(406, "PRECONDITION_FAILED - stream queues require manual acknowledgement")
+                if not self.prefetch_count:
+                    self._fail(406, "PRECONDITION_FAILED - consumer prefetch count is not set for stream")
+                consumer.offset = self.broker.stream_offset(existing, (arguments or {}).get('x-stream-offset'))
+            self._consumers[consumer_tag] = consumer
+            existing.consumers.append(consumer)
+            self.broker._dispatch(existing)
+        return consumer_tag
+
+    def _consume_replies(self, on_message_callback, auto_ack, consumer_tag):
+        """Consumidor de ``amq.rabbitmq.reply-to``: sem ack e um por canal, como no RabbitMQ"""
+        if not auto_ack:
+            self._fail(406, "PRECONDITION_FAILED - reply consumer cannot acknowledge")
+        if self._reply_queue is not None:
+            self._fail(406, "PRECONDITION_FAILED - reply consumer already set")
+        with self.broker._lock:
+            reply_queue = _Queue(f"{DIRECT_REPLY_TO}.{uuid.uuid4().hex}", False, self.connection, {})
+            consumer_tag = consumer_tag or f"ctag{self.channel_number}.{uuid.uuid4().hex}"
+            consumer = _Consumer(consumer_tag, reply_queue, self, on_message_callback, True)
+            self._consumers[consumer_tag] = consumer
+            reply_queue.consumers.append(consumer)
+            self._reply_queue = self.broker._reply_queues[reply_queue.name] = reply_queue
+        return consumer_tag
+
+    def _deliver(self, consumer, message):
+        """Registra a entrega (com o lock do broker) e agenda o callback na thread da conexão"""
+        delivery_tag = next(self._delivery_tags)
+        if not consumer.auto_ack:
+            consumer.unacked += 1
+            self._unacked[delivery_tag] = (consumer, consumer.queue, message)
+        method = spec.Basic.Deliver(consumer.tag, delivery_tag, message.redelivered,
+                                    message.exchange, message.routing_key)
+        self.connection._post(self._run_callback, consumer, method, message)
+
+    def _run_callback(self, consumer, method, message):
+        if consumer.active and self.is_open:
+            consumer.callback(self, method, message.properties, message.body)
+        elif not consumer.auto_ack and self.is_open and method.delivery_tag in self._unacked:
+            # Consumidor cancelado antes da entrega: a mensagem volta para a fila
+            self.basic_nack(method.delivery_tag, requeue=True)
+
+    def basic_cancel(self, consumer_tag=''):
+        with self.broker._lock:
+            consumer = self._consumers.pop(consumer_tag, None)
+            if consumer is not None:
+                consumer.active = False
+                try:
+                    consumer.queue.consumers.remove(consumer)
+                except ValueError:
+                    pass
+                if consumer.queue is self._reply_queue:
+                    # Respostas que chegarem depois são descartadas
+                    self.broker._reply_queues.pop(consumer.queue.name, None)
+                    self._reply_queue = None
+        return []
+
+    def _settle(self, delivery_tag, multiple, requeue, rejected=False):
+        if not self.is_open:
+            raise ChannelWrongStateError('Canal fechado.')
+        with self.broker._lock:
+            if multiple:
+                tags = [tag for tag in self._unacked if tag <= delivery_tag or delivery_tag == 0]
+            else:
+                tags = [delivery_tag]
+            self._settle_tags(tags, multiple, requeue, rejected)
+
+    def _settle_tags(self, tags, multiple, requeue, rejected):
+        """Confirma ou devolve ``tags`` de uma vez: as devolvidas voltam à fila na ordem de entrega"""
+        with self.broker._lock:
+            queues = {}
+            requeued = []
+            for tag in tags:
+                entry = self._unacked.pop(tag, None)
+                if entry is None:
+                    if not multiple:
+                        self._fail(406, f"PRECONDITION_FAILED - unknown delivery tag {tag}")
+                    continue
+                consumer, queue, message = entry
+                if consumer is not None:
+                    consumer.unacked -= 1
+                if queue.stream:
+                    pass  # A mensagem continua no log: nada a reenfileirar
+                elif requeue:
+                    message.redelivered = True
+                    requeued.append((queue, message))
+                elif rejected:
+                    self.broker._dead_letter(queue, message, 'rejected')
+                queues[queue.name] = queue
+            for queue, message in reversed(requeued):
+                if queue.name in self.broker.queues:
+                    queue.appendleft(message)
+            for queue in queues.values():
+                self.broker._dispatch(queue)
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self._settle(delivery_tag, multiple, requeue=False)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self._settle(delivery_tag, multiple, requeue, rejected=True)
+
+    def basic_reject(self, delivery_tag=0, requeue=True):
+        self._settle(delivery_tag, False, requeue, rejected=True)
+
+    def consume(self, queue, auto_ack=False, exclusive=False, arguments=None, inactivity_timeout=None):
+        """Gerador de ``(method, properties, body)``; ``(None, None, None)`` após ``inactivity_timeout``"""
+        if self._generator is None:
+            pending = deque()
+            consumer_tag = self.basic_consume(
+                queue, lambda channel, method, properties, body: pending.append((method, properties, body)),
+                auto_ack=auto_ack, arguments=arguments
+            )
+            self._generator = (consumer_tag, pending)
+            self._generator_tag = 0
+        pending = self._generator[1]
+        while self._generator is not None:
+            deadline = None if inactivity_timeout is None else time.monotonic() + inactivity_timeout
+            while not pending and self._generator is not None:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self.connection.process_data_events(time_limit=remaining if remaining is not None else 1.0)
+            if pending:
+                delivery = pending.popleft()
+                self._generator_tag = delivery[0].delivery_tag
+                yield delivery
+            elif self._generator is not None:
+                yield None, None, None
+
+    def cancel(self):
+        """Cancela o consumidor de ``consume()`` devolvendo à fila as mensagens ainda não entregues"""
+        if self._generator is None:
+            return 0
+        consumer_tag, pending = self._generator
+        self._generator = None
+        consumer = self._consumers.get(consumer_tag)
+        requeued = 0
+        with self.broker._lock:
+            self.basic_cancel(consumer_tag)
+            if consumer is not None and not consumer.auto_ack and self.is_open:
+                # As do buffer e as ainda agendadas na conexão; as já passadas à aplicação ficam com ela
+                tags = sorted(tag for tag, (owner, _, _) in self._unacked.items()
+                              if owner is consumer and tag > self._generator_tag)
+                self._settle_tags(tags, True, requeue=True, rejected=True)
+                requeued = len(tags)
+        pending.clear()
+        return requeued
+
+    def _close(self, requeue):
+        if not self.is_open:
+            return
+        with self.broker._lock:
+            for consumer_tag in list(self._consumers):
+                self.basic_cancel(consumer_tag)
+            self._generator = None
+            if requeue and self._unacked:
+                self._settle(0, True, requeue=True)
+            self.is_open = False
+        if self in self.connection._channels:
+            self.connection._channels.remove(self)
+
+    def close(self, reply_code=0, reply_text='Normal shutdown'):
+        # Mensagens não confirmadas voltam para a fila, como no RabbitMQ
+        self._close(requeue=True)
+
+
+_default_broker = None
+_default_broker_lock = threading.Lock()
+
+def get_in_memory_broker():
+    """Retorna o broker em memória compartilhado pelo processo"""
+    global _default_broker
+    if _default_broker is None:
+        with _default_broker_lock:
+            if _default_broker is None:
+                _default_broker = InMemoryBroker()
+    return _default_broker
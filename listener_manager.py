@@ -0,0 +1,455 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, BrokenExecutor
+from functools import partial
+
+from message_utils import get_rabbitmq_connection, close_rabbitmq_connection
+from dedup import message_key
+from metrics import metrics
+
+DEFAULT_POLL_INTERVAL = 0.2  # Segundos entre verificações de parada da thread de I/O
+DEFAULT_RECONNECT_DELAY = 2.0  # Segundos antes de reconectar após uma falha
+DEFAULT_REGISTER_TIMEOUT = 10.0  # Segundos para registrar/cancelar um consumidor
+DEFAULT_HANDLER_PREFETCH = 32  # Mensagens não confirmadas por consumidor com handler
+DEFAULT_DRAIN_TIMEOUT = 10.0  # Segundos aguardando handlers em andamento ao encerrar
+
+
+class ListenerManager:
+    """Consome várias filas e tópicos numa única conexão e numa única thread de I/O.
+
+    Cada consumidor recebe um canal próprio na conexão compartilhada e é
+    identificado por um ``consumer_id`` estável (ex.: ``alice:topic:noticias``).
+    Consumidores podem ser adicionados e removidos em tempo de execução a
+    partir de qualquer thread; as operações são executadas na thread de I/O
+    via ``add_callback_threadsafe``. Após uma queda de conexão, os
+    consumidores registrados são recriados automaticamente.
+
+    Consumidores com ``handler`` não processam as mensagens na thread de I/O:
+    o corpo é enviado a um executor (threads ou processos), com prefetch
+    limitado e ack manual feito na thread de I/O quando o handler termina.
+    """
+
+    def __init__(self, connection_factory=None, poll_interval=DEFAULT_POLL_INTERVAL,
+                 reconnect_delay=DEFAULT_RECONNECT_DELAY):
+        self.connection_factory = connection_factory or get_rabbitmq_connection
+        self.poll_interval = poll_interval
+        self.reconnect_delay = reconnect_delay
+        self.thread = None
+        self._connection = None
+        self._consumers = {}  # consumer_id -> especificação, canal e estatísticas
+        self._lock = threading.Lock()
+        self._running = False
+        self._ready = threading.Event()
+        self._stopped = threading.Event()
+
+    def start(self, timeout=DEFAULT_REGISTER_TIMEOUT):
+        """Inicia a thread de I/O (se ainda não estiver rodando)"""
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            self._ready.clear()
+            self._stopped.clear()
+            self.thread = threading.Thread(target=self._run, name='mom-listeners', daemon=True)
+            self.thread.start()
+        self._ready.wait(timeout)
+
+    def is_running(self):
+        return self._running
+
+    def _run(self):
+        while self._running:
+            try:
+                self._connection = self.connection_factory()
+                for consumer_id in list(self._consumers):
+                    try:
+                        self._register(consumer_id)
+                    except Exception as e:
+                        print(f"Erro ao registrar o consumidor '{consumer_id}': {e}")
+                self._ready.set()
+                while self._running:
+                    self._connection.process_data_events(time_limit=self.poll_interval)
+            except Exception as e:
+                if not self._running:
+                    break
+                print(f"Erro na conexão dos listeners: {e}. Reconectando em {self.reconnect_delay}s...")
+                self._ready.clear()
+                self._mark_inactive()
+                self._stopped.wait(self.reconnect_delay)
+        self._shutdown()
+
+    def _shutdown(self):
+        """Cancela todos os consumidores e fecha a conexão (na thread de I/O)"""
+        connection, self._connection = self._connection, None
+        try:
+            if connection is not None and connection.is_open:
+                for consumer_id in list(self._consumers):
+                    self._unregister(consumer_id)
+                # Aguarda os handlers em andamento para enviar os seus acks
+                deadline = time.monotonic() + DEFAULT_DRAIN_TIMEOUT
+                while self._in_flight() and time.monotonic() < deadline:
+                    connection.process_data_events(time_limit=self.poll_interval)
+                close_rabbitmq_connection(connection)
+        except Exception as e:
+            print(f"Erro ao encerrar a conexão dos listeners: {e}")
+        self._mark_inactive()
+        self._ready.clear()
+        self._stopped.set()
+
+    def _mark_inactive(self):
+        with self._lock:
+            for consumer in self._consumers.values():
+                consumer['channel'] = None
+                consumer['stats']['active'] = False
+                consumer['stats']['consumer_tag'] = None
+
+    def call_threadsafe(self, function, *args):
+        """Agenda ``function(*args)`` na thread de I/O e retorna um Future com o resultado"""
+        future = Future()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(function(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+        if threading.current_thread() is self.thread:
+            run()
+        elif self._connection is None or not self._ready.is_set():
+            future.set_exception(RuntimeError("Conexão dos listeners indisponível."))
+        else:
+            self._connection.add_callback_threadsafe(run)
+        return future
+
+    def add_consumer(self, consumer_id, queue_name, on_message=None, setup=None,
+                     auto_ack=True, prefetch_count=0, handler=None, executor=None,
+                     requeue_on_error=False, reply_to_sender=False, arguments=None, dedup=None,
+                     timeout=DEFAULT_REGISTER_TIMEOUT):
+        """Registra um consumidor e retorna o seu consumer tag.
+
+        ``on_message(channel, method, properties, body)`` é chamado na thread de
+        I/O. Com ``handler``, ``handler(method, properties, body)`` roda no ``executor`` (padrão: o
+        executor compartilhado) e a mensagem recebe ack quando ele termina, ou
+        nack se ele falhar (reenfileirada se ``requeue_on_error`` ou se o
+        executor quebrar). Com ``reply_to_sender``, o retorno do handler,
+        ``(corpo, propriedades)``, é publicado no ``reply_to`` da mensagem antes
+        do ack. ``setup(channel)``, se informado, é executado antes do consumo
+        (declarações, binds) e pode retornar o nome da fila a consumir.
+        ``arguments`` vai no ``basic_consume`` (ex.: ``x-stream-offset``); se for
+        uma função, é chamada a cada registro, inclusive após reconexões.
+        Com ``dedup`` (um ``DedupCache``), mensagens já processadas ou em
+        processamento são confirmadas e descartadas sem chegar ao callback;
+        o ID só é lembrado quando o callback ou o handler termina sem erro.
+        """
+        if handler is not None:
+            auto_ack = False
+            prefetch_count = prefetch_count or DEFAULT_HANDLER_PREFETCH
+            executor = executor or get_handler_executor()
+        elif on_message is None:
+            raise ValueError("Informe on_message ou handler.")
+
+        with self._lock:
+            if consumer_id in self._consumers:
+                raise ValueError(f"Consumidor '{consumer_id}' já registrado.")
+            self._consumers[consumer_id] = {
+                'queue': queue_name,
+                'on_message': on_message,
+                'handler': handler,
+                'executor': executor,
+                'requeue_on_error': requeue_on_error,
+                'reply_to_sender': reply_to_sender,
+                'setup': setup,
+                'arguments': arguments,
+                'dedup': dedup,
+                'auto_ack': auto_ack,
+                'prefetch_count': prefetch_count,
+                'channel': None,
+                'closing': False,
+                'stats': {
+                    'queue': queue_name,
+                    'consumer_tag': None,
+                    'active': False,
+                    'delivered': 0,
+                    'bytes': 0,
+                    'errors': 0,
+                    'in_flight': 0,
+                    'acked': 0,
+                    'nacked': 0,
+                    'duplicates': 0,
+                    'started_at': time.time(),
+                    'last_delivery_at': None,
+                },
+            }
+
+        self.start()
+        try:
+            return self.call_threadsafe(self._register, consumer_id).result(timeout)
+        except Exception:
+            with self._lock:
+                self._consumers.pop(consumer_id, None)
+            raise
+
+    def remove_consumer(self, consumer_id, timeout=DEFAULT_REGISTER_TIMEOUT):
+        """Cancela o consumidor (basic_cancel) e fecha o seu canal"""
+        if consumer_id not in self._consumers:
+            return False
+        try:
+            self.call_threadsafe(self._unregister, consumer_id).result(timeout)
+        except RuntimeError:
+            pass  # Sem conexão: não há consumidor ativo no broker
+        with self._lock:
+            self._consumers.pop(consumer_id, None)
+        return True
+
+    def _register(self, consumer_id):
+        consumer = self._consumers[consumer_id]
+        if consumer['channel'] is not None:
+            return consumer['stats']['consumer_tag']  # Já registrado na (re)conexão
+        consumer['closing'] = False
+        channel = self._connection.channel()
+        try:
+            queue_name = consumer['queue']
+            if consumer['setup']:
+                queue_name = consumer['setup'](channel) or queue_name
+            if consumer['prefetch_count']:
+                channel.basic_qos(prefetch_count=consumer['prefetch_count'])
+
+            stats = consumer['stats']
+            on_message = consumer['on_message']
+            dedup = consumer['dedup']
+
+            def callback(ch, method, properties, body):
+                stats['delivered'] += 1
+                stats['bytes'] += len(body)
+                stats['last_delivery_at'] = time.time()
+                key = None
+                if dedup is not None:
+                    key = message_key(properties, body)
+                    if not dedup.claim(key):
+                        self._discard_duplicate(consumer, ch, method)
+                        return
+                if consumer['handler'] is not None:
+                    self._dispatch(consumer, ch, method, properties, body, key)
+                    return
+                try:
+                    on_message(ch, method, properties, body)
+                except Exception as e:
+                    stats['errors'] += 1
+                    if key is not None:
+                        dedup.release(key)
+                    print(f"Erro no consumidor '{consumer_id}': {e}")
+                else:
+                    if key is not None:
+                        dedup.commit(key)
+
+            arguments = consumer['arguments']
+            if callable(arguments):
+                arguments = arguments()
+            consumer_tag = channel.basic_consume(
+                queue=queue_name, on_message_callback=callback, auto_ack=consumer['auto_ack'],
+                arguments=arguments
+            )
+        except Exception:
+            if channel.is_open:
+                channel.close()
+            raise
+
+        consumer['channel'] = channel
+        stats['queue'] = queue_name
+        stats['consumer_tag'] = consumer_tag
+        stats['active'] = True
+        return consumer_tag
+
+    def _discard_duplicate(self, consumer, channel, method):
+        """Confirma uma mensagem repetida sem processá-la"""
+        stats = consumer['stats']
+        stats['duplicates'] += 1
+        metrics.inc('mom_messages_deduplicated_total', kind='queue', name=stats['queue'])
+        if not consumer['auto_ack']:
+            channel.basic_ack(delivery_tag=method.delivery_tag)
+            stats['acked'] += 1
+
+    def _dispatch(self, consumer, channel, method, properties, body, key=None):
+        """Envia a mensagem ao executor; o ack/nack volta para a thread de I/O"""
+        stats = consumer['stats']
+        connection = self._connection
+        try:
+            future = consumer['executor'].submit(consumer['handler'], method, properties, body)
+        except Exception as e:
+            if key is not None:
+                consumer['dedup'].release(key)
+            stats['errors'] += 1
+            print(f"Erro ao despachar mensagem da fila '{stats['queue']}': {e}")
+            channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            stats['nacked'] += 1
+            return
+        stats['in_flight'] += 1
+
+        def done(completed):
+            try:
+                connection.add_callback_threadsafe(
+                    partial(self._settle, consumer, channel, method.delivery_tag, completed, properties, key)
+                )
+            except Exception:
+                pass  # Conexão já fechada: o broker reentrega a mensagem
+
+        future.add_done_callback(done)
+
+    def _settle(self, consumer, channel, delivery_tag, future, properties=None, key=None):
+        """Confirma (ou rejeita) a mensagem após o handler terminar"""
+        stats = consumer['stats']
+        stats['in_flight'] -= 1
+        if key is not None:
+            # Só um processamento bem-sucedido torna o ID conhecido
+            if future.exception() is None:
+                consumer['dedup'].commit(key)
+            else:
+                consumer['dedup'].release(key)
+        # Canal de uma conexão anterior: as delivery tags não valem mais
+        if channel.is_open:
+            error = future.exception()
+            if error is None and consumer['reply_to_sender']:
+                self._reply(channel, properties, future.result())
+            if error is None:
+                channel.basic_ack(delivery_tag=delivery_tag)
+                stats['acked'] += 1
+            else:
+                stats['errors'] += 1
+                requeue = consumer['requeue_on_error'] or isinstance(error, BrokenExecutor)
+                channel.basic_nack(delivery_tag=delivery_tag, requeue=requeue)
+                stats['nacked'] += 1
+                print(f"Erro no handler da fila '{stats['queue']}': {error}")
+            if consumer['closing'] and stats['in_flight'] == 0:
+                channel.close()
+
+    def _reply(self, channel, properties, reply):
+        """Publica a resposta do handler no ``reply_to`` da requisição"""
+        if reply is None or properties is None or not properties.reply_to:
+            return
+        body, reply_properties = reply
+        channel.basic_publish(exchange='', routing_key=properties.reply_to, body=body,
+                              properties=reply_properties)
+
+    def publish(self, consumer_id, exchange, routing_key, body, properties=None):
+        """Publica no canal do consumidor (na thread de I/O) e retorna um Future.
+
+        Necessário para o direct reply-to do RabbitMQ: a requisição precisa
+        sair do mesmo canal que consome ``amq.rabbitmq.reply-to``.
+        """
+        return self.call_threadsafe(self._publish, consumer_id, exchange, routing_key, body, properties)
+
+    def _publish(self, consumer_id, exchange, routing_key, body, properties):
+        consumer = self._consumers.get(consumer_id)
+        channel = consumer['channel'] if consumer is not None else None
+        if channel is None or not channel.is_open:
+            raise RuntimeError(f"Consumidor '{consumer_id}' sem canal ativo.")
+        channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body, properties=properties)
+
+    def _unregister(self, consumer_id):
+        consumer = self._consumers.get(consumer_id)
+        if consumer is None or consumer['channel'] is None:
+            return
+        channel = consumer['channel']
+        consumer['channel'] = None
+        consumer['stats']['active'] = False
+        if channel.is_open:
+            channel.basic_cancel(consumer['stats']['consumer_tag'])
+            if consumer['stats']['in_flight']:
+                # Fecha o canal só depois dos acks dos handlers em andamento
+                consumer['closing'] = True
+            else:
+                channel.close()
+
+    def _in_flight(self):
+        with self._lock:
+            return sum(consumer['stats']['in_flight'] for consumer in self._consumers.values())
+
+    def stats(self):
+        """Retorna uma cópia das estatísticas de cada consumidor"""
+        with self._lock:
+            return {consumer_id: dict(consumer['stats'])
+                    for consumer_id, consumer in self._consumers.items()}
+
+    def consumer_ids(self):
+        with self._lock:
+            return list(self._consumers)
+
+    def stop(self, timeout=DEFAULT_REGISTER_TIMEOUT):
+        """Cancela todos os consumidores, fecha a conexão e aguarda a thread de I/O"""
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+        self._stopped.set()  # Interrompe uma espera de reconexão
+        connection = self._connection
+        if connection is not None:
+            try:
+                connection.add_callback_threadsafe(lambda: None)  # Acorda a thread de I/O
+            except Exception:
+                pass
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout + DEFAULT_DRAIN_TIMEOUT)
+        with self._lock:
+            self._consumers.clear()
+
+
+_handler_executor = None
+_listener_manager = None
+_listener_manager_lock = threading.Lock()
+
+def get_handler_executor():
+    """Retorna o executor compartilhado dos handlers (threads, por padrão)"""
+    global _handler_executor
+    with _listener_manager_lock:
+        if _handler_executor is None:
+            _handler_executor = ThreadPoolExecutor(thread_name_prefix='mom-handler')
+        return _handler_executor
+
+def configure_handler_executor(kind='thread', max_workers=None):
+    """Substitui o executor compartilhado por um pool de ``'thread'`` ou ``'process'``.
+
+    Com processos, os handlers (e seus argumentos) precisam ser serializáveis
+    com pickle, ou seja, funções definidas no nível do módulo.
+    """
+    global _handler_executor
+    if kind == 'process':
+        from concurrent.futures import ProcessPoolExecutor  # Carrega o multiprocessing só quando usado
+        executor = ProcessPoolExecutor(max_workers=max_workers or os.cpu_count())
+    elif kind == 'thread':
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='mom-handler')
+    else:
+        raise ValueError(f"Tipo de executor desconhecido: '{kind}'")
+    with _listener_manager_lock:
+        old_executor, _handler_executor = _handler_executor, executor
+    if old_executor is not None:
+        old_executor.shutdown(wait=False)
+    return executor
+
+def get_listener_manager():
+    """Retorna o gerenciador de listeners compartilhado pelo processo"""
+    global _listener_manager
+    with _listener_manager_lock:
+        if _listener_manager is None:
+            _listener_manager = ListenerManager()
+        return _listener_manager
+
+def configure_listener_manager(**options):
+    """Encerra o gerenciador compartilhado e o substitui por um novo com as opções informadas"""
+    global _listener_manager
+    manager = ListenerManager(**options)
+    with _listener_manager_lock:
+        old_manager, _listener_manager = _listener_manager, manager
+    if old_manager is not None:
+        old_manager.stop()
+    return manager
+
+def shutdown_listener_manager():
+    """Encerra o gerenciador de listeners compartilhado, se existir"""
+    global _listener_manager
+    with _listener_manager_lock:
+        manager, _listener_manager = _listener_manager, None
+    if manager is not None:
+        manager.stop()
@@ -4,14 +4,26 @@ Sistema de Gerenciamento e Utilização de Comunicação por Mensagens (MOM)
 Baseado nos requisitos do projeto e códigos Java fornecidos
 """
 
+import argparse
+import json
 import sys
+import threading
 import time
-from broker_manager import BrokerManager
-from user_application import UserApplication
+from startup_timing import ImportTimer, StartupReport
 
-def print_menu():
+_STARTED = time.perf_counter()  # Referência do relatório de inicialização
+
+# Os módulos do MOM (e o pika, por eles) são importados em main(), depois dos argumentos:
+# o menu aparece sem esperar por eles e o relatório de inicialização mede esses imports.
+TOPIC_TYPES = ('fanout', 'direct', 'topic', 'headers')  # Os de broker_manager.EXCHANGE_TYPES
+DEFAULT_WARM_CONNECTIONS = 2  # Conexões abertas em paralelo, em segundo plano, no menu interativo
+STARTUP_REPORT_WAIT = 10.0  # Segundos aguardando a inicialização em segundo plano antes do relatório
+
+def print_menu(status=None):
     print("\n" + "="*50)
     print("    SISTEMA MOM - MENU PRINCIPAL")
+    if status:
+        print(f"    Status: {status}")
     print("="*50)
     print("1. Gerenciar Broker")
     print("2. Gerenciar Usuários")
@@ -30,7 +42,8 @@ def print_broker_menu():
     print("5. Listar Filas")
     print("6. Listar Tópicos")
     print("7. Contar Mensagens em Fila")
-    print("8. Voltar ao Menu Principal")
+    print("8. Exibir Métricas")
+    print("9. Voltar ao Menu Principal")
     print("-"*50)
 
 def print_user_menu():
@@ -71,23 +84,27 @@ def manage_broker(broker_manager):
         
         elif choice == '3':
             topic_name = input("Nome do tópico: ").strip()
-            broker_manager.add_topic(topic_name)
+            exchange_type = input("Tipo (fanout/direct/topic/headers) [fanout]: ").strip() or 'fanout'
+            broker_manager.add_topic(topic_name, exchange_type)
         
         elif choice == '4':
             topic_name = input("Nome do tópico: ").strip()
             broker_manager.remove_topic(topic_name)
         
         elif choice == '5':
-            broker_manager.list_queues()
+            broker_manager.list_queues(verify=True)
         
         elif choice == '6':
-            broker_manager.list_topics()
+            broker_manager.list_topics(verify=True)
         
         elif choice == '7':
             queue_name = input("Nome da fila: ").strip()
             broker_manager.get_queue_message_count(queue_name)
         
         elif choice == '8':
+            print(broker_manager.export_metrics())
+        
+        elif choice == '9':
             break
         
         else:
@@ -116,6 +133,7 @@ def manage_users(broker_manager):
             print("Opção inválida!")
 
 def test_communication(broker_manager):
+    from user_application import UserApplication
     while True:
         print_communication_menu()
         choice = input("Escolha uma opção: ").strip()
@@ -125,7 +143,7 @@ def test_communication(broker_manager):
             receiver = input("Nome do usuário destinatário: ").strip()
             message = input("Mensagem: ").strip()
             
-            if sender in broker_manager.users:
+            if broker_manager.has_user(sender):
                 user_app = UserApplication(sender, broker_manager)
                 user_app.send_message_to_user(receiver, message)
             else:
@@ -134,7 +152,7 @@ def test_communication(broker_manager):
         elif choice == '2':
             username = input("Nome do usuário: ").strip()
             
-            if username in broker_manager.users:
+            if broker_manager.has_user(username):
                 user_app = UserApplication(username, broker_manager)
                 message = user_app.receive_messages_from_user_queue()
                 if not message:
@@ -145,21 +163,23 @@ def test_communication(broker_manager):
         elif choice == '3':
             publisher = input("Nome do usuário publicador: ").strip()
             topic_name = input("Nome do tópico: ").strip()
+            routing_key = input("Chave de roteamento (opcional, ex.: noticias.esporte.futebol): ").strip()
             message = input("Mensagem: ").strip()
             
-            if publisher in broker_manager.users:
+            if broker_manager.has_user(publisher):
                 user_app = UserApplication(publisher, broker_manager)
-                user_app.publish_message_to_topic(topic_name, message)
+                user_app.publish_message_to_topic(topic_name, message, routing_key)
             else:
                 print(f"Usuário '{publisher}' não existe.")
         
         elif choice == '4':
             username = input("Nome do usuário: ").strip()
             topic_name = input("Nome do tópico: ").strip()
+            binding_key = input("Chave de ligação (opcional, ex.: noticias.esporte.*): ").strip()
             
-            if username in broker_manager.users:
+            if broker_manager.has_user(username):
                 user_app = UserApplication(username, broker_manager)
-                user_app.subscribe_to_topic(topic_name)
+                user_app.subscribe_to_topic(topic_name, binding_key)
             else:
                 print(f"Usuário '{username}' não existe.")
         
@@ -167,12 +187,12 @@ def test_communication(broker_manager):
             username = input("Nome do usuário: ").strip()
             topic_name = input("Nome do tópico: ").strip()
             
-            if username in broker_manager.users:
+            if broker_manager.has_user(username):
                 user_app = UserApplication(username, broker_manager)
                 user_app.start_topic_listener(topic_name)
                 print("Listener iniciado. Pressione Enter para parar...")
                 input()
-                user_app.stop_topic_listener()
+                user_app.stop_topic_listener(topic_name)
             else:
                 print(f"Usuário '{username}' não existe.")
         
@@ -180,7 +200,7 @@ def test_communication(broker_manager):
             username = input("Nome do usuário: ").strip()
             queue_name = input("Nome da fila (deixe vazio para usar a fila do usuário): ").strip()
             
-            if username in broker_manager.users:
+            if broker_manager.has_user(username):
                 user_app = UserApplication(username, broker_manager)
                 if queue_name:
                     user_app.start_queue_listener(queue_name)
@@ -188,7 +208,7 @@ def test_communication(broker_manager):
                     user_app.start_queue_listener()
                 print("Listener iniciado. Pressione Enter para parar...")
                 input()
-                user_app.stop_topic_listener()
+                user_app.stop_queue_listener()
             else:
                 print(f"Usuário '{username}' não existe.")
         
@@ -198,25 +218,63 @@ def test_communication(broker_manager):
         else:
             print("Opção inválida!")
 
-def main():
-    print("Iniciando Sistema MOM...")
-    
-    # Inicializa o gerenciador do broker
-    broker_manager = BrokerManager()
+def setup_sample_environment(broker_manager, verbose=True):
+    """Cria alguns usuários e recursos de exemplo; retorna os itens que falharam"""
+    reports = [
+        broker_manager.create_users(["alice", "bob"], verbose=verbose),
+        broker_manager.add_topics(["noticias", "chat_geral"], verbose=verbose),
+        broker_manager.add_queues(["fila_publica"], verbose=verbose),
+    ]
+    # "Já existe" não é falha: o ambiente de exemplo persiste entre execuções com --registry
+    return [name for report in reports for name, result in report.items()
+            if not result['ok'] and result['error'] != 'usuário já existe']
+
+def start_background_setup(broker_manager, report, sample=True, connections=DEFAULT_WARM_CONNECTIONS):
+    """Conecta ao broker e, se ``sample``, cria o ambiente de exemplo, numa thread de fundo.
+
+    As ``connections`` conexões do pool são abertas em paralelo. O menu não
+    espera por elas: com o broker lento ou fora do ar, só as ações que
+    dependem dele aguardam (ou falham e tentam de novo na próxima vez). A
+    thread não imprime nada (o menu pode estar esperando em ``input()``):
+    o andamento fica em ``thread.status``, mostrado no cabeçalho do menu.
+    """
+    from message_utils import get_channel_pool
     
-    # Cria alguns usuários e recursos de exemplo
-    print("\nConfigurando ambiente de exemplo...")
-    broker_manager.create_user("alice")
-    broker_manager.create_user("bob")
-    broker_manager.add_topic("noticias")
-    broker_manager.add_topic("chat_geral")
-    broker_manager.add_queue("fila_publica")
+    def run():
+        thread.status = "conectando ao broker..."
+        try:
+            with report.measure(f"conexão com o broker ({connections} em paralelo)"):
+                get_channel_pool().warm_up(connections)
+        except Exception as e:
+            thread.status = f"broker indisponível ({e.__class__.__name__}); as operações tentarão conectar de novo"
+            report.mark(f"broker indisponível ({e.__class__.__name__})")
+            return
+        thread.status = "conectado ao broker"
+        if sample:
+            thread.status = "configurando o ambiente de exemplo..."
+            try:
+                with report.measure("ambiente de exemplo"):
+                    failed = setup_sample_environment(broker_manager, verbose=False)
+            except Exception as e:
+                thread.status = f"falha no ambiente de exemplo ({e})"
+                return
+            if failed:
+                thread.status = f"ambiente de exemplo incompleto (falharam: {', '.join(failed)})"
+            else:
+                thread.status = "ambiente de exemplo configurado"
     
+    thread = threading.Thread(target=run, name='mom-startup', daemon=True)
+    thread.status = None
+    thread.start()
+    return thread
+
+def interactive(broker_manager, startup=None):
+    """Menu interativo (modo padrão, sem subcomando); ``startup`` é a thread de ``start_background_setup``"""
     print("Sistema MOM iniciado com sucesso!")
     
     while True:
         try:
-            print_menu()
+            print_menu(getattr(startup, 'status', None))
             choice = input("Escolha uma opção: ").strip()
             
             if choice == '1':
@@ -240,7 +298,270 @@ def main():
             break
         except Exception as e:
             print(f"Erro: {e}")
+    return 0
 
-if __name__ == "__main__":
-    main()
+# Modo não interativo (subcomandos)
+
+def _open_input(path):
+    return sys.stdin if path in (None, '-') else open(path, encoding='utf-8')
+
+def read_messages(messages=None, path=None, whole=False):
+    """Mensagens da linha de comando ou, sem elas, do arquivo ``path`` (``-``/None: stdin).
+
+    Cada linha não vazia é uma mensagem; com ``whole`` o conteúdo inteiro é uma só.
+    """
+    if messages:
+        return list(messages)
+    source = _open_input(path)
+    try:
+        if whole:
+            return [source.read()]
+        return [line.rstrip('\r\n') for line in source if line.strip()]
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+def provision_from_file(broker_manager, path, parallelism=None):
+    """Provisiona em lote os recursos descritos num arquivo JSON (``-`` para stdin).
+
+    Formato::
+
+        {"users": ["alice", "bob"],
+         "queues": ["fila_publica"],
+         "topics": ["noticias", {"name": "placar", "type": "topic", "history": true}],
+         "subscriptions": [{"user": "alice", "topic": "placar", "binding_key": "placar.#"}]}
+
+    Usuários, filas e tópicos simples são declarados em paralelo (por tipo);
+    tópicos com histórico e inscrições, um a um. Retorna True se tudo deu certo.
+    """
+    source = _open_input(path)
+    try:
+        spec = json.load(source)
+    except ValueError as e:
+        print(f"Arquivo de provisionamento inválido: {e}")
+        return False
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    options = {} if parallelism is None else {'parallelism': parallelism}
+    ok = True
+    
+    if spec.get('users'):
+        report = broker_manager.create_users(spec['users'], **options)
+        ok &= all(result['ok'] or result['error'] == 'usuário já existe' for result in report.values())
+    if spec.get('queues'):
+        report = broker_manager.add_queues(spec['queues'], **options)
+        ok &= all(result['ok'] for result in report.values())
+    
+    by_type = {}
+    for topic in spec.get('topics', []):
+        if isinstance(topic, str):
+            topic = {'name': topic}
+        if topic.get('history'):
+            ok &= broker_manager.add_topic(topic['name'], topic.get('type', 'fanout'), history=True,
+                                           **{key: topic[key] for key in ('history_max_bytes', 'history_max_age')
+                                              if key in topic})
+        else:
+            by_type.setdefault(topic.get('type', 'fanout'), []).append(topic['name'])
+    for exchange_type, names in by_type.items():
+        report = broker_manager.add_topics(names, exchange_type, **options)
+        ok &= all(result['ok'] for result in report.values())
+    
+    for subscription in spec.get('subscriptions', []):
+        ok &= broker_manager.subscribe_user_to_topic(subscription['user'], subscription['topic'],
+                                                     subscription.get('binding_key', ''),
+                                                     subscription.get('headers'),
+                                                     subscription.get('match', 'all'))
+    return bool(ok)
+
+def _remember_topic_type(broker_manager, topic_name, exchange_type):
+    """Tipo do tópico informado na linha de comando (sem registro persistente, o padrão é fanout)"""
+    from message_utils import declaration_cache
+    if exchange_type and not broker_manager.has_topic(topic_name):
+        declaration_cache.remember_exchange(topic_name, exchange_type)
+
+def _format_message(message_data, as_json=False):
+    if as_json:
+        return json.dumps(message_data, ensure_ascii=False, default=str)
+    when = time.strftime('%H:%M:%S', time.localtime(message_data.get('timestamp', time.time())))
+    origin = f" [{message_data['routing_key']}]" if message_data.get('routing_key') else ''
+    return f"{when} {message_data.get('from')}{origin}: {message_data.get('message')}"
+
+def command_provision(broker_manager, args):
+    return 0 if provision_from_file(broker_manager, args.file, args.parallelism) else 1
+
+def command_send(broker_manager, args):
+    from user_application import UserApplication
+    messages = read_messages(args.messages, args.file, args.whole)
+    user_app = UserApplication(args.sender, broker_manager)
+    if args.queue:
+        sent = sum(bool(user_app.send_message_to_queue(args.target, message, args.priority, args.expiration))
+                   for message in messages)
+    else:
+        sent = sum(user_app.send_messages_to_user(args.target, messages, priority=args.priority,
+                                                  expiration=args.expiration))
+    return 0 if sent == len(messages) else 1
+
+def command_publish(broker_manager, args):
+    from user_application import UserApplication
+    messages = read_messages(args.messages, args.file, args.whole)
+    _remember_topic_type(broker_manager, args.topic, args.type)
+    user_app = UserApplication(args.sender, broker_manager)
+    headers = json.loads(args.headers) if args.headers else None
+    published = sum(user_app.publish_batch(args.topic, messages, routing_key=args.routing_key, headers=headers,
+                                           priority=args.priority, expiration=args.expiration))
+    return 0 if published == len(messages) else 1
 
+def command_tail(broker_manager, args):
+    from user_application import UserApplication
+    user_app = UserApplication(args.reader, broker_manager)
+    if args.topic:
+        _remember_topic_type(broker_manager, args.topic, args.type)
+        messages = user_app.iter_topic(args.topic, args.binding_key, inactivity_timeout=args.timeout,
+                                       max_messages=args.count)
+    else:
+        queue_name = args.queue or f"user_{args.user}"
+        messages = user_app.iter_messages(queue_name, inactivity_timeout=args.timeout,
+                                          max_messages=args.count)
+    try:
+        for message_data in messages:
+            print(_format_message(message_data, args.json), flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        messages.close()
+    return 0
+
+def command_loadgen(broker_manager, args):
+    from benchmarks.loadgen import LoadGenerator
+    options = {name: getattr(args, name) for name in ('users', 'rate', 'duration', 'workers', 'topic_ratio',
+                                                      'payload_size', 'interval')
+               if getattr(args, name) is not None}
+    try:
+        generator = LoadGenerator(processes=args.processes, **options)
+    except ValueError as e:
+        print(f"Erro: {e}")
+        return 2
+    summary = generator.run(broker_manager)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(summary, output, indent=2)
+    return 0 if not summary['errors'] else 1
+
+def _add_message_arguments(parser):
+    parser.add_argument('-m', '--message', dest='messages', action='append', metavar='MENSAGEM',
+                        help="mensagem (repetível; sem ela, uma por linha de --file ou da entrada padrão)")
+    parser.add_argument('--file', help="arquivo com as mensagens (- para a entrada padrão)")
+    parser.add_argument('--whole', action='store_true', help="envia o conteúdo inteiro como uma mensagem")
+    parser.add_argument('--priority', type=int, help="prioridade (filas com max_priority)")
+    parser.add_argument('--expiration', type=float, help="segundos até a mensagem expirar na fila")
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='python main.py',
+        description="Sistema MOM. Sem subcomando abre o menu interativo.")
+    parser.add_argument('--broker', choices=('rabbitmq', 'memory'),
+                        help="transporte (padrão: MOM_TRANSPORT ou rabbitmq)")
+    parser.add_argument('--registry', metavar='ARQUIVO',
+                        help="registro SQLite de usuários, tópicos e inscrições (padrão: em memória)")
+    parser.add_argument('--no-sample', action='store_true',
+                        help="não cria o ambiente de exemplo (alice, bob...) no menu interativo")
+    parser.add_argument('--startup-report', action='store_true',
+                        help="ao sair, mostra o tempo de cada fase da inicialização e dos imports")
+    commands = parser.add_subparsers(dest='command', metavar='comando')
+    
+    provision = commands.add_parser('provision', help="cria usuários, filas, tópicos e inscrições de um arquivo JSON")
+    provision.add_argument('file', help="arquivo JSON (- para a entrada padrão)")
+    provision.add_argument('--parallelism', type=int, help="canais usados em paralelo")
+    provision.set_defaults(handler=command_provision)
+    
+    send = commands.add_parser('send', help="envia mensagens a um usuário (ou fila)")
+    send.add_argument('sender', help="usuário remetente")
+    send.add_argument('target', help="usuário destinatário (ou fila, com --queue)")
+    send.add_argument('--queue', action='store_true', help="o destino é uma fila, não um usuário")
+    _add_message_arguments(send)
+    send.set_defaults(handler=command_send)
+    
+    publish = commands.add_parser('publish', help="publica mensagens em um tópico")
+    publish.add_argument('sender', help="usuário publicador")
+    publish.add_argument('topic', help="tópico")
+    publish.add_argument('--routing-key', default='', help="chave de roteamento")
+    publish.add_argument('--headers', help="cabeçalhos em JSON (tópicos headers)")
+    publish.add_argument('--type', choices=TOPIC_TYPES, help="tipo do tópico, se não estiver no registro")
+    _add_message_arguments(publish)
+    publish.set_defaults(handler=command_publish)
+    
+    tail = commands.add_parser('tail', help="acompanha as mensagens de uma fila, usuário ou tópico")
+    source = tail.add_mutually_exclusive_group(required=True)
+    source.add_argument('--queue', help="consome a fila (as mensagens são retiradas)")
+    source.add_argument('--user', help="consome a fila do usuário")
+    source.add_argument('--topic', help="ouve o tópico numa fila temporária (não retira de ninguém)")
+    tail.add_argument('--binding-key', default='', help="chave de ligação no tópico (ex.: noticias.#)")
+    tail.add_argument('--type', choices=TOPIC_TYPES, help="tipo do tópico, se não estiver no registro")
+    tail.add_argument('--as', dest='reader', default='cli', help="usuário leitor (as próprias são ignoradas)")
+    tail.add_argument('--count', type=int, help="para após N mensagens")
+    tail.add_argument('--timeout', type=float, help="para após N segundos sem mensagens")
+    tail.add_argument('--json', action='store_true', help="uma mensagem JSON por linha")
+    tail.set_defaults(handler=command_tail)
+    
+    loadgen = commands.add_parser('loadgen', help="gera carga com usuários simulados")
+    loadgen.add_argument('--users', type=int, help="usuários simulados (padrão: 10)")
+    loadgen.add_argument('--rate', type=float, help="mensagens por segundo, no total (padrão: 500)")
+    loadgen.add_argument('--duration', type=float, help="segundos de envio (padrão: 10)")
+    loadgen.add_argument('--workers', type=int, help="threads ou processos (padrão: 4)")
+    loadgen.add_argument('--processes', action='store_true', help="workers em processos (só com RabbitMQ)")
+    loadgen.add_argument('--topic-ratio', type=float,
+                         help="fração publicada no tópico, o resto é envio direto (padrão: 0.2)")
+    loadgen.add_argument('--payload-size', type=int, help="bytes por mensagem (padrão: 64)")
+    loadgen.add_argument('--interval', type=float, help="segundos entre as linhas de progresso (padrão: 1)")
+    loadgen.add_argument('--output', help="salva o resumo em JSON")
+    loadgen.set_defaults(handler=command_loadgen)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    import_timer = ImportTimer().install() if args.startup_report else None
+    report = StartupReport(_STARTED, import_timer)
+    
+    with report.measure("imports do MOM"):
+        from broker_manager import BrokerManager
+        from listener_manager import shutdown_listener_manager
+        from message_utils import configure_transport, get_channel_pool
+        from subscription_registry import SQLiteRegistry
+    if args.broker:
+        with report.measure("transporte"):
+            configure_transport(args.broker)
+    
+    if args.command is None:
+        print("Iniciando Sistema MOM...")
+    
+    # Inicializa o gerenciador do broker (sem conectar: a primeira conexão é feita sob demanda)
+    with report.measure("BrokerManager"):
+        registry = SQLiteRegistry(args.registry) if args.registry else None
+        broker_manager = BrokerManager(registry)
+    
+    startup = None
+    try:
+        if args.command is None:
+            startup = start_background_setup(broker_manager, report, sample=not args.no_sample)
+            report.mark("menu interativo")
+            return interactive(broker_manager, startup)
+        if args.startup_report:
+            try:
+                with report.measure("conexão com o broker"):
+                    get_channel_pool().warm_up(1)
+            except Exception as e:
+                print(f"Broker indisponível ({e.__class__.__name__}).")
+        report.mark(f"comando '{args.command}'")
+        return args.handler(broker_manager, args)
+    finally:
+        # Cancela os consumidores e fecha a conexão dos listeners
+        shutdown_listener_manager()
+        if import_timer is not None:
+            if startup is not None:
+                startup.join(timeout=STARTUP_REPORT_WAIT)  # Para incluir a conexão no relatório
+            import_timer.uninstall()
+            print(report.format(), file=sys.stderr)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+import json
+import zlib
+
+try:
+    import orjson
+except ImportError:  # orjson é opcional
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # msgpack é opcional
+    msgpack = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # lz4 é opcional
+    lz4_frame = None
+
+CONTENT_TYPE_JSON = 'application/json'
+CONTENT_TYPE_MSGPACK = 'application/msgpack'
+DEFAULT_COMPRESSION_THRESHOLD = 1024  # Bytes a partir dos quais o corpo é comprimido
+
+
+def _json_dumps(payload):
+    return json.dumps(payload).encode()
+
+def _json_loads(body):
+    if isinstance(body, memoryview):
+        body = body.tobytes()
+    return json.loads(body)
+
+def _orjson_loads(body):
+    return orjson.loads(body)  # Aceita bytes e memoryview sem cópia extra
+
+def _msgpack_dumps(payload):
+    return msgpack.packb(payload, use_bin_type=True)
+
+def _msgpack_loads(body):
+    return msgpack.unpackb(body, raw=False)
+
+
+class MessageCodec:
+    """Formato de serialização identificado pelo ``content_type`` AMQP"""
+
+    def __init__(self, name, content_type, dumps, loads):
+        self.name = name
+        self.content_type = content_type
+        self.dumps = dumps
+        self.loads = loads
+
+
+class Compressor:
+    """Compressão identificada pelo ``content_encoding`` AMQP"""
+
+    def __init__(self, name, compress, decompress):
+        self.name = name
+        self.compress = compress
+        self.decompress = decompress
+
+
+CODECS = {'json': MessageCodec('json', CONTENT_TYPE_JSON, _json_dumps, _json_loads)}
+if orjson is not None:
+    # orjson gera JSON comum: mesmo content_type, interoperável com o codec json
+    CODECS['orjson'] = MessageCodec('orjson', CONTENT_TYPE_JSON, orjson.dumps, _orjson_loads)
+if msgpack is not None:
+    CODECS['msgpack'] = MessageCodec('msgpack', CONTENT_TYPE_MSGPACK, _msgpack_dumps, _msgpack_loads)
+
+COMPRESSORS = {'zlib': Compressor('zlib', zlib.compress, zlib.decompress)}
+if lz4_frame is not None:
+    COMPRESSORS['lz4'] = Compressor('lz4', lz4_frame.compress, lz4_frame.decompress)
+
+# Decodificador usado para cada content_type recebido (o mais rápido disponível)
+DECODERS = {CONTENT_TYPE_JSON: (CODECS.get('orjson') or CODECS['json']).loads}
+if msgpack is not None:
+    DECODERS[CONTENT_TYPE_MSGPACK] = CODECS['msgpack'].loads
+
+
+class MessageSerializer:
+    """Serializa mensagens com um codec e, acima de um limite, as comprime.
+
+    O codec e a compressão vão nas propriedades ``content_type`` e
+    ``content_encoding`` da mensagem, e a decodificação é guiada por elas, de
+    modo que clientes com configurações diferentes continuam interoperando.
+    Mensagens sem ``content_type`` (clientes antigos) são tratadas como JSON.
+    """
+
+    def __init__(self, codec='json', compression=None,
+                 compression_threshold=DEFAULT_COMPRESSION_THRESHOLD):
+        if codec not in CODECS:
+            raise ValueError(f"Codec indisponível: '{codec}'")
+        if compression is not None and compression not in COMPRESSORS:
+            raise ValueError(f"Compressão indisponível: '{compression}'")
+        self.codec = CODECS[codec]
+        self.compressor = COMPRESSORS[compression] if compression else None
+        self.compression_threshold = compression_threshold
+
+    def encode(self, payload):
+        """Retorna ``(body, content_type, content_encoding)``"""
+        body = self.codec.dumps(payload)
+        if self.compressor is not None and len(body) >= self.compression_threshold:
+            return self.compressor.compress(body), self.codec.content_type, self.compressor.name
+        return body, self.codec.content_type, None
+
+    def decode(self, body, content_type=None, content_encoding=None):
+        """Decodifica ``bytes``/``memoryview`` conforme o content_type/encoding recebidos"""
+        if content_encoding:
+            compressor = COMPRESSORS.get(content_encoding)
+            if compressor is None:
+                raise ValueError(f"Compressão não suportada: '{content_encoding}'")
+            body = compressor.decompress(body)
+        loads = DECODERS.get(content_type or CONTENT_TYPE_JSON)
+        if loads is None:
+            raise ValueError(f"Content type não suportado: '{content_type}'")
+        return loads(body)
+
+
+_serializer = MessageSerializer()
+
+def get_serializer():
+    """Retorna o serializador padrão do processo"""
+    return _serializer
+
+def configure_serializer(codec='json', compression=None,
+                         compression_threshold=DEFAULT_COMPRESSION_THRESHOLD):
+    """Substitui o serializador padrão usado pelos produtores"""
+    global _serializer
+    _serializer = MessageSerializer(codec, compression, compression_threshold)
+    return _serializer
+
+def encode_message(payload):
+    """Serializa com o serializador padrão: ``(body, content_type, content_encoding)``"""
+    return _serializer.encode(payload)
+
+def decode_message(body, properties=None):
+    """Decodifica usando o ``content_type``/``content_encoding`` das propriedades"""
+    content_type = getattr(properties, 'content_type', None)
+    content_encoding = getattr(properties, 'content_encoding', None)
+    return _serializer.decode(body, content_type, content_encoding)
@@ -1,10 +1,693 @@
-import pika
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+
+from metrics import metrics
+
+DEFAULT_POOL_SIZE = 8  # Número máximo de conexões mantidas pelo pool
+DEFAULT_MAX_IDLE = 60.0  # Segundos até uma conexão ociosa ser descartada
+DEFAULT_CONFIRM_WINDOW = 256  # Confirmações pendentes antes de aguardar o broker
+DEFAULT_CONFIRM_TIMEOUT = 30.0  # Segundos para o broker confirmar um lote
+
+
+DEFAULT_TRANSPORT = os.environ.get('MOM_TRANSPORT', 'rabbitmq')  # 'rabbitmq' ou 'memory'
+
+
+class PikaTransport:
+    """Transporte padrão: uma BlockingConnection do pika com o RabbitMQ"""
+
+    name = 'rabbitmq'
+
+    def __init__(self, host='localhost', **parameters):
+        import pika  # Adiado até o primeiro transporte: o pika leva dezenas de ms para importar
+        self.parameters = pika.ConnectionParameters(host, **parameters)
+
+    def connect(self):
+        import pika
+        return pika.BlockingConnection(self.parameters)
+
+
+class InMemoryTransport:
+    """Transporte sobre o broker em memória do processo (sem RabbitMQ).
+
+    As conexões têm a mesma interface das do pika, então o pool de canais,
+    o ListenerManager, o BrokerManager e o UserApplication funcionam sem
+    alterações; mensagens entre usuários do mesmo processo são entregues
+    em microssegundos.
+    """
+
+    name = 'memory'
+
+    def __init__(self, broker=None):
+        from in_memory_broker import get_in_memory_broker
+        self.broker = broker or get_in_memory_broker()
+
+    def connect(self):
+        return self.broker.connect()
+
+
+TRANSPORTS = {'rabbitmq': PikaTransport, 'memory': InMemoryTransport}
+_transport = None
+_transport_lock = threading.Lock()
+
+def get_transport():
+    """Retorna o transporte do processo (``MOM_TRANSPORT``, padrão ``rabbitmq``)"""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = TRANSPORTS[DEFAULT_TRANSPORT]()
+    return _transport
+
+def configure_transport(transport='rabbitmq', **options):
+    """Troca o transporte do processo: ``'rabbitmq'``, ``'memory'`` ou um objeto com ``connect()``.
+
+    O pool de canais e o cache de declarações são recriados; listeners já
+    iniciados continuam no transporte anterior até se reconectarem.
+    """
+    global _transport
+    if isinstance(transport, str):
+        if transport not in TRANSPORTS:
+            raise ValueError(f"Transporte desconhecido: '{transport}' (use {', '.join(TRANSPORTS)}).")
+        transport = TRANSPORTS[transport](**options)
+    with _transport_lock:
+        _transport = transport
+    configure_channel_pool()
+    declaration_cache.clear()
+    return transport
 
 def get_rabbitmq_connection():
-    connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
-    return connection
+    return get_transport().connect()
 
 def close_rabbitmq_connection(connection):
     connection.close()
 
 
+def _is_channel_closed_by_broker(error, reply_code):
+    from pika.exceptions import ChannelClosedByBroker  # Só em caminhos de erro
+    return isinstance(error, ChannelClosedByBroker) and error.reply_code == reply_code
+
+def is_not_found_error(error):
+    """Indica se o broker fechou o canal com NOT_FOUND (404)"""
+    return _is_channel_closed_by_broker(error, 404)
+
+
+class DeclarationCache:
+    """Cache, compartilhado pelo processo, de filas e exchanges já declaradas.
+
+    Evita um ``queue_declare``/``exchange_declare`` síncrono antes de cada
+    mensagem: uma vez declarado com os mesmos argumentos, o nome fica no cache
+    até ser removido pelo BrokerManager ou invalidado por um erro NOT_FOUND.
+    """
+
+    def __init__(self):
+        self._queues = {}  # nome da fila -> argumentos
+        self._exchanges = {}  # nome do exchange -> (tipo, argumentos)
+        self._lock = threading.Lock()
+
+    def declare_queue(self, channel, queue_name, durable=True, arguments=None, force=False):
+        """Declara a fila no broker apenas se ainda não estiver no cache.
+
+        Com ``arguments=None`` (remetentes e consumidores), qualquer declaração
+        já conhecida da fila serve; com argumentos, eles precisam coincidir.
+        """
+        if not force and queue_name in self._queues:
+            cached = self._queues[queue_name]
+            if arguments is None or cached is None or cached == dict(arguments):
+                return False
+        arguments = dict(arguments or {})
+        channel.queue_declare(queue=queue_name, durable=durable, arguments=arguments or None)
+        with self._lock:
+            self._queues[queue_name] = arguments
+        return True
+
+    def declare_exchange(self, channel, exchange_name, exchange_type='fanout',
+                         durable=True, arguments=None, force=False):
+        """Declara o exchange no broker apenas se ainda não estiver no cache"""
+        declaration = (exchange_type, dict(arguments or {}))
+        if not force and self._exchanges.get(exchange_name) == declaration:
+            return False
+        channel.exchange_declare(exchange=exchange_name, exchange_type=exchange_type,
+                                 durable=durable, arguments=arguments or None)
+        with self._lock:
+            self._exchanges[exchange_name] = declaration
+        return True
+
+    def remember_queue(self, queue_name, arguments=None):
+        """Registra uma fila já existente no broker sem declará-la (ex.: warm start).
+
+        ``arguments=None`` indica uma fila que existe com argumentos desconhecidos.
+        """
+        with self._lock:
+            self._queues[queue_name] = None if arguments is None else dict(arguments)
+
+    def remember_exchange(self, exchange_name, exchange_type='fanout', arguments=None):
+        """Registra um exchange já existente no broker sem declará-lo (ex.: warm start)"""
+        with self._lock:
+            self._exchanges[exchange_name] = (exchange_type, dict(arguments or {}))
+
+    def forget_queue(self, queue_name):
+        """Remove a fila do cache (ela será declarada de novo no próximo uso)"""
+        with self._lock:
+            self._queues.pop(queue_name, None)
+
+    def forget_exchange(self, exchange_name):
+        """Remove o exchange do cache (ele será declarado de novo no próximo uso)"""
+        with self._lock:
+            self._exchanges.pop(exchange_name, None)
+
+    def is_queue_declared(self, queue_name):
+        return queue_name in self._queues
+
+    def is_exchange_declared(self, exchange_name):
+        return exchange_name in self._exchanges
+
+    def get_exchange_type(self, exchange_name):
+        """Tipo com que o exchange foi declarado, ou None se não estiver no cache"""
+        declaration = self._exchanges.get(exchange_name)
+        return None if declaration is None else declaration[0]
+
+    def clear(self):
+        with self._lock:
+            self._queues.clear()
+            self._exchanges.clear()
+
+
+declaration_cache = DeclarationCache()
+
+def is_precondition_failed_error(error):
+    """Indica se o broker fechou o canal com PRECONDITION_FAILED (406)"""
+    return _is_channel_closed_by_broker(error, 406)
+
+def retry_on_not_found(operation, queues=(), exchanges=()):
+    """Executa ``operation()`` e tenta de novo uma vez após um erro de declaração.
+
+    Em NOT_FOUND as declarações são invalidadas (e refeitas na nova
+    tentativa). Em PRECONDITION_FAILED, a fila já existe com outros
+    argumentos (limites, TTL...): ela é registrada no cache como existente,
+    e a nova tentativa publica sem redeclará-la.
+    """
+    try:
+        return operation()
+    except Exception as e:
+        if is_not_found_error(e):
+            for queue_name in queues:
+                declaration_cache.forget_queue(queue_name)
+            for exchange_name in exchanges:
+                declaration_cache.forget_exchange(exchange_name)
+        elif is_precondition_failed_error(e) and queues:
+            for queue_name in queues:
+                declaration_cache.remember_queue(queue_name)
+        else:
+            raise
+        return operation()
+
+
+QUEUE_OVERFLOW_MODES = ('drop-head', 'reject-publish', 'reject-publish-dlx')
+QUEUE_TYPES = ('classic', 'quorum', 'stream')
+
+def queue_arguments(max_length=None, max_length_bytes=None, overflow=None, message_ttl=None,
+                    dead_letter_exchange=None, dead_letter_routing_key=None, queue_type=None,
+                    lazy=False, max_priority=None, max_age=None, max_segment_size_bytes=None):
+    """Argumentos ``x-*`` de uma fila a partir das suas políticas (None se não houver nenhuma).
+
+    ``max_length``/``max_length_bytes`` limitam a fila; ao atingi-los,
+    ``overflow`` descarta as mais antigas (``drop-head``, padrão do RabbitMQ)
+    ou recusa as novas (``reject-publish``/``reject-publish-dlx``).
+    ``message_ttl`` é dado em segundos. Mensagens descartadas, expiradas ou
+    rejeitadas vão para ``dead_letter_exchange``, se informado. ``queue_type``
+    é ``classic``, ``quorum`` ou ``stream``; ``lazy`` (só em filas clássicas)
+    mantém as mensagens em disco, e ``max_priority`` (1 a 255, só em filas
+    clássicas) habilita prioridades por mensagem. Filas ``stream`` são logs
+    retidos por ``max_length_bytes`` e ``max_age`` (segundos), em segmentos
+    de ``max_segment_size_bytes``.
+    """
+    if queue_type == 'stream':
+        unsupported = {'max_length': max_length, 'overflow': overflow, 'message_ttl': message_ttl,
+                       'dead_letter_exchange': dead_letter_exchange, 'max_priority': max_priority}
+        unsupported = [name for name, value in unsupported.items() if value is not None]
+        if unsupported or lazy:
+            raise ValueError(f"Filas stream não suportam {', '.join(unsupported or ['lazy'])}.")
+    elif max_age is not None or max_segment_size_bytes is not None:
+        raise ValueError("max_age e max_segment_size_bytes valem só para filas stream.")
+    arguments = {}
+    if max_length is not None:
+        arguments['x-max-length'] = int(max_length)
+    if max_length_bytes is not None:
+        arguments['x-max-length-bytes'] = int(max_length_bytes)
+    if overflow is not None:
+        if overflow not in QUEUE_OVERFLOW_MODES:
+            raise ValueError(f"Modo de overflow inválido: '{overflow}' (use {', '.join(QUEUE_OVERFLOW_MODES)}).")
+        arguments['x-overflow'] = overflow
+    if message_ttl is not None:
+        arguments['x-message-ttl'] = int(message_ttl * 1000)
+    if dead_letter_exchange is not None:
+        arguments['x-dead-letter-exchange'] = dead_letter_exchange
+    if dead_letter_routing_key is not None:
+        arguments['x-dead-letter-routing-key'] = dead_letter_routing_key
+    if queue_type is not None:
+        if queue_type not in QUEUE_TYPES:
+            raise ValueError(f"Tipo de fila inválido: '{queue_type}' (use {', '.join(QUEUE_TYPES)}).")
+        arguments['x-queue-type'] = queue_type
+    if lazy:
+        if queue_type == 'quorum':
+            raise ValueError("Filas quorum não suportam o modo lazy.")
+        arguments['x-queue-mode'] = 'lazy'
+    if max_priority is not None:
+        if queue_type == 'quorum':
+            raise ValueError("Filas quorum não suportam max_priority.")
+        if not 1 <= max_priority <= 255:
+            raise ValueError("max_priority deve estar entre 1 e 255.")
+        arguments['x-max-priority'] = int(max_priority)
+    if max_age is not None:
+        arguments['x-max-age'] = f"{int(max_age)}s"
+    if max_segment_size_bytes is not None:
+        arguments['x-stream-max-segment-size-bytes'] = int(max_segment_size_bytes)
+    return arguments or None
+
+_BasicProperties = None  # pika.BasicProperties, importado na primeira mensagem
+
+def message_properties(priority=None, expiration=None, **properties):
+    """``pika.BasicProperties`` com prioridade e expiração (em segundos) por mensagem"""
+    global _BasicProperties
+    if _BasicProperties is None:
+        from pika import BasicProperties as _BasicProperties
+    if priority is not None:
+        properties['priority'] = int(priority)
+    if expiration is not None:
+        properties['expiration'] = str(max(0, int(expiration * 1000)))
+    return _BasicProperties(**properties)
+
+
+@lru_cache(maxsize=4096)
+def topic_matches(binding_key, routing_key):
+    """Indica se ``routing_key`` casa com ``binding_key`` (``*`` = uma palavra, ``#`` = zero ou mais)"""
+    return _match_words(tuple(binding_key.split('.')), tuple(routing_key.split('.')))
+
+def _match_words(pattern, words):
+    if not pattern:
+        return not words
+    head = pattern[0]
+    if head == '#':
+        return any(_match_words(pattern[1:], words[index:]) for index in range(len(words) + 1))
+    if not words:
+        return False
+    return (head == '*' or head == words[0]) and _match_words(pattern[1:], words[1:])
+
+def headers_binding_arguments(headers=None, match='all'):
+    """Argumentos de binding para um exchange ``headers`` (``match``: 'all' ou 'any')"""
+    if not headers:
+        return None
+    if match not in ('all', 'any'):
+        raise ValueError(f"x-match inválido: '{match}' (use 'all' ou 'any').")
+    arguments = {'x-match': match}
+    arguments.update(headers)
+    return arguments
+
+def bind_queue(queue_name, exchange_name, exchange_type='fanout', routing_key='', arguments=None):
+    """Cria um binding durável do exchange para a fila (declarando ambos se preciso).
+
+    ``routing_key`` é a chave de ligação (com ``*``/``#`` em exchanges
+    ``topic``) e ``arguments`` os cabeçalhos esperados em exchanges ``headers``.
+    """
+    def bind():
+        with pooled_channel() as channel:
+            declaration_cache.declare_queue(channel, queue_name)
+            declaration_cache.declare_exchange(channel, exchange_name, exchange_type)
+            channel.queue_bind(queue=queue_name, exchange=exchange_name, routing_key=routing_key,
+                               arguments=arguments or None)
+
+    retry_on_not_found(bind, queues=[queue_name], exchanges=[exchange_name])
+
+def unbind_queue(queue_name, exchange_name, routing_key='', arguments=None):
+    """Remove o binding do exchange para a fila (mesma chave e argumentos do bind)"""
+    with pooled_channel() as channel:
+        channel.queue_unbind(queue=queue_name, exchange=exchange_name, routing_key=routing_key,
+                             arguments=arguments or None)
+
+
+# Métodos da API assíncrona do canal usados pelo MOM
+_ASYNC_CHANNEL_METHODS = ('confirm_delivery', 'basic_publish', 'queue_declare', 'exchange_declare')
+
+def _async_channel(channel):
+    """Canal assíncrono (``_impl``) de um BlockingChannel do pika.
+
+    Único ponto que usa essa API interna (presente no pika 1.x): o
+    BlockingChannel aguarda a confirmação de cada mensagem individualmente
+    (``ConfirmPublisher``) e cada declaração (``collect_broker_stats``).
+    Os métodos usados são conferidos aqui, para que uma versão incompatível
+    do pika falhe na abertura do canal, com uma mensagem clara, e não no
+    meio de um lote.
+    """
+    impl = getattr(channel, '_impl', None)
+    missing = [name for name in _ASYNC_CHANNEL_METHODS if not callable(getattr(impl, name, None))]
+    if missing:
+        raise RuntimeError(f"Canal sem a API assíncrona esperada do pika 1.x ({', '.join(missing)}).")
+    return impl
+
+
+class ConfirmPublisher:
+    """Canal em modo confirm que publica sem aguardar cada confirmação.
+
+    Mantém até ``window`` publicações pendentes e processa os Basic.Ack/Nack
+    do broker à medida que chegam, devolvendo o resultado de cada mensagem.
+    Usa a API assíncrona do canal (veja ``_async_channel``).
+
+    Se o lote é interrompido por um erro, ``publish_batch`` retorna os
+    resultados obtidos até ali e guarda o erro em ``error``. Após um erro ou
+    um tempo esgotado ainda há confirmações pendentes no canal: ``broken``
+    indica que ele não deve ser reutilizado.
+    """
+
+    def __init__(self, connection, window=DEFAULT_CONFIRM_WINDOW):
+        from pika.spec import Basic
+        self._ack_type = Basic.Ack
+        self.connection = connection
+        self.window = window
+        self.channel = connection.channel()
+        self._async = _async_channel(self.channel)
+        self._pending = {}  # delivery_tag -> (índice no lote, instante do envio, destino)
+        self._results = None
+        self._next_tag = 1
+        self.error = None  # Erro que interrompeu o último lote
+        self.broken = False  # Confirmações perdidas: o canal não deve ser reutilizado
+
+        selected = []
+        self._async.confirm_delivery(
+            ack_nack_callback=self._on_confirm,
+            callback=lambda frame: selected.append(frame)
+        )
+        while not selected:
+            self.connection.process_data_events(time_limit=1)
+
+    @property
+    def is_open(self):
+        return self.channel.is_open
+
+    def _on_confirm(self, frame):
+        method = frame.method
+        acked = isinstance(method, self._ack_type)
+        if method.multiple:
+            tags = [tag for tag in self._pending if tag <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag]
+        now = time.perf_counter()
+        for tag in tags:
+            pending = self._pending.pop(tag, None)
+            # Confirmações de lotes expirados chegam sem lote ativo e são ignoradas
+            if pending is not None and self._results is not None:
+                index, sent_at, (kind, name) = pending
+                self._results[index] = acked
+                # Ida e volta ao broker de cada mensagem: publicação até o Ack/Nack
+                metrics.observe('mom_roundtrip_seconds', now - sent_at,
+                                operation='confirm', kind=kind, name=name)
+
+    def _wait_for_confirms(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("Tempo esgotado aguardando confirmações do broker.")
+        self.connection.process_data_events(time_limit=min(remaining, 1.0))
+
+    def publish_batch(self, publishes, timeout=DEFAULT_CONFIRM_TIMEOUT):
+        """Publica ``(exchange, routing_key, body, properties)`` e retorna um bool por mensagem.
+
+        A lista tem uma entrada por mensagem publicada até um erro (veja
+        ``error``); as não publicadas ficam de fora.
+        """
+        results = []
+        self._results = results
+        self.error = None
+        deadline = time.monotonic() + timeout
+        try:
+            for exchange, routing_key, body, properties in publishes:
+                while len(self._pending) >= self.window:
+                    self._wait_for_confirms(deadline)
+                results.append(False)
+                destination = ('topic', exchange) if exchange else ('queue', routing_key)
+                self._pending[self._next_tag] = (len(results) - 1, time.perf_counter(), destination)
+                self._next_tag += 1
+                self._async.basic_publish(exchange, routing_key, body, properties)
+            while self._pending:
+                self._wait_for_confirms(deadline)
+        except TimeoutError:
+            self.broken = True
+        except Exception as e:
+            self.error = e
+            # Aguarda as confirmações do que já foi publicado, se o canal ainda estiver aberto
+            try:
+                while self._pending and self.is_open:
+                    self._wait_for_confirms(deadline)
+            except Exception:
+                pass
+            self.broken = bool(self._pending) or not self.is_open
+        finally:
+            # O que não foi confirmado até aqui conta como falha
+            self._pending.clear()
+            self._results = None
+        return results
+
+    def close(self):
+        try:
+            if self.channel.is_open:
+                self.channel.close()
+        except Exception:
+            pass
+
+
+class PooledChannel:
+    """Conexão do pool com o seu canal de longa duração"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.channel = connection.channel()
+        self.confirm_publisher = None  # Criado sob demanda por get_confirm_publisher
+        self.last_used = time.monotonic()
+
+    def get_confirm_publisher(self, window=DEFAULT_CONFIRM_WINDOW):
+        """Retorna o canal em modo confirm desta conexão, abrindo-o se preciso"""
+        if self.confirm_publisher is None or not self.confirm_publisher.is_open or self.confirm_publisher.broken:
+            self.confirm_publisher = ConfirmPublisher(self.connection, window)
+        self.confirm_publisher.window = window
+        return self.confirm_publisher
+
+    def is_healthy(self):
+        """Verifica se a conexão e o canal ainda estão utilizáveis"""
+        if not (self.connection.is_open and self.channel.is_open):
+            return False
+        try:
+            # Processa heartbeats pendentes e detecta sockets mortos
+            self.connection.process_data_events(time_limit=0)
+        except Exception:
+            return False
+        return self.channel.is_open
+
+    def close(self):
+        """Fecha a conexão ignorando erros de uma conexão já perdida"""
+        try:
+            if self.connection.is_open:
+                close_rabbitmq_connection(self.connection)
+        except Exception:
+            pass
+
+
+class ChannelPool:
+    """Pool thread-safe de conexões/canais reutilizáveis com o RabbitMQ.
+
+    Cada conexão é emprestada a uma única thread por vez (o BlockingConnection
+    do pika não é thread-safe). As conexões ociosas ficam numa pilha, de modo
+    que um remetente frequente reutiliza sempre o mesmo canal.
+    """
+
+    def __init__(self, connection_factory=None, max_size=DEFAULT_POOL_SIZE,
+                 max_idle=DEFAULT_MAX_IDLE, acquire_timeout=None):
+        self.connection_factory = connection_factory or get_rabbitmq_connection
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.acquire_timeout = acquire_timeout
+        self._idle = []  # Pilha LIFO de PooledChannel ociosos
+        self._in_use = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout=None):
+        """Empresta um canal saudável do pool, reconectando se necessário"""
+        if timeout is None:
+            timeout = self.acquire_timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Pool de canais encerrado.")
+                if self._idle or self._in_use < self.max_size:
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("Nenhum canal disponível no pool.")
+                self._condition.wait(remaining)
+
+            self._in_use += 1
+            stale = self._evict_idle_locked()
+            pooled = self._idle.pop() if self._idle else None
+
+        for entry in stale:
+            entry.close()
+
+        try:
+            if pooled is not None and not pooled.is_healthy():
+                pooled.close()
+                pooled = None
+            if pooled is None:
+                pooled = PooledChannel(self.connection_factory())
+        except Exception:
+            with self._condition:
+                self._in_use -= 1
+                self._condition.notify()
+            raise
+        return pooled
+
+    def release(self, pooled, discard=False):
+        """Devolve um canal ao pool (ou o descarta após uma falha)"""
+        pooled.last_used = time.monotonic()
+        with self._condition:
+            self._in_use -= 1
+            keep = not discard and not self._closed and pooled.channel.is_open
+            if keep:
+                self._idle.append(pooled)
+            self._condition.notify()
+        if not keep:
+            pooled.close()
+
+    @contextmanager
+    def channel(self):
+        """Empresta um canal para o bloco ``with`` e o devolve ao final"""
+        pooled = self.acquire()
+        try:
+            yield pooled.channel
+        except GeneratorExit:
+            # Gerador que usava o canal foi fechado normalmente
+            self.release(pooled)
+            raise
+        except BaseException:
+            # O canal pode ter sido fechado pelo broker: descarta e reconecta depois
+            self.release(pooled, discard=True)
+            raise
+        else:
+            self.release(pooled)
+
+    @contextmanager
+    def confirm_publisher(self, window=DEFAULT_CONFIRM_WINDOW):
+        """Empresta o canal em modo confirm de uma conexão do pool.
+
+        A conexão é descartada se o lote deixou confirmações pendentes
+        (``broken``), para que não sejam atribuídas ao próximo lote.
+        """
+        pooled = self.acquire()
+        try:
+            publisher = pooled.get_confirm_publisher(window)
+            yield publisher
+        except BaseException:
+            self.release(pooled, discard=True)
+            raise
+        else:
+            self.release(pooled, discard=publisher.broken)
+
+    def warm_up(self, connections=1):
+        """Abre até ``connections`` conexões em paralelo e as deixa ociosas no pool.
+
+        Feito em segundo plano na inicialização, tira o tempo de conexão do
+        primeiro uso sem bloquear quem chama (os empréstimos feitos enquanto
+        isso abrem as próprias conexões). Retorna a lista com o tempo de cada
+        conexão aberta; as falhas são repassadas como exceção.
+        """
+        connections = max(1, min(connections, self.max_size))
+
+        def connect():
+            start = time.perf_counter()
+            pooled = self.acquire()
+            elapsed = time.perf_counter() - start
+            return pooled, elapsed
+
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            futures = [executor.submit(connect) for _ in range(connections)]
+        timings = []
+        error = None
+        for future in futures:
+            try:
+                pooled, elapsed = future.result()
+            except Exception as e:
+                error = e
+                continue
+            self.release(pooled)
+            timings.append(elapsed)
+        if error is not None and not timings:
+            raise error
+        return timings
+
+    def evict_idle(self):
+        """Fecha as conexões ociosas há mais de ``max_idle`` segundos"""
+        with self._condition:
+            stale = self._evict_idle_locked()
+        for entry in stale:
+            entry.close()
+        return len(stale)
+
+    def _evict_idle_locked(self):
+        if self.max_idle is None:
+            return []
+        limit = time.monotonic() - self.max_idle
+        stale = [entry for entry in self._idle if entry.last_used < limit]
+        if stale:
+            self._idle = [entry for entry in self._idle if entry.last_used >= limit]
+        return stale
+
+    def close(self):
+        """Fecha todas as conexões ociosas e recusa novos empréstimos"""
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._condition.notify_all()
+        for entry in idle:
+            entry.close()
+
+    def stats(self):
+        """Retorna o estado atual do pool"""
+        with self._condition:
+            return {
+                'max_size': self.max_size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+            }
+
+
+_channel_pool = None
+_channel_pool_lock = threading.Lock()
+
+def get_channel_pool():
+    """Retorna o pool de canais do processo, criando-o na primeira chamada"""
+    global _channel_pool
+    if _channel_pool is None:
+        with _channel_pool_lock:
+            if _channel_pool is None:
+                _channel_pool = ChannelPool()
+    return _channel_pool
+
+def configure_channel_pool(**options):
+    """Substitui o pool do processo por um novo com as opções informadas"""
+    global _channel_pool
+    with _channel_pool_lock:
+        old_pool, _channel_pool = _channel_pool, ChannelPool(**options)
+    if old_pool is not None:
+        old_pool.close()
+    return _channel_pool
+
+def pooled_channel():
+    """Atalho para ``with pooled_channel() as channel:``"""
+    return get_channel_pool().channel()
+
+def pooled_confirm_publisher(window=DEFAULT_CONFIRM_WINDOW):
+    """Atalho para ``with pooled_confirm_publisher() as publisher:``"""
+    return get_channel_pool().confirm_publisher(window)
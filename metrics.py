@@ -0,0 +1,253 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Limites dos buckets de latência (segundos): de 50µs a ~52s, dobrando a cada bucket
+DEFAULT_LATENCY_BUCKETS = tuple(0.00005 * 2 ** i for i in range(21))
+
+METRIC_HELP = {
+    'mom_publish_seconds': "Tempo para publicar uma mensagem (inclui obter o canal do pool).",
+    'mom_roundtrip_seconds': "Ida e volta ao broker (confirmação de publicação, basic_get, operações).",
+    'mom_delivery_latency_seconds': "Latência fim a fim: recebimento menos o timestamp da mensagem.",
+    'mom_handler_seconds': "Tempo de processamento das mensagens pelos listeners.",
+    'mom_messages_sent_total': "Mensagens publicadas.",
+    'mom_bytes_sent_total': "Bytes publicados (corpo das mensagens).",
+    'mom_messages_received_total': "Mensagens recebidas.",
+    'mom_bytes_received_total': "Bytes recebidos (corpo das mensagens).",
+    'mom_messages_dropped_total': "Mensagens descartadas pelo buffer do publicador (drop_oldest).",
+    'mom_messages_spilled_total': "Mensagens gravadas no journal em disco pelo buffer do publicador.",
+    'mom_messages_deduplicated_total': "Mensagens repetidas descartadas pela deduplicação dos consumidores.",
+    'mom_errors_total': "Erros por operação.",
+}
+
+
+class Histogram:
+    """Histograma de buckets fixos (cumulativos na exportação, como no Prometheus).
+
+    ``observe`` faz uma busca binária e três somas sob um lock, então pode ficar
+    ligado em produção; os percentis são estimados por interpolação no bucket.
+    """
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count', 'max', '_lock')
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # O último é o bucket +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+            if value > self.max:
+                self.max = value
+
+    def quantile(self, q):
+        """Estimativa do quantil ``q`` (0 a 1) a partir dos buckets"""
+        with self._lock:
+            counts = list(self.counts)
+            count = self.count
+            maximum = self.max
+        if not count:
+            return 0.0
+        rank = q * count
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else maximum
+                estimate = lower + (upper - lower) * (rank - cumulative) / bucket_count
+                return min(estimate, maximum)
+            cumulative += bucket_count
+        return maximum
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'max': self.max,
+        }
+
+
+class Counter:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+class Metrics:
+    """Histogramas e contadores do processo, identificados por nome e rótulos.
+
+    Os rótulos usados pelo MOM são ``kind`` (``queue``/``topic``), ``name``
+    (fila ou tópico) e ``operation``. Os valores são lidos com ``snapshot()``
+    ou exportados no formato texto do Prometheus com ``to_prometheus()``.
+    Com ``enabled=False`` as chamadas de registro retornam imediatamente.
+    """
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS, enabled=True):
+        self.buckets = tuple(buckets)
+        self.enabled = enabled
+        self._histograms = {}  # (nome, rótulos) -> Histogram
+        self._counters = {}  # (nome, rótulos) -> Counter
+        self._lock = threading.Lock()
+
+    def _get(self, metrics, metric_name, labels, factory):
+        key = (metric_name, tuple(sorted(labels.items())))
+        metric = metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = metrics.get(key)
+                if metric is None:
+                    metric = metrics[key] = factory()
+        return metric
+
+    def histogram(self, name, /, **labels):
+        return self._get(self._histograms, name, labels, lambda: Histogram(self.buckets))
+
+    def counter(self, name, /, **labels):
+        return self._get(self._counters, name, labels, Counter)
+
+    def observe(self, name, value, /, **labels):
+        """Registra ``value`` (segundos) no histograma ``name``"""
+        if self.enabled:
+            self.histogram(name, **labels).observe(value)
+
+    def inc(self, name, amount=1, /, **labels):
+        """Soma ``amount`` ao contador ``name``"""
+        if self.enabled:
+            self.counter(name, **labels).inc(amount)
+
+    @contextmanager
+    def timer(self, name, /, **labels):
+        """Mede o bloco em ``name``; se ele falhar, conta um erro em ``mom_errors_total``"""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.inc('mom_errors_total', **labels)
+            raise
+        self.observe(name, time.perf_counter() - start, **labels)
+
+    def record_sent(self, kind, name, size, elapsed=None):
+        """Registra uma publicação em ``kind`` (``queue``/``topic``) ``name``"""
+        if not self.enabled:
+            return
+        if elapsed is not None:
+            self.observe('mom_publish_seconds', elapsed, kind=kind, name=name)
+        self.inc('mom_messages_sent_total', kind=kind, name=name)
+        self.inc('mom_bytes_sent_total', size, kind=kind, name=name)
+
+    def record_received(self, kind, name, size, message_data=None):
+        """Registra um recebimento e, se houver ``timestamp`` na mensagem, a latência fim a fim"""
+        if not self.enabled:
+            return
+        self.inc('mom_messages_received_total', kind=kind, name=name)
+        self.inc('mom_bytes_received_total', size, kind=kind, name=name)
+        timestamp = message_data.get('timestamp') if isinstance(message_data, dict) else None
+        if isinstance(timestamp, (int, float)):
+            # Relógios diferentes entre máquinas podem gerar valores negativos
+            self.observe('mom_delivery_latency_seconds', max(0.0, time.time() - timestamp),
+                         kind=kind, name=name)
+
+    def record_error(self, operation, kind=None, name=None, amount=1):
+        if not self.enabled:
+            return
+        labels = {'operation': operation}
+        if kind is not None:
+            labels.update(kind=kind, name=name)
+        self.inc('mom_errors_total', amount, **labels)
+
+    def get_histogram(self, name, /, **labels):
+        """Estatísticas de um histograma (None se ainda não houver observações)"""
+        histogram = self._histograms.get((name, tuple(sorted(labels.items()))))
+        return None if histogram is None else histogram.snapshot()
+
+    def get_counter(self, name, /, **labels):
+        counter = self._counters.get((name, tuple(sorted(labels.items()))))
+        return 0 if counter is None else counter.value
+
+    def snapshot(self):
+        """``{'histograms': {nome: [(rótulos, estatísticas)]}, 'counters': {nome: [(rótulos, valor)]}}``"""
+        with self._lock:
+            histograms = list(self._histograms.items())
+            counters = list(self._counters.items())
+        result = {'histograms': {}, 'counters': {}}
+        for (name, labels), histogram in histograms:
+            result['histograms'].setdefault(name, []).append((dict(labels), histogram.snapshot()))
+        for (name, labels), counter in counters:
+            result['counters'].setdefault(name, []).append((dict(labels), counter.value))
+        return result
+
+    def to_prometheus(self):
+        """Exporta todas as métricas no formato texto do Prometheus (0.0.4)"""
+        with self._lock:
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+            counters = sorted(self._counters.items(), key=lambda item: item[0])
+        lines = []
+        described = set()
+
+        def describe(name, metric_type):
+            if name not in described:
+                described.add(name)
+                if name in METRIC_HELP:
+                    lines.append(f"# HELP {name} {METRIC_HELP[name]}")
+                lines.append(f"# TYPE {name} {metric_type}")
+
+        for (name, labels), histogram in histograms:
+            describe(name, 'histogram')
+            with histogram._lock:
+                counts = list(histogram.counts)
+                total, count = histogram.sum, histogram.count
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', repr(bound))])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total!r}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        for (name, labels), counter in counters:
+            describe(name, 'counter')
+            lines.append(f"{name}{_format_labels(labels)} {counter.value}")
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+metrics = Metrics()
+
+def configure_metrics(enabled=True, buckets=None):
+    """Liga/desliga a instrumentação e, opcionalmente, troca os buckets (zera as métricas)"""
+    metrics.enabled = enabled
+    if buckets is not None:
+        metrics.buckets = tuple(buckets)
+        metrics.reset()
+    return metrics
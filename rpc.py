@@ -0,0 +1,144 @@
+import heapq
+import threading
+import time
+import uuid
+from concurrent.futures import Future, InvalidStateError
+
+from message_codecs import encode_message, decode_message
+from message_utils import message_properties
+from metrics import metrics
+
+DIRECT_REPLY_TO = 'amq.rabbitmq.reply-to'  # Pseudo-fila de respostas diretas do RabbitMQ
+DEFAULT_RPC_TIMEOUT = 10.0  # Segundos aguardando a resposta de uma chamada
+
+
+def rpc_queue_name(username):
+    """Fila em que ``username`` recebe as requisições RPC"""
+    return f"rpc_{username}"
+
+
+class RpcError(Exception):
+    """Erro levantado pelo handler do servidor, repassado a quem fez a chamada"""
+
+
+def run_rpc_handler(handler, username, queue_name, method, properties, body):
+    """Executa ``handler(request)`` (num worker do executor) e monta a resposta.
+
+    Retorna ``(corpo, propriedades)`` para o ``reply_to`` da requisição. Um
+    erro no handler vira uma resposta de erro, para que quem chamou não
+    espere até o timeout; a requisição recebe ack normalmente.
+    """
+    start = time.perf_counter()
+    try:
+        request = decode_message(body, properties)
+        metrics.record_received('queue', queue_name, len(body), request)
+        reply = {'from': username, 'message': handler(request), 'timestamp': time.time()}
+    except Exception as e:
+        metrics.record_error('rpc_handler', 'queue', queue_name)
+        reply = {'from': username, 'error': str(e), 'timestamp': time.time()}
+    else:
+        metrics.observe('mom_handler_seconds', time.perf_counter() - start, kind='queue', name=queue_name)
+    if properties is None or not properties.reply_to:
+        return None  # Requisição sem resposta esperada
+    reply_body, content_type, content_encoding = encode_message(reply)
+    return reply_body, message_properties(
+        content_type=content_type,
+        content_encoding=content_encoding,
+        correlation_id=properties.correlation_id,
+        app_id=username
+    )
+
+
+class RpcClient:
+    """Chamadas RPC em andamento, associadas às respostas pelo ``correlation_id``.
+
+    Cada chamada tem um Future e um prazo. As respostas chegam pelo consumidor
+    de ``amq.rabbitmq.reply-to`` na thread de I/O, que resolve o Future
+    correspondente; respostas de chamadas já expiradas são descartadas. Os
+    prazos ficam num heap, varrido a cada chamada e a cada resposta, de modo
+    que chamadas sem resposta não ficam retidas.
+    """
+
+    def __init__(self):
+        self.late_replies = 0  # Respostas que chegaram após o prazo
+        self._pending = {}  # correlation_id -> (Future, fila de destino, instante do envio)
+        self._deadlines = []  # Heap de (prazo, correlation_id)
+        self._lock = threading.Lock()
+
+    def register(self, target_queue, timeout):
+        """Cria o Future de uma nova chamada; ``future.correlation_id`` identifica a requisição"""
+        self.expire()
+        future = Future()
+        future.correlation_id = uuid.uuid4().hex
+        with self._lock:
+            self._pending[future.correlation_id] = (future, target_queue, time.perf_counter())
+            heapq.heappush(self._deadlines, (time.monotonic() + timeout, future.correlation_id))
+            if len(self._deadlines) > 2 * len(self._pending) + 1024:
+                # Prazos de chamadas já respondidas: reconstrói o heap
+                self._deadlines = [entry for entry in self._deadlines if entry[1] in self._pending]
+                heapq.heapify(self._deadlines)
+        return future
+
+    def on_reply(self, channel, method, properties, body):
+        """Callback do consumidor de respostas (thread de I/O)"""
+        with self._lock:
+            entry = self._pending.pop(properties.correlation_id, None)
+        if entry is None:
+            self.late_replies += 1
+        else:
+            future, target_queue, sent_at = entry
+            metrics.observe('mom_roundtrip_seconds', time.perf_counter() - sent_at,
+                            operation='rpc', kind='queue', name=target_queue)
+            try:
+                reply = decode_message(body, properties)
+            except Exception as e:
+                self._resolve(future, error=e)
+            else:
+                if 'error' in reply:
+                    self._resolve(future, error=RpcError(reply['error']))
+                else:
+                    self._resolve(future, result=reply['message'])
+        self.expire()
+
+    def fail(self, correlation_id, error):
+        """Encerra uma chamada com ``error`` (falha no envio ou timeout de quem espera)"""
+        with self._lock:
+            entry = self._pending.pop(correlation_id, None)
+        if entry is not None:
+            self._resolve(entry[0], error=error)
+
+    def fail_all(self, error):
+        with self._lock:
+            entries = list(self._pending.values())
+            self._pending.clear()
+            self._deadlines.clear()
+        for future, _, _ in entries:
+            self._resolve(future, error=error)
+
+    def expire(self):
+        """Encerra com TimeoutError as chamadas cujo prazo passou"""
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _, correlation_id = heapq.heappop(self._deadlines)
+                entry = self._pending.pop(correlation_id, None)
+                if entry is not None:
+                    expired.append(entry)
+        for future, target_queue, _ in expired:
+            metrics.record_error('rpc_timeout', 'queue', target_queue)
+            self._resolve(future, error=TimeoutError(f"Sem resposta de '{target_queue}' no prazo."))
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    @staticmethod
+    def _resolve(future, result=None, error=None):
+        try:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        except InvalidStateError:
+            pass  # Future cancelado por quem chamou
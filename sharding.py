@@ -0,0 +1,203 @@
+import hashlib
+import threading
+from bisect import bisect, insort
+
+from message_utils import ChannelPool, get_channel_pool, get_transport
+from listener_manager import ListenerManager, get_listener_manager
+
+DEFAULT_SHARDS = 4  # Filas físicas por fila fragmentada
+DEFAULT_VIRTUAL_NODES = 128  # Pontos de cada fragmento no anel
+DEFAULT_ENDPOINT = 'default'  # Broker do transporte do processo
+SHARD_KEY_HEADER = 'x-shard-key'  # Cabeçalho com a chave usada no roteamento
+
+
+def _hash(value):
+    """Hash estável de 64 bits (igual em todos os processos, ao contrário de ``hash()``)"""
+    return int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Anel de hash consistente com nós virtuais.
+
+    Cada nó ocupa ``replicas`` pontos do anel; uma chave pertence ao primeiro
+    ponto no sentido horário. Ao adicionar ou remover um nó, só as chaves
+    dos arcos dele mudam de dono (cerca de 1/N do total).
+    """
+
+    def __init__(self, nodes=(), replicas=DEFAULT_VIRTUAL_NODES):
+        self.replicas = replicas
+        self._points = []  # (hash, nó), ordenado
+        self._nodes = set()
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __contains__(self, node):
+        return node in self._nodes
+
+    def add(self, node):
+        if node in self._nodes:
+            return
+        self._nodes.add(node)
+        for replica in range(self.replicas):
+            insort(self._points, (_hash(f"{node}#{replica}"), node))
+
+    def remove(self, node):
+        if node not in self._nodes:
+            return
+        self._nodes.discard(node)
+        self._points = [point for point in self._points if point[1] != node]
+
+    def get(self, key):
+        """Nó responsável pela chave"""
+        if not self._points:
+            raise LookupError("Anel de hash vazio.")
+        index = bisect(self._points, (_hash(key),))
+        return self._points[index % len(self._points)][1]
+
+
+# Brokers adicionais (nós do cluster ou portas locais) com pools e listeners próprios
+
+_endpoints = {}  # nome -> {'transport', 'pool', 'listener_manager'}
+_endpoints_lock = threading.Lock()
+
+def register_endpoint(name, transport, **pool_options):
+    """Registra um broker adicional, ex.: ``register_endpoint('b', PikaTransport('localhost', port=5673))``.
+
+    Cada endpoint tem o seu pool de canais; o seu ListenerManager é criado no
+    primeiro consumidor. ``transport`` é qualquer objeto com ``connect()``.
+    """
+    pool = ChannelPool(connection_factory=transport.connect, **pool_options)
+    with _endpoints_lock:
+        old = _endpoints.get(name)
+        _endpoints[name] = {'transport': transport, 'pool': pool, 'listener_manager': None}
+    if old is not None:
+        old['pool'].close()
+        if old['listener_manager'] is not None:
+            old['listener_manager'].stop()
+    return pool
+
+def get_endpoint_names():
+    with _endpoints_lock:
+        return [DEFAULT_ENDPOINT] + list(_endpoints)
+
+def _get_endpoint(name):
+    endpoint = _endpoints.get(name)
+    if endpoint is None:
+        raise KeyError(f"Endpoint desconhecido: '{name}'")
+    return endpoint
+
+def get_endpoint_pool(name=DEFAULT_ENDPOINT):
+    """Pool de canais do endpoint (o pool do processo para ``default``)"""
+    if name == DEFAULT_ENDPOINT and name not in _endpoints:
+        return get_channel_pool()
+    return _get_endpoint(name)['pool']
+
+def get_endpoint_listener_manager(name=DEFAULT_ENDPOINT):
+    """ListenerManager do endpoint (o compartilhado do processo para ``default``)"""
+    if name == DEFAULT_ENDPOINT and name not in _endpoints:
+        return get_listener_manager()
+    with _endpoints_lock:
+        endpoint = _get_endpoint(name)
+        if endpoint['listener_manager'] is None:
+            endpoint['listener_manager'] = ListenerManager(connection_factory=endpoint['transport'].connect)
+        return endpoint['listener_manager']
+
+def get_endpoint_transport(name=DEFAULT_ENDPOINT):
+    if name == DEFAULT_ENDPOINT and name not in _endpoints:
+        return get_transport()
+    return _get_endpoint(name)['transport']
+
+
+class ShardedQueue:
+    """Fila lógica distribuída em várias filas físicas (fragmentos), possivelmente em vários brokers.
+
+    Os fragmentos se chamam ``<nome>.<índice>`` e são distribuídos em rodízio
+    pelos ``endpoints``, de modo que processos que definem a mesma fila
+    com os mesmos parâmetros chegam ao mesmo anel. Produtores escolhem o
+    fragmento pelo hash consistente da chave da mensagem (mensagens de uma
+    mesma chave ficam em ordem no mesmo fragmento); consumidores leem de
+    todos os fragmentos, começando cada rodada por um diferente.
+    """
+
+    def __init__(self, name, shards=DEFAULT_SHARDS, endpoints=None, arguments=None,
+                 replicas=DEFAULT_VIRTUAL_NODES):
+        self.name = name
+        self.arguments = arguments
+        self.endpoints = list(endpoints or [DEFAULT_ENDPOINT])
+        self.ring = HashRing(replicas=replicas)
+        self.shards = {}  # fila física -> endpoint
+        self._next_index = 0
+        self._rotation = 0
+        self._lock = threading.Lock()
+        for _ in range(shards):
+            self.add_shard()
+
+    def next_shard(self, endpoint=None):
+        """``(fila física, endpoint)`` do próximo fragmento, sem adicioná-lo"""
+        with self._lock:
+            if endpoint is None:
+                endpoint = self.endpoints[self._next_index % len(self.endpoints)]
+            return f"{self.name}.{self._next_index}", endpoint
+
+    def add_shard(self, endpoint=None):
+        """Adiciona um fragmento (no próximo endpoint do rodízio, se não informado)"""
+        shard, endpoint = self.next_shard(endpoint)
+        with self._lock:
+            self._next_index += 1
+            self.shards[shard] = endpoint
+            self.ring.add(shard)
+        return shard
+
+    def remove_shard(self, shard):
+        """Tira o fragmento do anel; as suas chaves passam aos vizinhos"""
+        with self._lock:
+            if shard not in self.shards:
+                return None
+            if len(self.shards) == 1:
+                raise ValueError("Uma fila fragmentada precisa de ao menos um fragmento.")
+            self.ring.remove(shard)
+            return self.shards.pop(shard)
+
+    def restore_shard(self, shard, endpoint):
+        """Devolve ao anel um fragmento removido por ``remove_shard`` (ex.: a redistribuição falhou)"""
+        with self._lock:
+            self.shards[shard] = endpoint
+            self.ring.add(shard)
+
+    def shard_for(self, key):
+        """``(fila física, endpoint)`` responsável pela chave"""
+        with self._lock:
+            shard = self.ring.get(key)
+            return shard, self.shards[shard]
+
+    def rotation(self):
+        """Fragmentos a partir de um diferente a cada chamada (leitura justa)"""
+        with self._lock:
+            shards = list(self.shards.items())
+            start = self._rotation % len(shards)
+            self._rotation += 1
+        return shards[start:] + shards[:start]
+
+
+_sharded_queues = {}  # nome lógico -> ShardedQueue
+_sharded_queues_lock = threading.Lock()
+
+def register_sharded_queue(sharded_queue):
+    with _sharded_queues_lock:
+        _sharded_queues[sharded_queue.name] = sharded_queue
+    return sharded_queue
+
+def unregister_sharded_queue(name):
+    with _sharded_queues_lock:
+        return _sharded_queues.pop(name, None)
+
+def get_sharded_queue(name):
+    """Fila fragmentada definida neste processo (None se não existir)"""
+    return _sharded_queues.get(name)
+
+def list_sharded_queues():
+    with _sharded_queues_lock:
+        return list(_sharded_queues)
@@ -0,0 +1,138 @@
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_REPORT_MODULES = 15  # Imports mais lentos listados no relatório de inicialização
+
+
+class _TimedLoader:
+    """Loader que mede ``exec_module`` e devolve o loader original ao módulo"""
+
+    def __init__(self, loader, timer):
+        self._loader = loader
+        self._timer = timer
+
+    def __getattr__(self, attribute):
+        return getattr(self._loader, attribute)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        self._timer._enter()
+        start = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._timer._exit(module.__name__, time.perf_counter() - start)
+            module.__loader__ = self._loader
+            if module.__spec__ is not None:
+                module.__spec__.loader = self._loader
+
+
+class ImportTimer:
+    """Tempo de cada import, próprio e acumulado, como ``python -X importtime``.
+
+    Instalado no início de ``sys.meta_path``, encontra os módulos pelos
+    outros finders e só envolve o loader para medir a execução; os módulos
+    carregados antes de ``install`` não aparecem. Imports em threads
+    diferentes são medidos separadamente.
+    """
+
+    def __init__(self):
+        self.records = []  # (módulo, segundos próprios, segundos acumulados, profundidade), na ordem de conclusão
+        self._local = threading.local()
+
+    def install(self):
+        if self not in sys.meta_path:
+            sys.meta_path.insert(0, self)
+        return self
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, name, path, target=None):
+        if getattr(self._local, 'finding', False):
+            return None
+        self._local.finding = True
+        try:
+            for finder in sys.meta_path:
+                find_spec = getattr(finder, 'find_spec', None)
+                if finder is self or find_spec is None:
+                    continue
+                spec = find_spec(name, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            self._local.finding = False
+        if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+            spec.loader = _TimedLoader(spec.loader, self)
+        return spec
+
+    def _enter(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(0.0)  # Tempo dos imports aninhados
+
+    def _exit(self, name, elapsed):
+        stack = self._local.stack
+        children = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        self.records.append((name, elapsed - children, elapsed, len(stack)))
+
+    def total(self):
+        """Segundos gastos nos imports de primeiro nível"""
+        return sum(cumulative for _, _, cumulative, depth in self.records if depth == 0)
+
+    def slowest(self, limit=DEFAULT_REPORT_MODULES):
+        return sorted(self.records, key=lambda record: record[2], reverse=True)[:limit]
+
+
+class StartupReport:
+    """Fases da inicialização (imports, conexão, ambiente de exemplo) e o tempo até o menu.
+
+    ``mark`` registra o instante de um evento, contado desde ``started``;
+    ``measure`` registra a duração de um bloco. Com um ``ImportTimer``, o
+    relatório lista também os imports mais lentos.
+    """
+
+    def __init__(self, started=None, import_timer=None):
+        self.started = time.perf_counter() if started is None else started
+        self.import_timer = import_timer
+        self.events = []  # (evento, instante desde o início, duração ou None)
+        self._lock = threading.Lock()
+
+    def mark(self, event):
+        with self._lock:
+            self.events.append((event, time.perf_counter() - self.started, None))
+
+    @contextmanager
+    def measure(self, event):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self.events.append((event, end - self.started, end - start))
+
+    def format(self, limit=DEFAULT_REPORT_MODULES):
+        lines = ["Relatório de inicialização (ms desde o início de main.py):"]
+        with self._lock:
+            events = sorted(self.events, key=lambda event: event[1])
+        for event, at, duration in events:
+            spent = f"  ({duration * 1000:.1f}ms)" if duration is not None else ''
+            lines.append(f"  {at * 1000:9.1f}  {event}{spent}")
+        if self.import_timer is not None and self.import_timer.records:
+            lines.append(f"Imports: {len(self.import_timer.records)} módulos, "
+                         f"{self.import_timer.total() * 1000:.1f}ms; os mais lentos:")
+            lines.append("  import time:  self [us] | cumulative | imported package")
+            for name, own, cumulative, depth in self.import_timer.slowest(limit):
+                lines.append(f"  import time: {own * 1e6:10.0f} | {cumulative * 1e6:10.0f} | {'  ' * depth}{name}")
+        return '\n'.join(lines)
@@ -0,0 +1,329 @@
+import json
+import sqlite3
+import threading
+
+DEFAULT_PAGE_SIZE = 1000  # Registros lidos por consulta no carregamento incremental
+
+
+class InMemoryRegistry:
+    """Registro em memória de usuários, filas, tópicos e inscrições.
+
+    Mantém índices nos dois sentidos (usuário -> tópicos e tópico -> usuários),
+    de modo que ambas as consultas são O(1). O conteúdo é perdido ao encerrar.
+    """
+
+    persistent = False
+
+    def __init__(self):
+        self._users = {}  # usuário -> fila
+        self._queues = {}  # fila -> argumentos
+        self._topics = {}  # tópico -> tipo do exchange
+        self._user_topics = {}  # usuário -> conjunto de tópicos
+        self._topic_users = {}  # tópico -> conjunto de usuários
+        self._bindings = {}  # (usuário, tópico) -> (chave de ligação, argumentos)
+        self._lock = threading.Lock()
+
+    # Usuários
+
+    def add_user(self, username, queue_name):
+        self.add_users([(username, queue_name)])
+
+    def add_users(self, users):
+        with self._lock:
+            for username, queue_name in users:
+                self._users[username] = queue_name
+                self._user_topics.setdefault(username, set())
+
+    def remove_user(self, username):
+        with self._lock:
+            self._users.pop(username, None)
+            for topic_name in self._user_topics.pop(username, set()):
+                self._topic_users.get(topic_name, set()).discard(username)
+                self._bindings.pop((username, topic_name), None)
+
+    def has_user(self, username):
+        return username in self._users
+
+    def get_user_queue(self, username):
+        return self._users.get(username)
+
+    def iter_users(self, page_size=DEFAULT_PAGE_SIZE):
+        """Itera sobre ``(usuário, fila)``"""
+        with self._lock:
+            users = list(self._users.items())
+        return iter(users)
+
+    def count_users(self):
+        return len(self._users)
+
+    # Filas
+
+    def add_queue(self, queue_name, arguments=None):
+        self.add_queues([(queue_name, arguments)])
+
+    def add_queues(self, queues):
+        with self._lock:
+            for queue_name, arguments in queues:
+                self._queues[queue_name] = dict(arguments or {})
+
+    def remove_queue(self, queue_name):
+        with self._lock:
+            self._queues.pop(queue_name, None)
+
+    def has_queue(self, queue_name):
+        return queue_name in self._queues
+
+    def get_queue_arguments(self, queue_name):
+        arguments = self._queues.get(queue_name)
+        return None if arguments is None else dict(arguments)
+
+    def iter_queues(self, page_size=DEFAULT_PAGE_SIZE):
+        """Itera sobre ``(fila, argumentos)``"""
+        with self._lock:
+            queues = [(name, dict(arguments)) for name, arguments in self._queues.items()]
+        return iter(queues)
+
+    # Tópicos
+
+    def add_topic(self, topic_name, exchange_type='fanout'):
+        self.add_topics([(topic_name, exchange_type)])
+
+    def add_topics(self, topics):
+        with self._lock:
+            for topic_name, exchange_type in topics:
+                self._topics[topic_name] = exchange_type
+                self._topic_users.setdefault(topic_name, set())
+
+    def remove_topic(self, topic_name):
+        with self._lock:
+            self._topics.pop(topic_name, None)
+            for username in self._topic_users.pop(topic_name, set()):
+                self._user_topics.get(username, set()).discard(topic_name)
+                self._bindings.pop((username, topic_name), None)
+
+    def has_topic(self, topic_name):
+        return topic_name in self._topics
+
+    def get_topic_type(self, topic_name):
+        return self._topics.get(topic_name)
+
+    def iter_topics(self, page_size=DEFAULT_PAGE_SIZE):
+        """Itera sobre ``(tópico, tipo do exchange)``"""
+        with self._lock:
+            topics = list(self._topics.items())
+        return iter(topics)
+
+    # Inscrições
+
+    def subscribe(self, username, topic_name, binding_key='', arguments=None):
+        with self._lock:
+            self._user_topics.setdefault(username, set()).add(topic_name)
+            self._topic_users.setdefault(topic_name, set()).add(username)
+            self._bindings[(username, topic_name)] = (binding_key, dict(arguments or {}))
+
+    def unsubscribe(self, username, topic_name):
+        with self._lock:
+            self._user_topics.get(username, set()).discard(topic_name)
+            self._topic_users.get(topic_name, set()).discard(username)
+            self._bindings.pop((username, topic_name), None)
+
+    def get_subscription(self, username, topic_name):
+        """Retorna ``(chave de ligação, argumentos)`` da inscrição, ou None"""
+        binding = self._bindings.get((username, topic_name))
+        return None if binding is None else (binding[0], dict(binding[1]))
+
+    def topics_of(self, username):
+        with self._lock:
+            return list(self._user_topics.get(username, ()))
+
+    def subscribers_of(self, topic_name):
+        with self._lock:
+            return list(self._topic_users.get(topic_name, ()))
+
+    def close(self):
+        pass
+
+
+class SQLiteRegistry:
+    """Registro persistente em SQLite com a mesma interface do InMemoryRegistry.
+
+    As inscrições têm chave primária (usuário, tópico) e um índice
+    (tópico, usuário), então tanto "tópicos de um usuário" quanto "inscritos
+    em um tópico" são consultas indexadas. Nada é carregado inteiro em
+    memória: as consultas são feitas sob demanda e as listagens são
+    paginadas (``iter_*``).
+    """
+
+    persistent = True
+
+    def __init__(self, path='mom_registry.db'):
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript("""
+                CREATE TABLE IF NOT EXISTS users (
+                    username TEXT PRIMARY KEY,
+                    queue TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS queues (
+                    name TEXT PRIMARY KEY,
+                    arguments TEXT NOT NULL DEFAULT '{}'
+                );
+                CREATE TABLE IF NOT EXISTS topics (
+                    name TEXT PRIMARY KEY,
+                    exchange_type TEXT NOT NULL DEFAULT 'fanout'
+                );
+                CREATE TABLE IF NOT EXISTS subscriptions (
+                    username TEXT NOT NULL,
+                    topic TEXT NOT NULL,
+                    binding_key TEXT NOT NULL DEFAULT '',
+                    arguments TEXT NOT NULL DEFAULT '{}',
+                    PRIMARY KEY (username, topic)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS idx_subscriptions_topic
+                    ON subscriptions (topic, username);
+            """)
+            # Registros criados antes das chaves de ligação
+            columns = {row[1] for row in self._connection.execute("PRAGMA table_info(subscriptions)")}
+            if 'binding_key' not in columns:
+                self._connection.execute(
+                    "ALTER TABLE subscriptions ADD COLUMN binding_key TEXT NOT NULL DEFAULT ''")
+            if 'arguments' not in columns:
+                self._connection.execute(
+                    "ALTER TABLE subscriptions ADD COLUMN arguments TEXT NOT NULL DEFAULT '{}'")
+
+    def _execute(self, sql, parameters=()):
+        with self._lock, self._connection:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def _executemany(self, sql, rows):
+        with self._lock, self._connection:
+            self._connection.executemany(sql, rows)
+
+    def _iter_pages(self, sql, page_size):
+        """Pagina uma consulta ordenada pela chave primária (carregamento incremental)"""
+        last_key = ''
+        while True:
+            rows = self._execute(sql, (last_key, page_size))
+            yield from rows
+            if len(rows) < page_size:
+                return
+            last_key = rows[-1][0]
+
+    # Usuários
+
+    def add_user(self, username, queue_name):
+        self.add_users([(username, queue_name)])
+
+    def add_users(self, users):
+        self._executemany("INSERT OR REPLACE INTO users (username, queue) VALUES (?, ?)", users)
+
+    def remove_user(self, username):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM subscriptions WHERE username = ?", (username,))
+            self._connection.execute("DELETE FROM users WHERE username = ?", (username,))
+
+    def has_user(self, username):
+        return bool(self._execute("SELECT 1 FROM users WHERE username = ?", (username,)))
+
+    def get_user_queue(self, username):
+        rows = self._execute("SELECT queue FROM users WHERE username = ?", (username,))
+        return rows[0][0] if rows else None
+
+    def iter_users(self, page_size=DEFAULT_PAGE_SIZE):
+        """Itera sobre ``(usuário, fila)``, uma página por consulta"""
+        return self._iter_pages(
+            "SELECT username, queue FROM users WHERE username > ? ORDER BY username LIMIT ?",
+            page_size
+        )
+
+    def count_users(self):
+        return self._execute("SELECT COUNT(*) FROM users")[0][0]
+
+    # Filas
+
+    def add_queue(self, queue_name, arguments=None):
+        self.add_queues([(queue_name, arguments)])
+
+    def add_queues(self, queues):
+        self._executemany(
+            "INSERT OR REPLACE INTO queues (name, arguments) VALUES (?, ?)",
+            [(queue_name, json.dumps(arguments or {}, sort_keys=True)) for queue_name, arguments in queues]
+        )
+
+    def remove_queue(self, queue_name):
+        self._execute("DELETE FROM queues WHERE name = ?", (queue_name,))
+
+    def has_queue(self, queue_name):
+        return bool(self._execute("SELECT 1 FROM queues WHERE name = ?", (queue_name,)))
+
+    def get_queue_arguments(self, queue_name):
+        rows = self._execute("SELECT arguments FROM queues WHERE name = ?", (queue_name,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def iter_queues(self, page_size=DEFAULT_PAGE_SIZE):
+        """Itera sobre ``(fila, argumentos)``, uma página por consulta"""
+        for name, arguments in self._iter_pages(
+                "SELECT name, arguments FROM queues WHERE name > ? ORDER BY name LIMIT ?",
+                page_size):
+            yield name, json.loads(arguments)
+
+    # Tópicos
+
+    def add_topic(self, topic_name, exchange_type='fanout'):
+        self.add_topics([(topic_name, exchange_type)])
+
+    def add_topics(self, topics):
+        self._executemany("INSERT OR REPLACE INTO topics (name, exchange_type) VALUES (?, ?)", topics)
+
+    def remove_topic(self, topic_name):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM subscriptions WHERE topic = ?", (topic_name,))
+            self._connection.execute("DELETE FROM topics WHERE name = ?", (topic_name,))
+
+    def has_topic(self, topic_name):
+        return bool(self._execute("SELECT 1 FROM topics WHERE name = ?", (topic_name,)))
+
+    def get_topic_type(self, topic_name):
+        rows = self._execute("SELECT exchange_type FROM topics WHERE name = ?", (topic_name,))
+        return rows[0][0] if rows else None
+
+    def iter_topics(self, page_size=DEFAULT_PAGE_SIZE):
+        """Itera sobre ``(tópico, tipo do exchange)``, uma página por consulta"""
+        return self._iter_pages(
+            "SELECT name, exchange_type FROM topics WHERE name > ? ORDER BY name LIMIT ?",
+            page_size
+        )
+
+    # Inscrições
+
+    def subscribe(self, username, topic_name, binding_key='', arguments=None):
+        self._execute(
+            "INSERT OR REPLACE INTO subscriptions (username, topic, binding_key, arguments) VALUES (?, ?, ?, ?)",
+            (username, topic_name, binding_key, json.dumps(arguments or {}, sort_keys=True))
+        )
+
+    def unsubscribe(self, username, topic_name):
+        self._execute("DELETE FROM subscriptions WHERE username = ? AND topic = ?",
+                      (username, topic_name))
+
+    def get_subscription(self, username, topic_name):
+        """Retorna ``(chave de ligação, argumentos)`` da inscrição, ou None"""
+        rows = self._execute("SELECT binding_key, arguments FROM subscriptions WHERE username = ? AND topic = ?",
+                             (username, topic_name))
+        return (rows[0][0], json.loads(rows[0][1])) if rows else None
+
+    def topics_of(self, username):
+        rows = self._execute("SELECT topic FROM subscriptions WHERE username = ?", (username,))
+        return [row[0] for row in rows]
+
+    def subscribers_of(self, topic_name):
+        rows = self._execute("SELECT username FROM subscriptions WHERE topic = ?", (topic_name,))
+        return [row[0] for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
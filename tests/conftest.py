@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from in_memory_broker import InMemoryBroker
+from listener_manager import shutdown_listener_manager
+from message_utils import InMemoryTransport, configure_transport
+from metrics import metrics
+
+
+@pytest.fixture
+def broker():
+    """Broker em memória novo para cada teste (o pool de canais e o cache de declarações são recriados)"""
+    broker = InMemoryBroker()
+    configure_transport(InMemoryTransport(broker))
+    metrics.reset()
+    yield broker
+    shutdown_listener_manager()
+    metrics.reset()
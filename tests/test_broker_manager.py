@@ -0,0 +1,85 @@
+import inspect
+
+import pytest
+
+from broker_manager import BrokerManager
+from subscription_registry import SQLiteRegistry
+from user_application import UserApplication
+
+
+class CountingRegistry(SQLiteRegistry):
+    def __init__(self, path):
+        super().__init__(path)
+        self.lookups = 0
+
+    def get_queue_arguments(self, queue_name):
+        self.lookups += 1
+        return super().get_queue_arguments(queue_name)
+
+
+def test_queue_arguments_are_memoized(broker, tmp_path):
+    registry = CountingRegistry(str(tmp_path / 'registry.db'))
+    broker_manager = BrokerManager(registry)
+    broker_manager.create_users(['alice', 'bob'], max_length=100)
+    alice = UserApplication('alice', broker_manager)
+    for i in range(20):
+        assert alice.send_message_to_user('bob', i)
+    assert registry.lookups == 1
+    assert broker_manager.get_queue_arguments('user_bob') == {'x-max-length': 100}
+
+    # Remover e recriar a fila descarta a memória
+    broker_manager.remove_queue('user_bob')
+    assert broker_manager.get_queue_arguments('user_bob') is None
+    broker_manager.add_queue('user_bob', max_length=5)
+    assert broker_manager.get_queue_arguments('user_bob') == {'x-max-length': 5}
+    registry.close()
+
+
+def test_invalid_policy_is_reported_per_item(broker):
+    broker_manager = BrokerManager()
+    report = broker_manager.add_queues(['a', 'b'], overflow='descartar')
+    assert list(report) == ['a', 'b']
+    assert not any(result['ok'] for result in report.values())
+    assert all(result['error'].startswith('política inválida') for result in report.values())
+    report = broker_manager.create_users(['ana'], tamanho=10)
+    assert not report['ana']['ok']
+    assert not broker_manager.has_queue('a') and not broker_manager.has_user('ana')
+
+
+def test_add_topic_with_history_registers_only_after_binding(broker, monkeypatch):
+    import broker_manager as broker_manager_module
+
+    def failing_bind(*args, **kwargs):
+        raise RuntimeError('binding recusado')
+
+    broker_manager = BrokerManager()
+    monkeypatch.setattr(broker_manager_module, 'bind_queue', failing_bind)
+    assert not broker_manager.add_topic('eventos', 'topic', history=True)
+    assert not broker_manager.has_topic('eventos')
+    assert not broker_manager.has_topic_history('eventos')
+    assert 'history_eventos' not in broker.queues
+
+    monkeypatch.undo()
+    assert broker_manager.add_topic('eventos', 'topic', history=True)
+    assert broker_manager.has_topic('eventos') and broker_manager.has_topic_history('eventos')
+    assert broker.queues['history_eventos'].stream
+
+
+def test_async_broker_manager_only_shares_registry_queries(tmp_path):
+    pytest.importorskip('aio_pika')
+    from async_broker_manager import AsyncBrokerManager
+    from async_message_utils import AsyncConnectionManager
+
+    registry = SQLiteRegistry(str(tmp_path / 'registry.db'))
+    registry.add_queue('user_bob', {'x-max-length': 10})
+    registry.add_topic('eventos', 'topic')
+    connection_manager = AsyncConnectionManager()
+    broker_manager = AsyncBrokerManager(connection_manager, registry)
+    assert not isinstance(broker_manager, BrokerManager)
+    assert not hasattr(broker_manager, 'add_queues') and not hasattr(broker_manager, 'start_monitoring')
+    assert inspect.iscoroutinefunction(broker_manager.add_topic)
+    assert broker_manager.get_queue_arguments('user_bob') == {'x-max-length': 10}
+    assert broker_manager.get_topic_type('eventos') == 'topic'
+    # Warm start: recursos persistidos não são redeclarados na conexão
+    assert connection_manager.get_exchange_type('eventos') == 'topic'
+    registry.close()
@@ -0,0 +1,26 @@
+import pytest
+
+from broker_manager import BrokerManager
+from broker_monitor import collect_broker_stats
+from message_utils import _async_channel
+
+
+def test_collect_broker_stats_marks_missing_resources(broker):
+    BrokerManager().create_users(['alice', 'bob'])
+    stats = collect_broker_stats(['user_alice', 'user_bob', 'inexistente'], ['sem_topico'], lanes=2)
+    assert stats['queues'] == {'user_alice': {'messages': 0, 'consumers': 0},
+                               'user_bob': {'messages': 0, 'consumers': 0},
+                               'inexistente': None}
+    assert stats['topics'] == {'sem_topico': False}
+
+
+def test_async_channel_rejects_incomplete_api():
+    class Impl:
+        def confirm_delivery(self, *args, **kwargs):
+            pass
+
+    class Channel:
+        _impl = Impl()
+
+    with pytest.raises(RuntimeError, match='basic_publish, queue_declare, exchange_declare'):
+        _async_channel(Channel())
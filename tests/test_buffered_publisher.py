@@ -0,0 +1,90 @@
+import time
+
+import pytest
+
+from buffered_publisher import BufferedPublisher
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def bodies(broker, queue_name):
+    return [message.body for message in broker.queues[queue_name].messages]
+
+
+@pytest.fixture
+def make_publisher(broker):
+    publishers = []
+
+    def make(**options):
+        publisher = BufferedPublisher(connection_factory=broker.connect, retry_delay=0.05, **options)
+        publishers.append(publisher)
+        return publisher
+
+    yield make
+    for publisher in publishers:
+        publisher.close(timeout=1)
+
+
+def blocked(broker, publisher):
+    """Publica uma primeira mensagem (a conexão é aberta) e dispara o alarme do broker"""
+    assert publisher.publish('', 'fila', b'0') and publisher.flush(timeout=5)
+    broker.set_alarm()
+    assert wait_for(lambda: publisher.stats()['blocked'] is not None)
+
+
+def test_flush_delivers_buffered_messages_in_order(make_publisher, broker):
+    publisher = make_publisher(batch_size=7)
+    for i in range(50):
+        assert publisher.publish('', 'fila', b'%d' % i)
+    assert publisher.flush(timeout=5)
+    assert bodies(broker, 'fila') == [b'%d' % i for i in range(50)]
+    stats = publisher.stats()
+    assert stats['published'] == stats['confirmed'] == 50 and stats['buffered'] == 0
+
+
+def test_broker_alarm_holds_messages_in_the_buffer(make_publisher, broker):
+    publisher = make_publisher()
+    blocked(broker, publisher)
+    assert publisher.publish('', 'fila', b'1')
+    assert not publisher.flush(timeout=0.2)
+    assert publisher.stats()['buffered'] == 1 and bodies(broker, 'fila') == [b'0']
+    broker.clear_alarm()
+    assert publisher.flush(timeout=5)
+    assert bodies(broker, 'fila') == [b'0', b'1'] and publisher.stats()['blocked'] is None
+
+
+def test_overflow_drop_oldest(make_publisher, broker):
+    publisher = make_publisher(max_buffer=2, overflow='drop_oldest')
+    blocked(broker, publisher)
+    for body in (b'a', b'b', b'c', b'd'):
+        assert publisher.publish('', 'fila', body)
+    assert publisher.stats()['dropped'] == 2
+    broker.clear_alarm()
+    assert publisher.flush(timeout=5)
+    assert bodies(broker, 'fila') == [b'0', b'c', b'd']
+
+
+def test_overflow_spill_keeps_the_order(make_publisher, broker, tmp_path):
+    publisher = make_publisher(max_buffer=2, overflow='spill', journal_path=str(tmp_path / 'journal'))
+    blocked(broker, publisher)
+    for i in range(1, 6):
+        assert publisher.publish('', 'fila', b'%d' % i)
+    assert publisher.stats()['spilled'] == 3 and publisher.stats()['journal'] == 3
+    broker.clear_alarm()
+    assert publisher.flush(timeout=5)
+    assert bodies(broker, 'fila') == [b'%d' % i for i in range(6)]
+
+
+def test_overflow_block_gives_up_after_the_timeout(make_publisher, broker):
+    publisher = make_publisher(max_buffer=1, block_timeout=0.05)
+    blocked(broker, publisher)
+    assert publisher.publish('', 'fila', b'1')
+    assert not publisher.publish('', 'fila', b'2')
+    broker.clear_alarm()
+    assert publisher.flush(timeout=5)
+    assert bodies(broker, 'fila') == [b'0', b'1']
@@ -0,0 +1,80 @@
+import os
+import random
+
+from chunked_transfer import (
+    ChunkReassembler, iter_chunk_messages, iter_file_chunks, iter_stream_chunks, new_transfer_id
+)
+
+CONTENT = bytes(random.Random(7).getrandbits(8) for _ in range(10000))
+
+
+def chunk_messages(content, chunk_size=1024, name='dados.bin'):
+    chunks = iter_stream_chunks([content], chunk_size)
+    return list(iter_chunk_messages('alice', new_transfer_id(), chunks, name, len(content)))
+
+
+def test_stream_chunks_regroup_input():
+    chunks = list(iter_stream_chunks([b'ab', b'cdefg', b'', b'h'], 3))
+    assert [bytes(chunk) for chunk in chunks] == [b'abc', b'def', b'gh']
+
+
+def test_file_chunks(tmp_path):
+    path = tmp_path / 'arquivo'
+    path.write_bytes(CONTENT)
+    assert b''.join(bytes(chunk) for chunk in iter_file_chunks(str(path), 4096)) == CONTENT
+    empty = tmp_path / 'vazio'
+    empty.write_bytes(b'')
+    assert list(iter_file_chunks(str(empty))) == []
+
+
+def test_last_chunk_carries_count_and_digest():
+    messages = chunk_messages(CONTENT)
+    assert len(messages) == 10
+    headers = [properties.headers for _, properties in messages]
+    assert [h['x-chunk-index'] for h in headers] == list(range(10))
+    assert [h['x-chunk-offset'] for h in headers] == [i * 1024 for i in range(10)]
+    assert 'x-chunk-count' not in headers[0]
+    assert headers[-1]['x-chunk-count'] == 10
+    assert headers[-1]['x-transfer-size'] == len(CONTENT)
+    assert all(isinstance(body, bytes) for body, _ in messages)
+
+
+def test_reassembles_out_of_order_with_duplicates(tmp_path):
+    reassembler = ChunkReassembler(str(tmp_path))
+    messages = chunk_messages(CONTENT)
+    shuffled = messages[:]
+    random.Random(3).shuffle(shuffled)
+    shuffled.insert(3, shuffled[1])  # Reentrega
+    results = [reassembler.feed(properties, body) for body, properties in shuffled]
+    completed = [result for result in results if result is not None]
+    assert len(completed) == 1
+    result = completed[0]
+    assert result['ok'] and result['error'] is None
+    assert result['chunks'] == 10 and result['duplicates'] == 1
+    with open(result['path'], 'rb') as file:
+        assert file.read() == CONTENT
+    assert os.path.basename(result['path']).endswith('_dados.bin')
+    # Reentrega após a conclusão é só contada
+    body, properties = messages[0]
+    assert reassembler.feed(properties, body) is None
+    assert result['duplicates'] == 2
+
+
+def test_sha_mismatch_keeps_part_file(tmp_path):
+    reassembler = ChunkReassembler(str(tmp_path))
+    messages = chunk_messages(CONTENT)
+    body, properties = messages[4]
+    messages[4] = (b'\x00' * len(body), properties)  # Pedaço corrompido
+    results = [reassembler.feed(properties, body) for body, properties in reversed(messages)]
+    result = results[-1]
+    assert result is not None and not result['ok']
+    assert result['error'] == 'SHA-256 não confere'
+    assert result['path'].endswith('.part') and os.path.exists(result['path'])
+
+
+def test_empty_transfer(tmp_path):
+    reassembler = ChunkReassembler(str(tmp_path))
+    (body, properties), = chunk_messages(b'')
+    result = reassembler.feed(properties, body)
+    assert result['ok'] and result['size'] == 0
+    assert os.path.getsize(result['path']) == 0
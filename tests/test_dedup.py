@@ -0,0 +1,96 @@
+import dedup
+from dedup import BloomFilter, DedupCache, RotatingBloomFilter, message_key
+from message_utils import message_properties
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_message_key_prefers_message_id():
+    assert message_key(message_properties(message_id='abc'), b'corpo') == 'abc'
+    assert message_key(message_properties(), b'corpo') == message_key(None, b'corpo')
+    assert message_key(None, b'corpo') != message_key(None, b'outro')
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000)
+    keys = [f"id-{i}" for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    false_positives = sum(f"novo-{i}" in bloom for i in range(10000))
+    assert false_positives < 100
+
+
+def test_rotating_bloom_rotates_when_full():
+    bloom = RotatingBloomFilter(10)
+    for i in range(10):
+        bloom.add(f"a{i}")
+    bloom.add('b0')  # Cheio: o atual vira o anterior
+    assert bloom.previous is not None and 'a0' in bloom and 'b0' in bloom
+    for i in range(1, 10):
+        bloom.add(f"b{i}")
+    bloom.add('c0')  # Segunda rotação: os primeiros são esquecidos
+    assert 'a0' not in bloom
+    assert 'b0' in bloom and 'c0' in bloom
+
+
+def test_rotating_bloom_rotates_every_half_window(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(dedup.time, 'monotonic', clock)
+    bloom = RotatingBloomFilter(1000, window=10.0)
+    bloom.add('x')
+    clock.now += 6
+    assert 'x' in bloom  # Passou meia janela: está no filtro anterior
+    clock.now += 6
+    assert 'x' not in bloom
+
+
+def test_exact_cache_detects_duplicates_and_evicts_oldest():
+    cache = DedupCache(max_entries=3)
+    assert [cache.seen(key) for key in ('a', 'b', 'a')] == [False, False, True]
+    for key in ('c', 'd'):
+        cache.seen(key)
+    assert cache.seen('a') is False  # Saiu por limite de entradas
+    assert cache.stats()['entries'] == 3
+    assert cache.duplicates == 1
+
+
+def test_exact_cache_forgets_after_window(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(dedup.time, 'time', clock)
+    cache = DedupCache(window=60.0)
+    assert cache.seen('a') is False
+    clock.now += 30
+    assert cache.seen('a') is True
+    clock.now += 61
+    assert cache.seen('a') is False
+
+
+def test_claim_commit_release():
+    cache = DedupCache()
+    assert cache.claim('a')
+    assert not cache.claim('a')  # Cópia chegando durante o processamento
+    cache.release('a')  # Falhou: a reentrega será processada
+    assert cache.claim('a')
+    cache.commit('a')
+    assert not cache.claim('a')
+    assert cache.stats()['in_progress'] == 0
+
+
+def test_probabilistic_cache_with_persistent_store(tmp_path):
+    path = str(tmp_path / 'dedup.db')
+    cache = DedupCache(max_entries=100, probabilistic=True, path=path)
+    assert cache.seen('a') is False
+    assert cache.seen('a') is True
+    assert cache.stats()['mode'] == 'probabilistic'
+    cache.close()
+    # Outro processo (cache novo) reconhece o ID pelo disco
+    restarted = DedupCache(path=path)
+    assert restarted.seen('a') is True
+    restarted.close()
@@ -0,0 +1,119 @@
+import threading
+import time
+
+import pytest
+
+from listener_manager import ListenerManager
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+@pytest.fixture
+def manager(broker):
+    connections = []
+
+    def connect():
+        connections.append(broker.connect())
+        return connections[-1]
+
+    manager = ListenerManager(connection_factory=connect, poll_interval=0.01)
+    manager.connections = connections
+    yield manager
+    manager.stop()
+
+
+def declare(broker, *queues):
+    channel = broker.connect().channel()
+    for queue in queues:
+        channel.queue_declare(queue, durable=True)
+    return channel
+
+
+def test_consumers_share_one_connection_and_io_thread(manager, broker):
+    channel = declare(broker, 'fila_a', 'fila_b')
+    received = []
+
+    def on_message(ch, method, properties, body):
+        received.append((method.routing_key, body, threading.current_thread().name))
+
+    manager.add_consumer('a', 'fila_a', on_message)
+    manager.add_consumer('b', 'fila_b', on_message)
+    channel.basic_publish('', 'fila_a', b'1')
+    channel.basic_publish('', 'fila_b', b'2')
+    assert wait_for(lambda: len(received) == 2)
+    assert sorted(received) == [('fila_a', b'1', 'mom-listeners'), ('fila_b', b'2', 'mom-listeners')]
+    assert len(manager.connections) == 1
+    assert sorted(manager.consumer_ids()) == ['a', 'b']
+    assert manager.stats()['a']['delivered'] == 1 and manager.stats()['a']['active']
+
+
+def test_removed_consumer_stops_receiving(manager, broker):
+    channel = declare(broker, 'fila_a', 'fila_b')
+    received = []
+    manager.add_consumer('a', 'fila_a', lambda ch, method, properties, body: received.append(body))
+    manager.add_consumer('b', 'fila_b', lambda ch, method, properties, body: received.append(body))
+    assert manager.remove_consumer('a')
+    assert not manager.remove_consumer('a')
+    channel.basic_publish('', 'fila_a', b'retida')
+    channel.basic_publish('', 'fila_b', b'entregue')
+    assert wait_for(lambda: received == [b'entregue'])
+    assert list(broker.queues['fila_a'].messages)  # Sem consumidor, a mensagem aguarda na fila
+    assert manager.consumer_ids() == ['b']
+
+
+def test_stop_cancels_consumers_and_closes_the_connection(manager, broker):
+    declare(broker, 'fila_a')
+    manager.add_consumer('a', 'fila_a', lambda ch, method, properties, body: None)
+    manager.stop()
+    assert not manager.is_running() and not manager.thread.is_alive()
+    assert not manager.connections[0].is_open
+    assert manager.consumer_ids() == []
+    assert not broker.queues['fila_a'].consumers
+
+
+def test_handler_runs_in_the_executor_and_acks_after_processing(manager, broker):
+    channel = declare(broker, 'tarefas')
+    release = threading.Event()
+    threads = []
+
+    def handler(method, properties, body):
+        threads.append(threading.current_thread().name)
+        release.wait(5)
+
+    manager.add_consumer('tarefas', 'tarefas', handler=handler, prefetch_count=2)
+    for i in range(5):
+        channel.basic_publish('', 'tarefas', b'%d' % i)
+    consumer = broker.queues['tarefas'].consumers[0]
+    # O prefetch limita as mensagens entregues e ainda não confirmadas
+    assert wait_for(lambda: len(threads) == 2)
+    assert consumer.unacked == 2 and len(broker.queues['tarefas'].messages) == 3
+    assert 'mom-listeners' not in threads
+    release.set()
+    assert wait_for(lambda: manager.stats()['tarefas']['acked'] == 5)
+    assert consumer.unacked == 0 and not broker.queues['tarefas'].messages
+
+
+def test_failed_handler_rejects_the_message(manager, broker):
+    channel = declare(broker, 'descarte', 'repetir')
+    attempts = []
+
+    def handler(method, properties, body):
+        attempts.append(method.routing_key)
+        if len(attempts) < 3:
+            raise ValueError('falha no handler')
+
+    manager.add_consumer('descarte', 'descarte', handler=handler)
+    channel.basic_publish('', 'descarte', b'x')
+    assert wait_for(lambda: manager.stats()['descarte']['nacked'] == 1)
+    assert not broker.queues['descarte'].messages  # Rejeitada sem voltar à fila
+
+    manager.add_consumer('repetir', 'repetir', handler=handler, requeue_on_error=True)
+    channel.basic_publish('', 'repetir', b'y')
+    assert wait_for(lambda: manager.stats()['repetir']['acked'] == 1)
+    assert attempts == ['descarte', 'repetir', 'repetir']
+    assert manager.stats()['repetir']['errors'] == 1
@@ -0,0 +1,54 @@
+import pika
+import pytest
+
+from message_codecs import (
+    CODECS, COMPRESSORS, CONTENT_TYPE_JSON, MessageSerializer, decode_message, encode_message
+)
+
+PAYLOAD = {'from': 'alice', 'message': 'olá, mundo', 'timestamp': 1700000000.5, 'tags': [1, 2, 3]}
+
+
+@pytest.mark.parametrize('codec', sorted(CODECS))
+def test_codec_round_trip(codec):
+    serializer = MessageSerializer(codec)
+    body, content_type, content_encoding = serializer.encode(PAYLOAD)
+    assert content_encoding is None
+    assert serializer.decode(body, content_type) == PAYLOAD
+    assert serializer.decode(memoryview(body), content_type) == PAYLOAD
+
+
+@pytest.mark.parametrize('compression', sorted(COMPRESSORS))
+def test_compression_above_threshold(compression):
+    serializer = MessageSerializer('json', compression, compression_threshold=100)
+    small = {'message': 'x'}
+    large = {'message': 'x' * 1000}
+    assert serializer.encode(small)[2] is None
+    body, content_type, content_encoding = serializer.encode(large)
+    assert content_encoding == compression
+    assert len(body) < 1000
+    assert serializer.decode(body, content_type, content_encoding) == large
+
+
+def test_decode_follows_the_message_properties():
+    # Um consumidor com outra configuração decodifica pelo content_type/content_encoding recebidos
+    producer = MessageSerializer(sorted(CODECS)[-1], 'zlib', compression_threshold=0)
+    body, content_type, content_encoding = producer.encode(PAYLOAD)
+    properties = pika.BasicProperties(content_type=content_type, content_encoding=content_encoding)
+    assert decode_message(body, properties) == PAYLOAD
+
+
+def test_messages_without_content_type_are_json():
+    body, content_type, _ = encode_message(PAYLOAD)
+    assert content_type == CONTENT_TYPE_JSON
+    assert decode_message(body) == PAYLOAD
+
+
+def test_unknown_codec_and_encoding_are_rejected():
+    with pytest.raises(ValueError):
+        MessageSerializer('xml')
+    with pytest.raises(ValueError):
+        MessageSerializer('json', 'brotli')
+    with pytest.raises(ValueError):
+        MessageSerializer().decode(b'{}', CONTENT_TYPE_JSON, 'brotli')
+    with pytest.raises(ValueError):
+        MessageSerializer().decode(b'{}', 'text/xml')
@@ -0,0 +1,84 @@
+import pytest
+
+from broker_manager import BrokerManager
+from message_utils import (
+    ChannelPool, ConfirmPublisher, get_channel_pool, message_properties, pooled_channel, pooled_confirm_publisher
+)
+
+
+def test_pool_reuses_the_same_channel(broker):
+    pool = ChannelPool(connection_factory=broker.connect)
+    first = pool.acquire()
+    pool.release(first)
+    second = pool.acquire()
+    assert second is first
+    pool.release(second)
+    assert pool.stats() == {'max_size': pool.max_size, 'in_use': 0, 'idle': 1}
+    pool.close()
+
+
+def test_pool_discards_failed_and_closed_channels(broker):
+    pool = ChannelPool(connection_factory=broker.connect)
+    failed = pool.acquire()
+    pool.release(failed, discard=True)
+    assert not failed.connection.is_open and pool.stats()['idle'] == 0
+
+    closed = pool.acquire()
+    assert closed is not failed
+    closed.channel.close()
+    pool.release(closed)
+    assert pool.stats()['idle'] == 0
+    pool.close()
+
+
+def test_pooled_channel_discards_the_channel_on_error(broker):
+    with pooled_channel() as channel:
+        kept = channel
+    with pytest.raises(RuntimeError):
+        with pooled_channel() as channel:
+            assert channel is kept
+            raise RuntimeError('falha no meio da operação')
+    with pooled_channel() as channel:
+        assert channel is not kept
+    assert get_channel_pool().stats()['in_use'] == 0
+
+
+def test_pool_waits_for_a_free_channel(broker):
+    pool = ChannelPool(connection_factory=broker.connect, max_size=1)
+    pooled = pool.acquire()
+    with pytest.raises(TimeoutError):
+        pool.acquire(timeout=0.05)
+    pool.release(pooled)
+    assert pool.acquire(timeout=0.05) is pooled
+    pool.release(pooled)
+    pool.close()
+    with pytest.raises(RuntimeError):
+        pool.acquire()
+
+
+def test_confirm_publisher_batches(broker):
+    BrokerManager().create_users(['bob'])
+    connection = broker.connect()
+    publisher = ConfirmPublisher(connection, window=4)
+    results = publisher.publish_batch([('', 'user_bob', b'%d' % i, message_properties()) for i in range(20)])
+    assert results == [True] * 20 and publisher.error is None and not publisher.broken
+    channel = connection.channel()
+    assert channel.queue_declare('user_bob', passive=True).method.message_count == 20
+    publisher.close()
+    connection.close()
+
+
+def test_confirm_publisher_returns_partial_results_on_error(broker):
+    BrokerManager().create_users(['bob'])
+
+    def publishes():
+        for i in range(5):
+            if i == 3:
+                raise ValueError('falha ao montar a mensagem')
+            yield '', 'user_bob', b'x', message_properties()
+
+    with pooled_confirm_publisher() as publisher:
+        results = publisher.publish_batch(publishes())
+        assert isinstance(publisher.error, ValueError)
+    assert results == [True, True, True]
+    assert get_channel_pool().stats()['in_use'] == 0
@@ -0,0 +1,68 @@
+import pytest
+
+from metrics import Histogram, Metrics
+
+
+def test_histogram_snapshot_and_quantiles():
+    histogram = Histogram(buckets=(0.001, 0.01, 0.1, 1.0))
+    for value in [0.0005] * 50 + [0.05] * 49 + [0.5]:
+        histogram.observe(value)
+    snapshot = histogram.snapshot()
+    assert snapshot['count'] == 100
+    assert snapshot['max'] == 0.5
+    assert snapshot['sum'] == pytest.approx(0.0005 * 50 + 0.05 * 49 + 0.5)
+    assert snapshot['p50'] <= 0.001
+    assert 0.01 <= snapshot['p90'] <= 0.1
+    assert snapshot['p99'] <= snapshot['max']
+    assert Histogram().quantile(0.5) == 0.0
+
+
+def test_counters_and_labels():
+    metrics = Metrics()
+    metrics.record_sent('queue', 'user_bob', 100, elapsed=0.002)
+    metrics.record_sent('queue', 'user_bob', 50)
+    metrics.record_received('topic', 'noticias', 10, {'timestamp': 0})
+    metrics.record_error('publish', 'queue', 'user_bob', 3)
+    assert metrics.get_counter('mom_messages_sent_total', kind='queue', name='user_bob') == 2
+    assert metrics.get_counter('mom_bytes_sent_total', kind='queue', name='user_bob') == 150
+    assert metrics.get_counter('mom_errors_total', operation='publish', kind='queue', name='user_bob') == 3
+    assert metrics.get_histogram('mom_publish_seconds', kind='queue', name='user_bob')['count'] == 1
+    assert metrics.get_histogram('mom_delivery_latency_seconds', kind='topic', name='noticias')['count'] == 1
+    assert metrics.get_counter('mom_messages_sent_total', kind='queue', name='outra') == 0
+
+
+def test_timer_counts_errors():
+    metrics = Metrics()
+    with metrics.timer('mom_roundtrip_seconds', operation='get'):
+        pass
+    with pytest.raises(RuntimeError):
+        with metrics.timer('mom_roundtrip_seconds', operation='get'):
+            raise RuntimeError
+    assert metrics.get_histogram('mom_roundtrip_seconds', operation='get')['count'] == 1
+    assert metrics.get_counter('mom_errors_total', operation='get') == 1
+
+
+def test_disabled_metrics_record_nothing():
+    metrics = Metrics(enabled=False)
+    metrics.record_sent('queue', 'q', 10, 0.1)
+    metrics.inc('mom_errors_total')
+    assert metrics.snapshot() == {'histograms': {}, 'counters': {}}
+
+
+def test_prometheus_export():
+    metrics = Metrics(buckets=(0.01, 0.1))
+    metrics.observe('mom_publish_seconds', 0.005, kind='queue', name='q')
+    metrics.observe('mom_publish_seconds', 0.05, kind='queue', name='q')
+    metrics.observe('mom_publish_seconds', 5.0, kind='queue', name='q')
+    metrics.inc('mom_messages_sent_total', 3, kind='topic', name='a"b')
+    lines = metrics.to_prometheus().splitlines()
+    assert '# TYPE mom_publish_seconds histogram' in lines
+    assert '# TYPE mom_messages_sent_total counter' in lines
+    assert any(line.startswith('# HELP mom_publish_seconds ') for line in lines)
+    # Buckets cumulativos, com +Inf igual à contagem
+    assert 'mom_publish_seconds_bucket{kind="queue",name="q",le="0.01"} 1' in lines
+    assert 'mom_publish_seconds_bucket{kind="queue",name="q",le="0.1"} 2' in lines
+    assert 'mom_publish_seconds_bucket{kind="queue",name="q",le="+Inf"} 3' in lines
+    assert 'mom_publish_seconds_count{kind="queue",name="q"} 3' in lines
+    assert 'mom_publish_seconds_sum{kind="queue",name="q"} 5.055' in lines
+    assert 'mom_messages_sent_total{kind="topic",name="a\\"b"} 3' in lines
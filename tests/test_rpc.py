@@ -0,0 +1,46 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from broker_manager import BrokerManager
+from rpc import RpcError
+from user_application import UserApplication
+
+
+@pytest.fixture
+def apps(broker):
+    return UserApplication('alice', BrokerManager()), UserApplication('bob', BrokerManager())
+
+
+def test_call_returns_the_handler_reply(apps):
+    alice, bob = apps
+    assert bob.serve(lambda request: {'soma': sum(request['message']), 'de': request['from']})
+    assert alice.call('bob', [1, 2, 3], timeout=5) == {'soma': 6, 'de': 'alice'}
+
+
+def test_concurrent_calls_are_matched_by_correlation_id(apps):
+    alice, bob = apps
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        bob.serve(lambda request: request['message'] * 2, executor=executor, prefetch_count=4)
+        futures = [alice.call_async('bob', i, timeout=5) for i in range(20)]
+        assert [future.result(5) for future in futures] == [i * 2 for i in range(20)]
+    assert alice.rpc_client.pending_count() == 0
+
+
+def test_handler_error_reaches_the_caller(apps):
+    alice, bob = apps
+
+    def handler(request):
+        raise ValueError('pedido inválido')
+
+    bob.serve(handler)
+    future = alice.call_async('bob', 'x', timeout=5)
+    with pytest.raises(RpcError, match='pedido inválido'):
+        future.result(5)
+    assert alice.call('bob', 'x', timeout=5) is None
+
+
+def test_call_without_server_times_out(apps):
+    alice, _ = apps
+    assert alice.call('carol', 'alguém aí?', timeout=0.2) is None
+    assert alice.rpc_client.pending_count() == 0
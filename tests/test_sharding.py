@@ -0,0 +1,107 @@
+import pytest
+
+from broker_manager import BrokerManager
+from message_utils import ConfirmPublisher
+from sharding import HashRing
+from user_application import UserApplication
+
+KEYS = [f"pedido-{i}" for i in range(2000)]
+
+
+def test_keys_are_spread_over_all_nodes():
+    ring = HashRing(['a', 'b', 'c', 'd'])
+    owners = [ring.get(key) for key in KEYS]
+    assert set(owners) == {'a', 'b', 'c', 'd'}
+    for node in 'abcd':
+        assert owners.count(node) > len(KEYS) / 4 * 0.5
+
+
+def test_lookup_is_stable():
+    first, second = HashRing(['a', 'b', 'c']), HashRing(['c', 'a', 'b'])
+    assert [first.get(key) for key in KEYS] == [second.get(key) for key in KEYS]
+
+
+def test_adding_a_node_only_moves_keys_to_it():
+    ring = HashRing(['a', 'b', 'c'])
+    before = {key: ring.get(key) for key in KEYS}
+    ring.add('d')
+    moved = {key for key in KEYS if ring.get(key) != before[key]}
+    assert moved
+    assert all(ring.get(key) == 'd' for key in moved)
+    assert len(moved) < len(KEYS) / 2
+
+
+def test_removing_a_node_only_moves_its_keys():
+    ring = HashRing(['a', 'b', 'c', 'd'])
+    before = {key: ring.get(key) for key in KEYS}
+    ring.remove('b')
+    assert 'b' not in ring and len(ring) == 3
+    for key in KEYS:
+        if before[key] != 'b':
+            assert ring.get(key) == before[key]
+        else:
+            assert ring.get(key) != 'b'
+
+
+def test_add_and_remove_are_idempotent():
+    ring = HashRing(['a'], replicas=8)
+    ring.add('a')
+    assert len(ring._points) == 8
+    ring.remove('x')
+    assert len(ring) == 1
+
+
+def test_empty_ring_raises():
+    with pytest.raises(LookupError):
+        HashRing().get('chave')
+
+
+@pytest.fixture
+def sharded(broker):
+    broker_manager = BrokerManager()
+    broker_manager.add_sharded_queue('pedidos', shards=3)
+    alice = UserApplication('alice', broker_manager)
+    for i in range(60):
+        assert alice.send_message_to_sharded_queue('pedidos', i, key=f"cliente-{i}")
+    yield broker_manager
+    broker_manager.remove_sharded_queue('pedidos')
+
+
+def _depths(broker, sharded_queue):
+    return {shard: len(broker.queues[shard].messages) for shard in sharded_queue.shards}
+
+
+def test_remove_shard_moves_messages_to_the_new_owners(sharded, broker):
+    sharded_queue = sharded.get_sharded_queue('pedidos')
+    left = len(broker.queues['pedidos.1'].messages)
+    assert sharded.remove_shard('pedidos', 'pedidos.1') == left
+    assert 'pedidos.1' not in broker.queues
+    assert sum(_depths(broker, sharded_queue).values()) == 60
+
+
+def test_remove_shard_keeps_unconfirmed_messages(sharded, broker, monkeypatch):
+    sharded_queue = sharded.get_sharded_queue('pedidos')
+    before = _depths(broker, sharded_queue)
+    monkeypatch.setattr(ConfirmPublisher, 'publish_batch', lambda self, publishes, timeout=None: [False] * len(publishes))
+    assert sharded.remove_shard('pedidos', 'pedidos.1') is None
+    # Nada foi perdido: o fragmento volta ao anel com as suas mensagens
+    assert 'pedidos.1' in sharded_queue.shards
+    assert _depths(broker, sharded_queue) == before
+    monkeypatch.undo()
+    assert sharded.remove_shard('pedidos', 'pedidos.1') == before['pedidos.1']
+
+
+def test_stop_sharded_queue_listener_only_stops_that_queue(broker):
+    broker_manager = BrokerManager()
+    broker_manager.add_sharded_queue('fila', shards=2)
+    broker_manager.add_sharded_queue('fila.x', shards=2)
+    bob = UserApplication('bob', broker_manager)
+    try:
+        assert len(bob.start_sharded_queue_listener('fila')) == 2
+        assert len(bob.start_sharded_queue_listener('fila.x')) == 2
+        assert bob.stop_sharded_queue_listener('fila') == 2
+        assert sorted(bob.shard_listeners) == ['bob:shard:fila.x.0', 'bob:shard:fila.x.1']
+        assert bob.stop_sharded_queue_listener() == 2
+    finally:
+        broker_manager.remove_sharded_queue('fila')
+        broker_manager.remove_sharded_queue('fila.x')
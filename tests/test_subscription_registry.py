@@ -0,0 +1,83 @@
+import pytest
+
+from subscription_registry import InMemoryRegistry, SQLiteRegistry
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def registry(request, tmp_path):
+    registry = InMemoryRegistry() if request.param == 'memory' else SQLiteRegistry(str(tmp_path / 'registry.db'))
+    registry.add_users([('alice', 'user_alice'), ('bob', 'user_bob'), ('carol', 'user_carol')])
+    registry.add_topics([('noticias', 'fanout'), ('eventos', 'topic')])
+    yield registry
+    registry.close()
+
+
+def test_bidirectional_indexes(registry):
+    registry.subscribe('alice', 'noticias')
+    registry.subscribe('alice', 'eventos', 'pedidos.*')
+    registry.subscribe('bob', 'eventos', '#')
+    assert sorted(registry.topics_of('alice')) == ['eventos', 'noticias']
+    assert sorted(registry.subscribers_of('eventos')) == ['alice', 'bob']
+    assert registry.subscribers_of('noticias') == ['alice']
+    assert registry.get_subscription('alice', 'eventos') == ('pedidos.*', {})
+    assert registry.get_subscription('carol', 'eventos') is None
+
+    registry.unsubscribe('alice', 'eventos')
+    assert registry.topics_of('alice') == ['noticias']
+    assert registry.subscribers_of('eventos') == ['bob']
+
+
+def test_removing_user_clears_both_indexes(registry):
+    registry.subscribe('alice', 'noticias')
+    registry.subscribe('alice', 'eventos', '#')
+    registry.remove_user('alice')
+    assert not registry.has_user('alice')
+    assert registry.topics_of('alice') == []
+    assert registry.subscribers_of('noticias') == []
+    assert registry.subscribers_of('eventos') == []
+    assert registry.get_subscription('alice', 'eventos') is None
+
+
+def test_removing_topic_clears_both_indexes(registry):
+    registry.subscribe('alice', 'eventos', '#')
+    registry.subscribe('bob', 'eventos', '#')
+    registry.subscribe('bob', 'noticias')
+    registry.remove_topic('eventos')
+    assert not registry.has_topic('eventos')
+    assert registry.subscribers_of('eventos') == []
+    assert registry.topics_of('alice') == []
+    assert registry.topics_of('bob') == ['noticias']
+
+
+def test_subscription_arguments(registry):
+    registry.subscribe('carol', 'eventos', '', {'x-match': 'any', 'regiao': 'sul'})
+    assert registry.get_subscription('carol', 'eventos') == ('', {'x-match': 'any', 'regiao': 'sul'})
+
+
+def test_users_queues_and_topics(registry):
+    assert registry.get_user_queue('bob') == 'user_bob'
+    assert registry.count_users() == 3
+    assert sorted(registry.iter_users(page_size=2)) == [
+        ('alice', 'user_alice'), ('bob', 'user_bob'), ('carol', 'user_carol')]
+    registry.add_queues([('fila', {'x-max-length': 10}), ('outra', None)])
+    assert registry.get_queue_arguments('fila') == {'x-max-length': 10}
+    assert registry.get_queue_arguments('outra') == {}
+    assert registry.get_queue_arguments('inexistente') is None
+    registry.remove_queue('fila')
+    assert not registry.has_queue('fila')
+    assert registry.get_topic_type('eventos') == 'topic'
+    assert sorted(registry.iter_topics(page_size=1)) == [('eventos', 'topic'), ('noticias', 'fanout')]
+
+
+def test_sqlite_registry_persists(tmp_path):
+    path = str(tmp_path / 'registry.db')
+    registry = SQLiteRegistry(path)
+    registry.add_user('alice', 'user_alice')
+    registry.add_topic('eventos', 'topic')
+    registry.subscribe('alice', 'eventos', 'a.#')
+    registry.close()
+    reopened = SQLiteRegistry(path)
+    assert reopened.topics_of('alice') == ['eventos']
+    assert reopened.subscribers_of('eventos') == ['alice']
+    assert reopened.get_subscription('alice', 'eventos') == ('a.#', {})
+    reopened.close()
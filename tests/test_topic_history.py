@@ -0,0 +1,49 @@
+import time
+
+import pytest
+
+from broker_manager import BrokerManager
+from user_application import UserApplication
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+@pytest.fixture
+def apps(broker):
+    broker_manager = BrokerManager()
+    broker_manager.add_topic('precos', 'topic', history=True)
+    alice = UserApplication('alice', broker_manager)
+    for i in range(10):
+        assert alice.publish_message_to_topic('precos', i, routing_key='acoes.petr4' if i % 2 else 'fundos.xpto')
+    return alice, UserApplication('bob', broker_manager)
+
+
+def test_late_subscriber_reads_the_retained_history(apps):
+    _, bob = apps
+    history = bob.read_topic_history('precos', last=3, timeout=0.2)
+    assert [message['message'] for message in history] == [7, 8, 9]
+    assert [message['offset'] for message in history] == [7, 8, 9]
+    assert bob.get_topic_offset('precos') == 9
+
+    resumed = bob.read_topic_history('precos', offset=4, max_messages=2, timeout=0.2)
+    assert [message['message'] for message in resumed] == [4, 5]
+    filtered = bob.read_topic_history('precos', offset=0, binding_key='acoes.*', timeout=0.2)
+    assert [message['message'] for message in filtered] == [1, 3, 5, 7, 9]
+
+
+def test_replay_continues_with_live_messages_without_gaps(apps):
+    alice, bob = apps
+    received = []
+    assert bob.start_topic_replay('precos', handler=lambda message: received.append(message['message']),
+                                  last=2)
+    assert wait_for(lambda: received == [8, 9])
+    for i in range(10, 13):
+        alice.publish_message_to_topic('precos', i, routing_key='acoes.petr4')
+    assert wait_for(lambda: received == [8, 9, 10, 11, 12])
+    assert wait_for(lambda: bob.get_topic_offset('precos') == 12)
+    assert bob.stop_topic_replay('precos') == 1
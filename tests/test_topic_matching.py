@@ -0,0 +1,50 @@
+import pytest
+
+from in_memory_broker import headers_match, topic_matches
+
+
+@pytest.mark.parametrize('binding_key, routing_key, expected', [
+    ('pedidos.criado', 'pedidos.criado', True),
+    ('pedidos.criado', 'pedidos.pago', False),
+    ('pedidos.*', 'pedidos.criado', True),
+    ('pedidos.*', 'pedidos', False),
+    ('pedidos.*', 'pedidos.criado.sul', False),
+    ('*.criado', 'pedidos.criado', True),
+    ('pedidos.#', 'pedidos', True),
+    ('pedidos.#', 'pedidos.criado.sul', True),
+    ('#', 'qualquer.coisa', True),
+    ('#', '', True),
+    ('#.sul', 'pedidos.criado.sul', True),
+    ('#.sul', 'pedidos.criado.norte', False),
+    ('pedidos.#.sul', 'pedidos.sul', True),
+    ('pedidos.#.sul', 'pedidos.a.b.sul', True),
+    ('*.#', 'pedidos', True),
+    ('*', 'a.b', False),
+])
+def test_topic_matches(binding_key, routing_key, expected):
+    assert topic_matches(binding_key, routing_key) is expected
+
+
+@pytest.mark.parametrize('arguments, headers, expected', [
+    ({'x-match': 'all', 'tipo': 'pedido', 'regiao': 'sul'}, {'tipo': 'pedido', 'regiao': 'sul'}, True),
+    ({'x-match': 'all', 'tipo': 'pedido', 'regiao': 'sul'}, {'tipo': 'pedido'}, False),
+    ({'x-match': 'any', 'tipo': 'pedido', 'regiao': 'sul'}, {'regiao': 'sul'}, True),
+    ({'x-match': 'any', 'tipo': 'pedido'}, {'tipo': 'outro'}, False),
+    ({'x-match': 'all'}, None, True),
+])
+def test_headers_match(arguments, headers, expected):
+    assert headers_match(arguments, headers) is expected
+
+
+def test_topic_exchange_routing(broker):
+    from message_utils import get_rabbitmq_connection
+    channel = get_rabbitmq_connection().channel()
+    channel.exchange_declare('eventos', 'topic')
+    for queue, binding_key in [('todos', '#'), ('criados', '*.criado'), ('sul', 'pedidos.#.sul')]:
+        channel.queue_declare(queue)
+        channel.queue_bind(queue, 'eventos', binding_key)
+    for routing_key in ('pedidos.criado', 'pedidos.pago.sul', 'estoque.baixo'):
+        channel.basic_publish('eventos', routing_key, routing_key.encode())
+    counts = {queue: channel.queue_declare(queue, passive=True).method.message_count
+              for queue in ('todos', 'criados', 'sul')}
+    assert counts == {'todos': 3, 'criados': 1, 'sul': 1}
@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import deque
+
+import pytest
+
+from broker_manager import BrokerManager
+from message_utils import get_channel_pool, pooled_channel
+from metrics import metrics
+import user_application
+from user_application import UserApplication
+
+
+@pytest.fixture
+def apps(broker):
+    broker_manager = BrokerManager()
+    broker_manager.create_users(['alice', 'bob'])
+    broker_manager.add_topic('eventos', 'topic')
+    return broker_manager, UserApplication('alice', broker_manager), UserApplication('bob', broker_manager)
+
+
+def test_send_and_receive(apps):
+    _, alice, bob = apps
+    assert alice.send_message_to_user('bob', {'texto': 'oi'})
+    message = bob.receive_message_from_queue('user_bob')
+    assert message['message'] == {'texto': 'oi'} and message['from'] == 'alice'
+    assert bob.receive_message_from_queue('user_bob') is None
+    assert metrics.get_counter('mom_messages_sent_total', kind='queue', name='user_bob') == 1
+    assert metrics.get_counter('mom_messages_received_total', kind='queue', name='user_bob') == 1
+
+
+def test_confirmed_batch_round_trip(apps):
+    _, alice, bob = apps
+    messages = [f"mensagem {i}" for i in range(250)]
+    assert alice.send_messages_to_user('bob', messages, window=32) == [True] * 250
+    assert alice.last_batch_stats['confirmed'] == 250
+    received = bob.receive_messages(max_messages=1000, timeout=0.2)
+    assert [message['message'] for message in received] == messages
+
+
+def test_iter_messages_acks_only_what_was_processed(apps, broker):
+    _, alice, bob = apps
+    alice.send_messages_to_user('bob', list(range(10)))
+    iterator = bob.iter_messages(prefetch_count=5, ack_batch=2)
+    first = [next(iterator)['message'] for _ in range(3)]
+    iterator.close()
+    assert first == [0, 1, 2]
+    rest = [message['message'] for message in bob.receive_messages(timeout=0.2)]
+    assert rest == list(range(2, 10))  # A terceira foi entregue mas não processada
+    assert not get_channel_pool().stats()['in_use']
+
+
+def test_iter_messages_with_prefetch_below_ack_batch(apps, broker):
+    _, alice, bob = apps
+    alice.send_messages_to_user('bob', list(range(30)))
+    received = bob.iter_messages(prefetch_count=10, ack_batch=50, inactivity_timeout=0.5)
+    assert [message['message'] for message in received] == list(range(30))
+    assert broker.queues['user_bob'].messages == deque()
+
+
+def test_iter_messages_flushes_acks_while_idle(apps, broker, monkeypatch):
+    monkeypatch.setattr(user_application, 'DEFAULT_ACK_FLUSH_INTERVAL', 0.05)
+    _, alice, bob = apps
+    alice.send_messages_to_user('bob', list(range(3)))
+    received = []
+
+    def consume():
+        for message in bob.iter_messages(ack_batch=50, max_messages=4):
+            received.append(message['message'])
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    time.sleep(0.5)
+    # Aguardando a quarta mensagem, as três processadas já foram confirmadas
+    assert received == [0, 1, 2]
+    assert [consumer.unacked for consumer in broker.queues['user_bob'].consumers] == [0]
+    alice.send_message_to_user('bob', 3)
+    consumer.join(5)
+    assert received == [0, 1, 2, 3]
+
+
+def test_topic_batch_reaches_matching_subscribers(apps):
+    broker_manager, alice, bob = apps
+    broker_manager.subscribe_user_to_topic('bob', 'eventos', 'pedidos.*')
+    assert alice.publish_batch('eventos', ['a', 'b'], routing_key='pedidos.criado') == [True, True]
+    assert alice.publish_batch('eventos', ['c'], routing_key='estoque.baixo') == [True]
+    received = list(bob.iter_messages(inactivity_timeout=0.2))
+    assert [message['message'] for message in received] == ['a', 'b']
+    assert all(message['topic'] == 'eventos' for message in received)
+    assert all(message['routing_key'] == 'pedidos.criado' for message in received)
+
+
+def test_history_reads_do_not_leak_prefetch_into_the_pool(apps):
+    broker_manager, alice, bob = apps
+    broker_manager.add_topic('auditoria', 'fanout', history=True)
+    assert alice.publish_batch('auditoria', list(range(5))) == [True] * 5
+    history = bob.read_topic_history('auditoria', last=3, timeout=0.2)
+    assert [message['message'] for message in history] == [2, 3, 4]
+    with pooled_channel() as channel:
+        assert channel.prefetch_count == 0
+
+
+def test_topic_listener_refuses_other_options_for_running_consumer(apps):
+    broker_manager, alice, bob = apps
+    broker_manager.add_topic('avisos', 'fanout')
+    first, second = [], []
+    listener_id = bob.start_topic_listener('eventos', handler=first.append, prefetch_count=4)
+    assert listener_id == 'bob:queue:user_bob'
+    # Outro handler não substitui o do consumidor em andamento
+    assert bob.start_topic_listener('avisos', handler=second.append) is None
+    assert bob.topic_listeners == {'eventos'} and 'avisos' not in bob.subscribed_topics
+    # Sem opções, ou com as mesmas, o consumidor existente é reutilizado
+    assert bob.start_topic_listener('avisos') == listener_id
+    assert bob.start_topic_listener('avisos', handler=first.append, prefetch_count=4) == listener_id
+    assert alice.publish_message_to_topic('avisos', 'a')
+
+    bob.stop_queue_listener()
+    assert bob.start_topic_listener('avisos', handler=second.append) == listener_id
+    assert alice.publish_message_to_topic('avisos', 'b')
+    deadline = time.monotonic() + 5
+    while not (first and second) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert [message['message'] for message in first] == ['a']
+    assert [message['message'] for message in second] == ['b']
+
+
+def test_subscribers_do_not_receive_their_own_messages(apps):
+    broker_manager, alice, bob = apps
+    broker_manager.subscribe_user_to_topic('alice', 'eventos', '#')
+    broker_manager.subscribe_user_to_topic('bob', 'eventos', '#')
+    assert alice.publish_message_to_topic('eventos', 'da alice', routing_key='pedidos.criado')
+    assert bob.publish_message_to_topic('eventos', 'do bob', routing_key='pedidos.criado')
+    assert [message['message'] for message in alice.iter_messages(inactivity_timeout=0.2)] == ['do bob']
+    assert [message['message'] for message in bob.iter_messages(inactivity_timeout=0.2)] == ['da alice']
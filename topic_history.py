@@ -0,0 +1,88 @@
+import time
+from datetime import datetime, timezone
+
+from message_utils import queue_arguments
+
+DEFAULT_HISTORY_BYTES = 64 * 1024 * 1024  # Retenção do histórico de um tópico (bytes)
+DEFAULT_HISTORY_SEGMENT_BYTES = 8 * 1024 * 1024  # Tamanho dos segmentos do log no broker
+DEFAULT_REPLAY_PREFETCH = 100  # Mensagens do histórico entregues antes de um ack (obrigatório em streams)
+DEFAULT_REPLAY_TIMEOUT = 1.0  # Segundos sem mensagens para considerar o histórico lido
+DEFAULT_TAIL_TIMEOUT = 0.25  # Segundos aguardando o último bloco do log ao procurar o fim
+
+
+def history_queue_name(topic_name):
+    """Fila stream que retém o histórico de ``topic_name``"""
+    return f"history_{topic_name}"
+
+
+def history_queue_arguments(max_bytes=DEFAULT_HISTORY_BYTES, max_age=None):
+    """Argumentos da fila stream do histórico: retenção por bytes e, se informada, por idade"""
+    return queue_arguments(queue_type='stream', max_length_bytes=max_bytes, max_age=max_age,
+                           max_segment_size_bytes=min(max_bytes, DEFAULT_HISTORY_SEGMENT_BYTES))
+
+
+def history_binding(exchange_type):
+    """``(chave, argumentos)`` do binding que recebe todas as mensagens do tópico.
+
+    Exchanges ``direct`` só entregam por chave exata e não têm binding
+    que receba tudo: retorna None.
+    """
+    if exchange_type == 'fanout':
+        return '', None
+    if exchange_type == 'topic':
+        return '#', None
+    if exchange_type == 'headers':
+        return '', None  # Sem cabeçalhos, x-match=all casa com todas as mensagens
+    return None
+
+
+def stream_offset(last=None, since=None, offset=None, tail=None):
+    """Valor de ``x-stream-offset`` para começar a leitura do histórico.
+
+    ``offset`` é um offset guardado pelo cliente (lê a partir dele), ``since``
+    um instante (``time.time()``) e ``last`` a quantidade de mensagens mais
+    recentes, contadas a partir de ``tail``, o último offset do log (None se
+    o log estiver vazio). Sem nenhum deles, só mensagens novas (``next``).
+    """
+    if offset is not None:
+        return int(offset)
+    if since is not None:
+        return datetime.fromtimestamp(since, tz=timezone.utc)
+    if last is not None:
+        if tail is None:
+            return 'first'
+        return max(0, tail - int(last) + 1)
+    return 'next'
+
+
+def message_offset(properties):
+    """Offset da mensagem no log (cabeçalho ``x-stream-offset`` das entregas de streams)"""
+    return (properties.headers or {}).get('x-stream-offset') if properties is not None else None
+
+
+def stream_tail(channel, queue_name, timeout=DEFAULT_TAIL_TIMEOUT):
+    """Último offset do log (None se vazio).
+
+    Lê a partir de ``last``, que entrega o último bloco do log, até ficar
+    ``timeout`` segundos sem mensagens; com publicações contínuas a leitura
+    para após ``4 * timeout``, com o maior offset visto até ali.
+    """
+    tail = None
+    deadline = time.monotonic() + 4 * timeout
+    channel.basic_qos(prefetch_count=DEFAULT_REPLAY_PREFETCH)
+    try:
+        for method, properties, _ in channel.consume(queue_name, arguments={'x-stream-offset': 'last'},
+                                                     inactivity_timeout=timeout):
+            if method is None:
+                break
+            offset = message_offset(properties)
+            tail = offset if tail is None or offset > tail else tail
+            channel.basic_ack(method.delivery_tag)
+            if time.monotonic() >= deadline:
+                break
+    finally:
+        if channel.is_open:
+            channel.cancel()
+            # O canal costuma voltar a um pool: o próximo usuário não herda o prefetch
+            channel.basic_qos(prefetch_count=0)
+    return tail
@@ -1,8 +1,74 @@
-import pika
-import json
-import threading
+import os
 import time
-from message_utils import get_rabbitmq_connection, close_rabbitmq_connection
+import uuid
+from contextlib import ExitStack
+from functools import partial
+from message_utils import (
+    pooled_channel, pooled_confirm_publisher, declaration_cache, retry_on_not_found,
+    is_not_found_error, is_precondition_failed_error, bind_queue, unbind_queue, headers_binding_arguments, message_properties,
+    topic_matches, DEFAULT_CONFIRM_WINDOW
+)
+from listener_manager import get_listener_manager
+from message_codecs import encode_message, decode_message
+from metrics import metrics
+from buffered_publisher import get_buffered_publisher
+from rpc import RpcClient, RpcError, run_rpc_handler, rpc_queue_name, DIRECT_REPLY_TO, DEFAULT_RPC_TIMEOUT
+from chunked_transfer import (
+    ChunkReassembler, iter_file_chunks, iter_stream_chunks, iter_chunk_messages, new_transfer_id,
+    transfer_queue_name, DEFAULT_CHUNK_SIZE, DEFAULT_TRANSFER_PREFETCH, DEFAULT_TRANSFER_TIMEOUT
+)
+from topic_history import (
+    history_queue_name, stream_offset, stream_tail, message_offset,
+    DEFAULT_REPLAY_PREFETCH, DEFAULT_REPLAY_TIMEOUT
+)
+from dedup import DedupCache, message_key
+from sharding import (
+    get_sharded_queue, get_endpoint_pool, get_endpoint_listener_manager, DEFAULT_ENDPOINT, SHARD_KEY_HEADER
+)
+
+DEFAULT_PREFETCH = 100  # Mensagens entregues pelo broker antes de um ack
+DEFAULT_ACK_BATCH = 50  # Mensagens confirmadas por basic_ack(multiple=True)
+DEFAULT_ACK_FLUSH_INTERVAL = 0.5  # Segundos sem mensagens antes de enviar as confirmações pendentes
+
+def _is_own_topic_message(method, properties, username):
+    """Mensagem de tópico publicada pelo próprio usuário (pelo ``app_id``, sem decodificar)"""
+    return bool(method.exchange) and properties is not None and properties.app_id == username
+
+def _delivery_source(method, queue_name):
+    """Rótulos de métrica da entrega: o tópico de origem ou a própria fila"""
+    return ('topic', method.exchange) if method.exchange else ('queue', queue_name)
+
+def _run_handler(handler, method, properties, body, skip_from=None, queue_name=None):
+    """Decodifica a mensagem e executa o handler do usuário (num worker do executor).
+
+    As métricas são registradas no processo que executa o handler: com um
+    executor de processos, elas ficam nos workers.
+    """
+    if _is_own_topic_message(method, properties, skip_from):
+        return None  # Não processa suas próprias mensagens
+    kind, name = _delivery_source(method, queue_name)
+    try:
+        message_data = decode_message(body, properties)
+        metrics.record_received(kind, name, len(body), message_data)
+        if method.exchange:
+            # Mensagem de tópico entregue pelo binding na fila do usuário
+            message_data['topic'] = method.exchange
+            message_data['routing_key'] = method.routing_key
+        start = time.perf_counter()
+        result = handler(message_data)
+    except Exception:
+        metrics.record_error('listener', kind, name)
+        raise
+    metrics.observe('mom_handler_seconds', time.perf_counter() - start, kind=kind, name=name)
+    return result
+
+def _run_replay_handler(handler, offsets, topic_name, binding_key, method, properties, body, skip_from=None):
+    """Executa o handler para uma mensagem do histórico e guarda o seu offset depois de processada"""
+    result = None
+    if binding_key is None or topic_matches(binding_key, method.routing_key):
+        result = _run_handler(handler, method, properties, body, skip_from, history_queue_name(topic_name))
+    offsets[topic_name] = message_offset(properties)
+    return result
 
 class UserApplication:
     def __init__(self, username, broker_manager=None):
@@ -10,227 +76,1155 @@ class UserApplication:
         self.broker_manager = broker_manager
         self.user_queue = f"user_{username}"
         self.subscribed_topics = set()
+        self.topic_bindings = {}  # tópico -> (chave, argumentos), sem broker manager
         self.listening = False
         self.listener_thread = None
+        self.listener_manager = None  # Gerenciador de listeners, criado no primeiro listener
+        self.topic_listeners = set()  # Tópicos ouvidos pelo consumidor da fila do usuário
+        self._implicit_queue_listener = False  # Consumidor da fila iniciado por um tópico
+        self._user_queue_options = None  # (handler, executor, prefetch) do consumidor da fila do usuário
+        self.last_batch_stats = None  # Estatísticas do último envio em lote
+        self.publisher = None  # BufferedPublisher usado nos envios, se ativado
+        self.rpc_client = RpcClient()  # Chamadas RPC aguardando resposta
+        self.shard_listeners = {}  # listener -> (fila fragmentada, ListenerManager do broker do fragmento)
+        self.reassembler = None  # ChunkReassembler das transferências recebidas
+        self.topic_offsets = {}  # tópico -> último offset do histórico processado
+        self.dedup = None  # DedupCache dos consumidores, se ativado
         
-    def send_message_to_user(self, target_username, message):
+    def _build_message(self, message, headers=None, priority=None, expiration=None):
+        """Serializa a mensagem com o codec configurado e monta as propriedades AMQP.
+
+        O remetente também vai em ``app_id``, para que os assinantes descartem
+        as próprias mensagens sem decodificar o corpo; ``headers`` são usados
+        no roteamento de exchanges ``headers``. ``priority`` vale em filas
+        com ``max_priority``; após ``expiration`` segundos na fila, a mensagem
+        é descartada (ou vai para o dead-letter exchange da fila). Cada
+        mensagem recebe um ``message_id`` único, mantido nas republicações,
+        que os consumidores com deduplicação usam para descartar repetidas.
+        """
+        body, content_type, content_encoding = encode_message({
+            'from': self.username,
+            'message': message,
+            'timestamp': time.time()
+        })
+        properties = message_properties(
+            priority, expiration,
+            delivery_mode=2,  # Torna a mensagem persistente
+            message_id=uuid.uuid4().hex,
+            content_type=content_type,
+            content_encoding=content_encoding,
+            app_id=self.username,
+            headers=headers
+        )
+        return body, properties
+    
+    def _get_topic_type(self, topic_name):
+        """Tipo do exchange do tópico: registro do broker manager, cache de declarações ou fanout"""
+        exchange_type = None
+        if self.broker_manager:
+            exchange_type = self.broker_manager.get_topic_type(topic_name)
+        return exchange_type or declaration_cache.get_exchange_type(topic_name) or 'fanout'
+    
+    def enable_buffered_publishing(self, publisher=None):
+        """Passa a enviar pelo buffer local do publicador (o do processo, por padrão).
+
+        Os envios retornam assim que a mensagem entra no buffer; a publicação
+        no broker, com confirmação, acontece em lotes numa thread de fundo e
+        continua após alarmes de memória/disco e quedas de conexão.
+        """
+        self.publisher = publisher or get_buffered_publisher()
+        return self.publisher
+    
+    def disable_buffered_publishing(self, timeout=None):
+        """Volta ao envio direto, aguardando até ``timeout`` o buffer esvaziar"""
+        publisher, self.publisher = self.publisher, None
+        if publisher is not None:
+            return publisher.flush(timeout)
+        return True
+    
+    def enable_dedup(self, cache=None, **options):
+        """Descarta mensagens repetidas (reentregas e republicações) antes dos handlers.
+
+        Vale para os listeners iniciados depois e para as leituras diretas
+        das filas. ``options`` são as de ``DedupCache`` (``max_entries``,
+        ``window``, ``probabilistic``, ``error_rate``, ``path``).
+        """
+        self.dedup = cache or DedupCache(**options)
+        return self.dedup
+    
+    def disable_dedup(self):
+        dedup, self.dedup = self.dedup, None
+        return dedup
+    
+    def _is_duplicate(self, properties, body, kind, name):
+        """Verifica (e registra) a mensagem na deduplicação das leituras diretas"""
+        if self.dedup is None or not self.dedup.seen(message_key(properties, body)):
+            return False
+        metrics.inc('mom_messages_deduplicated_total', kind=kind, name=name)
+        return True
+    
+    def _get_queue_arguments(self, queue_name):
+        """Argumentos com que a fila foi criada (registro do broker manager), ou None se desconhecidos"""
+        if self.broker_manager:
+            return self.broker_manager.get_queue_arguments(queue_name)
+        return None
+    
+    def send_message_to_user(self, target_username, message, priority=None, expiration=None):
         """Envia mensagem diretamente para outro usuário (produtor)"""
         target_queue = f"user_{target_username}"
-        return self._send_message_to_queue(target_queue, message)
+        return self._send_message_to_queue(target_queue, message, priority, expiration)
     
-    def send_message_to_queue(self, queue_name, message):
+    def send_message_to_queue(self, queue_name, message, priority=None, expiration=None):
         """Envia mensagem para uma fila específica"""
-        return self._send_message_to_queue(queue_name, message)
+        return self._send_message_to_queue(queue_name, message, priority, expiration)
     
-    def _send_message_to_queue(self, queue_name, message):
+    def _send_message_to_queue(self, queue_name, message, priority=None, expiration=None):
         """Método interno para enviar mensagem para fila"""
         try:
-            connection = get_rabbitmq_connection()
-            channel = connection.channel()
-            
-            # Declara a fila para garantir que existe
-            channel.queue_declare(queue=queue_name, durable=True)
-            
             # Prepara a mensagem
-            message_body = json.dumps({
-                'from': self.username,
-                'message': message,
-                'timestamp': time.time()
-            })
+            message_body, properties = self._build_message(message, priority=priority, expiration=expiration)
+            arguments = self._get_queue_arguments(queue_name)
+            
+            if self.publisher is not None:
+                if not self.publisher.publish('', queue_name, message_body, properties):
+                    raise RuntimeError("buffer do publicador cheio")
+                print(f"[{self.username}] Mensagem enfileirada para fila '{queue_name}': {message}")
+                return True
             
-            # Envia a mensagem
-            channel.basic_publish(
-                exchange='',
-                routing_key=queue_name,
-                body=message_body,
-                properties=pika.BasicProperties(delivery_mode=2)  # Torna a mensagem persistente
-            )
+            def send():
+                with pooled_channel() as channel:
+                    # Declara a fila apenas na primeira vez (cache de declarações)
+                    declaration_cache.declare_queue(channel, queue_name, arguments=arguments)
+                    
+                    # Envia a mensagem
+                    channel.basic_publish(
+                        exchange='',
+                        routing_key=queue_name,
+                        body=message_body,
+                        properties=properties
+                    )
             
-            close_rabbitmq_connection(connection)
+            start = time.perf_counter()
+            retry_on_not_found(send, queues=[queue_name])
+            metrics.record_sent('queue', queue_name, len(message_body), time.perf_counter() - start)
             print(f"[{self.username}] Mensagem enviada para fila '{queue_name}': {message}")
             return True
             
         except Exception as e:
+            metrics.record_error('publish', 'queue', queue_name)
             print(f"[{self.username}] Erro ao enviar mensagem para fila '{queue_name}': {e}")
             return False
     
+    def send_message_to_sharded_queue(self, queue_name, message, key, priority=None, expiration=None):
+        """Envia mensagem para o fragmento da fila fragmentada escolhido pelo hash de ``key``.
+
+        Mensagens com a mesma chave vão para o mesmo fragmento e mantêm a
+        ordem entre si; a chave segue no cabeçalho ``x-shard-key`` para
+        redistribuição quando um fragmento é removido.
+        """
+        sharded_queue = get_sharded_queue(queue_name)
+        if sharded_queue is None:
+            print(f"[{self.username}] Fila fragmentada '{queue_name}' não existe.")
+            return False
+        shard, endpoint = sharded_queue.shard_for(key)
+        try:
+            message_body, properties = self._build_message(message, headers={SHARD_KEY_HEADER: str(key)},
+                                                           priority=priority, expiration=expiration)
+            
+            if self.publisher is not None and endpoint == DEFAULT_ENDPOINT:
+                if not self.publisher.publish('', shard, message_body, properties):
+                    raise RuntimeError("buffer do publicador cheio")
+                print(f"[{self.username}] Mensagem enfileirada para fila '{shard}': {message}")
+                return True
+            
+            def send():
+                with get_endpoint_pool(endpoint).channel() as channel:
+                    declaration_cache.declare_queue(channel, shard, arguments=sharded_queue.arguments)
+                    channel.basic_publish(exchange='', routing_key=shard, body=message_body, properties=properties)
+            
+            start = time.perf_counter()
+            retry_on_not_found(send, queues=[shard])
+            metrics.record_sent('queue', queue_name, len(message_body), time.perf_counter() - start)
+            print(f"[{self.username}] Mensagem enviada para fila '{shard}': {message}")
+            return True
+            
+        except Exception as e:
+            metrics.record_error('publish', 'queue', queue_name)
+            print(f"[{self.username}] Erro ao enviar mensagem para fila '{shard}': {e}")
+            return False
+    
+    def receive_messages_from_sharded_queue(self, queue_name, max_messages=DEFAULT_PREFETCH):
+        """Recebe até ``max_messages`` da fila fragmentada, uma de cada fragmento por rodada.
+
+        Cada chamada começa por um fragmento diferente, de modo que nenhum
+        fica sem ser lido enquanto outro tem mensagens; um canal por broker
+        é usado durante toda a leitura. ``message_data['shard']`` indica a
+        fila física de origem.
+        """
+        sharded_queue = get_sharded_queue(queue_name)
+        if sharded_queue is None:
+            print(f"[{self.username}] Fila fragmentada '{queue_name}' não existe.")
+            return []
+        messages = []
+        try:
+            with ExitStack() as stack:
+                channels = {}  # endpoint -> canal
+                active = sharded_queue.rotation()
+                while active and len(messages) < max_messages:
+                    remaining = []
+                    for shard, endpoint in active:
+                        if len(messages) >= max_messages:
+                            break
+                        if endpoint not in channels:
+                            channels[endpoint] = stack.enter_context(get_endpoint_pool(endpoint).channel())
+                        method_frame, header_frame, body = channels[endpoint].basic_get(queue=shard, auto_ack=True)
+                        if method_frame is None:
+                            continue  # Fragmento vazio: sai das próximas rodadas
+                        remaining.append((shard, endpoint))
+                        if self._is_duplicate(header_frame, body, 'queue', queue_name):
+                            continue
+                        message_data = decode_message(body, header_frame)
+                        metrics.record_received('queue', queue_name, len(body), message_data)
+                        message_data['shard'] = shard
+                        messages.append(message_data)
+                    active = remaining
+        except Exception as e:
+            metrics.record_error('receive', 'queue', queue_name)
+            print(f"[{self.username}] Erro ao receber mensagens da fila '{queue_name}': {e}")
+        print(f"[{self.username}] {len(messages)} mensagens recebidas da fila '{queue_name}'.")
+        return messages
+    
+    def start_sharded_queue_listener(self, queue_name, handler=None, executor=None, prefetch_count=0):
+        """Inicia um consumidor em cada fragmento, no ListenerManager do broker de cada um.
+
+        Com ``prefetch_count`` o broker limita as entregas pendentes por
+        fragmento, e todos são atendidos em paralelo. Fragmentos adicionados
+        depois exigem chamar este método de novo.
+        """
+        sharded_queue = get_sharded_queue(queue_name)
+        if sharded_queue is None:
+            print(f"[{self.username}] Fila fragmentada '{queue_name}' não existe.")
+            return []
+        if handler is not None:
+            handler = partial(_run_handler, handler, queue_name=queue_name)
+        
+        def callback(ch, method, properties, body):
+            try:
+                message_data = decode_message(body, properties)
+                metrics.record_received('queue', queue_name, len(body), message_data)
+                print(f"[{self.username}] Mensagem recebida da fila '{method.routing_key}': {message_data['message']} (de: {message_data['from']})")
+            except Exception as e:
+                metrics.record_error('listener', 'queue', queue_name)
+                print(f"[{self.username}] Erro ao processar mensagem da fila: {e}")
+        
+        listener_ids = []
+        for shard, endpoint in sharded_queue.shards.items():
+            def setup(channel, shard=shard):
+                declaration_cache.declare_queue(channel, shard, arguments=sharded_queue.arguments)
+            
+            manager = get_endpoint_listener_manager(endpoint)
+            listener_id = self._start_listener(self._listener_id('shard', shard), shard, callback, setup,
+                                               f"fila '{shard}'", handler, executor, prefetch_count,
+                                               manager=manager)
+            if listener_id is not None:
+                self.shard_listeners[listener_id] = (queue_name, manager)
+                listener_ids.append(listener_id)
+        return listener_ids
+    
+    def stop_sharded_queue_listener(self, queue_name=None):
+        """Para os consumidores dos fragmentos de uma fila fragmentada (ou de todas).
+
+        Cada listener guarda a fila lógica que o iniciou: parar ``fila`` não
+        afeta ``fila.x``, e os fragmentos já removidos do anel também param.
+        """
+        stopped = 0
+        for listener_id, (sharded_name, manager) in list(self.shard_listeners.items()):
+            if queue_name is not None and sharded_name != queue_name:
+                continue
+            del self.shard_listeners[listener_id]
+            try:
+                if manager.remove_consumer(listener_id):
+                    stopped += 1
+            except Exception as e:
+                print(f"[{self.username}] Erro ao parar listener '{listener_id}': {e}")
+        if stopped:
+            print(f"[{self.username}] {stopped} listener(s) parado(s).")
+        return stopped
+    
     def receive_message_from_queue(self, queue_name, timeout=5):
         """Recebe uma mensagem de uma fila específica (consumidor)"""
         try:
-            connection = get_rabbitmq_connection()
-            channel = connection.channel()
-            
-            # Declara a fila para garantir que existe
-            channel.queue_declare(queue=queue_name, durable=True)
+            def get():
+                with pooled_channel() as channel:
+                    # Declara a fila apenas na primeira vez (cache de declarações)
+                    declaration_cache.declare_queue(channel, queue_name,
+                                                    arguments=self._get_queue_arguments(queue_name))
+                    
+                    # Tenta receber uma mensagem
+                    return channel.basic_get(queue=queue_name, auto_ack=True)
             
-            # Tenta receber uma mensagem
-            method_frame, header_frame, body = channel.basic_get(queue=queue_name, auto_ack=True)
+            start = time.perf_counter()
+            method_frame, header_frame, body = retry_on_not_found(get, queues=[queue_name])
+            metrics.observe('mom_roundtrip_seconds', time.perf_counter() - start,
+                            operation='get', kind='queue', name=queue_name)
             
+            if method_frame and self._is_duplicate(header_frame, body, 'queue', queue_name):
+                print(f"[{self.username}] Mensagem repetida descartada da fila '{queue_name}'.")
+                return None
             if method_frame:
-                message_data = json.loads(body.decode())
+                message_data = decode_message(body, header_frame)
+                metrics.record_received('queue', queue_name, len(body), message_data)
                 print(f"[{self.username}] Mensagem recebida da fila '{queue_name}': {message_data['message']} (de: {message_data['from']})")
-                close_rabbitmq_connection(connection)
                 return message_data
             else:
                 print(f"[{self.username}] Nenhuma mensagem disponível na fila '{queue_name}'.")
-                close_rabbitmq_connection(connection)
                 return None
                 
         except Exception as e:
+            metrics.record_error('receive', 'queue', queue_name)
             print(f"[{self.username}] Erro ao receber mensagem da fila '{queue_name}': {e}")
             return None
     
+    def receive_messages(self, queue_name=None, max_messages=DEFAULT_PREFETCH, timeout=5):
+        """Recebe até ``max_messages`` de uma fila num único canal (padrão: fila do usuário).
+
+        Para ao atingir o limite, ao esgotar ``timeout`` segundos ou quando a
+        fila fica ociosa por ``timeout`` segundos.
+        """
+        if queue_name is None:
+            queue_name = self.user_queue
+        
+        if max_messages <= 0:
+            return []
+        messages = list(self.iter_messages(
+            queue_name,
+            prefetch_count=min(max_messages, DEFAULT_PREFETCH),
+            inactivity_timeout=timeout,
+            max_messages=max_messages,
+            timeout=timeout
+        ))
+        
+        print(f"[{self.username}] {len(messages)} mensagens recebidas da fila '{queue_name}'.")
+        return messages
+    
+    def iter_messages(self, queue_name=None, prefetch_count=DEFAULT_PREFETCH,
+                      ack_batch=DEFAULT_ACK_BATCH, inactivity_timeout=None,
+                      max_messages=None, timeout=None):
+        """Gerador que consome uma fila num único canal (padrão: fila do usuário).
+
+        O broker entrega até ``prefetch_count`` mensagens adiantadas e as
+        processadas são confirmadas em lotes com ``multiple=True`` (de no
+        máximo ``prefetch_count`` mensagens, senão o broker para de entregar
+        antes de o lote fechar). Uma mensagem só é confirmada quando o gerador
+        é retomado após entregá-la; as que não foram processadas voltam para a
+        fila quando o gerador é fechado. Sem mensagens novas, as confirmações
+        pendentes são enviadas a cada ``DEFAULT_ACK_FLUSH_INTERVAL`` segundos.
+        Com ``inactivity_timeout`` o gerador termina após esse tempo sem
+        mensagens; ``max_messages`` e ``timeout`` limitam o total entregue e a
+        duração.
+        """
+        if queue_name is None:
+            queue_name = self.user_queue
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if prefetch_count:
+            ack_batch = max(1, min(ack_batch, prefetch_count))
+        tick = DEFAULT_ACK_FLUSH_INTERVAL
+        if inactivity_timeout is not None:
+            tick = min(tick, inactivity_timeout)
+        
+        try:
+            with pooled_channel() as channel:
+                declaration_cache.declare_queue(channel, queue_name,
+                                                arguments=self._get_queue_arguments(queue_name))
+                channel.basic_qos(prefetch_count=prefetch_count)
+                
+                last_tag = None
+                in_hand = None  # Entregue ao chamador e ainda não processada
+                pending = 0
+                delivered = 0
+                idle_since = time.monotonic()
+                try:
+                    for method_frame, properties, body in channel.consume(
+                            queue_name, inactivity_timeout=tick):
+                        if method_frame is None:
+                            # Sem mensagens: confirma o que já foi processado
+                            if pending:
+                                channel.basic_ack(delivery_tag=last_tag, multiple=True)
+                                pending = 0
+                            now = time.monotonic()
+                            if inactivity_timeout is not None and now - idle_since >= inactivity_timeout:
+                                break  # Fila ociosa por inactivity_timeout segundos
+                            if deadline is not None and now >= deadline:
+                                break
+                            continue
+                        
+                        kind, name = _delivery_source(method_frame, queue_name)
+                        try:
+                            if _is_own_topic_message(method_frame, properties, self.username):
+                                message_data = None  # Própria: só recebe ack
+                            elif self._is_duplicate(properties, body, kind, name):
+                                message_data = None  # Repetida: só recebe ack
+                            else:
+                                message_data = decode_message(body, properties)
+                        except Exception as e:
+                            metrics.record_error('receive', kind, name)
+                            print(f"[{self.username}] Erro ao processar mensagem da fila '{queue_name}': {e}")
+                        else:
+                            if message_data is not None:
+                                metrics.record_received(kind, name, len(body), message_data)
+                                if method_frame.exchange:
+                                    # Mensagem de tópico entregue pelo binding na fila do usuário
+                                    message_data['topic'] = method_frame.exchange
+                                    message_data['routing_key'] = method_frame.routing_key
+                                in_hand = method_frame.delivery_tag
+                                yield message_data
+                                in_hand = None
+                        
+                        last_tag = method_frame.delivery_tag
+                        pending += 1
+                        delivered += 1
+                        if pending >= ack_batch:
+                            channel.basic_ack(delivery_tag=last_tag, multiple=True)
+                            pending = 0
+                        if max_messages is not None and delivered >= max_messages:
+                            break
+                        if deadline is not None and time.monotonic() >= deadline:
+                            break
+                        idle_since = time.monotonic()
+                finally:
+                    if channel.is_open:
+                        if pending:
+                            channel.basic_ack(delivery_tag=last_tag, multiple=True)
+                        # Cancela o consumidor devolvendo à fila o que não foi processado
+                        channel.cancel()
+                        if in_hand is not None:
+                            # Gerador fechado antes de processar a última entregue (o canal volta ao pool)
+                            channel.basic_nack(delivery_tag=in_hand, requeue=True)
+                        # O canal volta ao pool: o próximo usuário não herda o prefetch
+                        channel.basic_qos(prefetch_count=0)
+        except Exception as e:
+            if is_not_found_error(e):
+                declaration_cache.forget_queue(queue_name)
+            metrics.record_error('consume', 'queue', queue_name)
+            print(f"[{self.username}] Erro ao consumir a fila '{queue_name}': {e}")
+
+    def iter_topic(self, topic_name, binding_key='', headers=None, match='all',
+                   inactivity_timeout=None, max_messages=None):
+        """Gerador sobre as mensagens novas de um tópico, sem inscrição (exceto as próprias).
+
+        Usa uma fila temporária exclusiva, vinculada ao exchange com
+        ``binding_key``/``headers`` e apagada quando o gerador é fechado:
+        nada fica retido entre leituras, ao contrário da fila do usuário.
+        ``inactivity_timeout`` e ``max_messages`` funcionam como em ``iter_messages``.
+        """
+        delivered = 0
+        try:
+            with pooled_channel() as channel:
+                exchange_type = self._get_topic_type(topic_name)
+                declaration_cache.declare_exchange(channel, topic_name, exchange_type)
+                queue_name = channel.queue_declare(queue='', exclusive=True, auto_delete=True).method.queue
+                try:
+                    channel.queue_bind(queue=queue_name, exchange=topic_name, routing_key=binding_key,
+                                       arguments=headers_binding_arguments(headers, match))
+                    for method_frame, properties, body in channel.consume(
+                            queue_name, auto_ack=True, inactivity_timeout=inactivity_timeout):
+                        if method_frame is None:
+                            break  # Tópico ocioso por inactivity_timeout segundos
+                        if _is_own_topic_message(method_frame, properties, self.username):
+                            continue  # Não processa suas próprias mensagens
+                        try:
+                            message_data = decode_message(body, properties)
+                        except Exception as e:
+                            metrics.record_error('receive', 'topic', topic_name)
+                            print(f"[{self.username}] Erro ao processar mensagem do tópico '{topic_name}': {e}")
+                            continue
+                        metrics.record_received('topic', topic_name, len(body), message_data)
+                        message_data['topic'] = topic_name
+                        message_data['routing_key'] = method_frame.routing_key
+                        yield message_data
+                        delivered += 1
+                        if max_messages is not None and delivered >= max_messages:
+                            break
+                finally:
+                    if channel.is_open:
+                        channel.cancel()
+                        channel.queue_delete(queue=queue_name)
+        except Exception as e:
+            metrics.record_error('consume', 'topic', topic_name)
+            print(f"[{self.username}] Erro ao consumir o tópico '{topic_name}': {e}")
+
     def receive_messages_from_user_queue(self, timeout=5):
         """Recebe mensagens da própria fila do usuário"""
         return self.receive_message_from_queue(self.user_queue, timeout)
     
-    def publish_message_to_topic(self, topic_name, message):
-        """Publica mensagem em um tópico (publisher)"""
+    def publish_message_to_topic(self, topic_name, message, routing_key='', headers=None,
+                                 priority=None, expiration=None):
+        """Publica mensagem em um tópico (publisher).
+
+        ``routing_key`` (ex.: ``noticias.esporte.futebol``) e ``headers`` são
+        usados pelo broker para entregar a mensagem só aos bindings que casam,
+        em tópicos ``direct``/``topic`` e ``headers``, respectivamente.
+        """
         try:
-            connection = get_rabbitmq_connection()
-            channel = connection.channel()
-            
-            # Declara o exchange (tópico) para garantir que existe
-            channel.exchange_declare(exchange=topic_name, exchange_type='fanout', durable=True)
-            
             # Prepara a mensagem
-            message_body = json.dumps({
-                'from': self.username,
-                'message': message,
-                'timestamp': time.time()
-            })
+            message_body, properties = self._build_message(message, headers, priority, expiration)
+            exchange_type = self._get_topic_type(topic_name)
+            
+            if self.publisher is not None:
+                if not self.publisher.publish(topic_name, routing_key, message_body, properties, exchange_type):
+                    raise RuntimeError("buffer do publicador cheio")
+                print(f"[{self.username}] Mensagem enfileirada para o tópico '{topic_name}': {message}")
+                return True
             
-            # Publica a mensagem
-            channel.basic_publish(
-                exchange=topic_name,
-                routing_key='',
-                body=message_body,
-                properties=pika.BasicProperties(delivery_mode=2)
-            )
+            def publish():
+                with pooled_channel() as channel:
+                    # Declara o exchange apenas na primeira vez (cache de declarações)
+                    declaration_cache.declare_exchange(channel, topic_name, exchange_type)
+                    
+                    # Publica a mensagem
+                    channel.basic_publish(
+                        exchange=topic_name,
+                        routing_key=routing_key,
+                        body=message_body,
+                        properties=properties
+                    )
             
-            close_rabbitmq_connection(connection)
+            start = time.perf_counter()
+            retry_on_not_found(publish, exchanges=[topic_name])
+            metrics.record_sent('topic', topic_name, len(message_body), time.perf_counter() - start)
             print(f"[{self.username}] Mensagem publicada no tópico '{topic_name}': {message}")
             return True
             
         except Exception as e:
+            metrics.record_error('publish', 'topic', topic_name)
             print(f"[{self.username}] Erro ao publicar mensagem no tópico '{topic_name}': {e}")
             return False
     
-    def subscribe_to_topic(self, topic_name):
-        """Inscreve-se em um tópico (subscriber)"""
+    def send_messages_to_user(self, target_username, messages, window=DEFAULT_CONFIRM_WINDOW,
+                              priority=None, expiration=None):
+        """Envia várias mensagens para outro usuário com confirmação do broker.
+
+        Retorna uma lista com True/False para cada mensagem, na ordem de envio.
+        """
+        target_queue = f"user_{target_username}"
+        return self._publish_batch(
+            f"fila '{target_queue}'", '', target_queue, messages, window,
+            lambda channel: declaration_cache.declare_queue(
+                channel, target_queue, arguments=self._get_queue_arguments(target_queue)),
+            priority=priority, expiration=expiration
+        )
+    
+    def publish_batch(self, topic_name, messages, window=DEFAULT_CONFIRM_WINDOW,
+                      routing_key='', headers=None, priority=None, expiration=None):
+        """Publica várias mensagens em um tópico com confirmação do broker.
+
+        Todas usam a mesma ``routing_key``/``headers``. Retorna uma lista com
+        True/False para cada mensagem, na ordem de envio.
+        """
+        exchange_type = self._get_topic_type(topic_name)
+        return self._publish_batch(
+            f"tópico '{topic_name}'", topic_name, routing_key, messages, window,
+            lambda channel: declaration_cache.declare_exchange(channel, topic_name, exchange_type),
+            headers, priority, expiration
+        )
+    
+    def _publish_batch(self, destination, exchange, routing_key, messages, window, declare, headers=None,
+                       priority=None, expiration=None):
+        """Método interno que publica um lote num único canal em modo confirm"""
+        messages = list(messages)
+        sizes = []
+        kind, name = ('topic', exchange) if exchange else ('queue', routing_key)
+        
+        def publishes():
+            for message in messages:
+                message_body, properties = self._build_message(message, headers, priority, expiration)
+                sizes.append(len(message_body))
+                yield exchange, routing_key, message_body, properties
+        
+        start = time.perf_counter()
+        results = []
         try:
-            connection = get_rabbitmq_connection()
-            channel = connection.channel()
-            
-            # Declara o exchange (tópico)
-            channel.exchange_declare(exchange=topic_name, exchange_type='fanout', durable=True)
-            
-            # Cria uma fila temporária exclusiva para este subscriber
-            result = channel.queue_declare(queue='', exclusive=True)
-            queue_name = result.method.queue
-            
-            # Vincula a fila ao exchange
-            channel.queue_bind(exchange=topic_name, queue=queue_name)
-            
-            self.subscribed_topics.add(topic_name)
-            
-            # Atualiza no broker manager se disponível
-            if self.broker_manager:
-                self.broker_manager.subscribe_user_to_topic(self.username, topic_name)
-            
-            close_rabbitmq_connection(connection)
-            print(f"[{self.username}] Inscrito no tópico '{topic_name}'.")
-            return True
-            
+            with pooled_confirm_publisher(window) as publisher:
+                declare(publisher.channel)
+                # Com erro no meio do lote, os resultados parciais são mantidos
+                results = publisher.publish_batch(publishes())
+                error = publisher.error
         except Exception as e:
-            print(f"[{self.username}] Erro ao se inscrever no tópico '{topic_name}': {e}")
-            return False
+            error = e
+        if error is not None:
+            if is_not_found_error(error):
+                # Destino removido no broker: o próximo lote declara de novo
+                if exchange:
+                    declaration_cache.forget_exchange(exchange)
+                else:
+                    declaration_cache.forget_queue(routing_key)
+            elif is_precondition_failed_error(error) and not exchange:
+                # Fila criada com outros argumentos: o próximo lote não a redeclara
+                declaration_cache.remember_queue(routing_key)
+            print(f"[{self.username}] Erro ao enviar lote para {destination}: {error}")
+        elapsed = time.perf_counter() - start
+        
+        # Mensagens que não chegaram a ser publicadas contam como falha
+        results.extend([False] * (len(messages) - len(results)))
+        confirmed = sum(results)
+        if metrics.enabled:
+            metrics.inc('mom_messages_sent_total', confirmed, kind=kind, name=name)
+            metrics.inc('mom_bytes_sent_total', sum(size for size, ok in zip(sizes, results) if ok),
+                        kind=kind, name=name)
+            if confirmed < len(messages):
+                metrics.record_error('publish', kind, name, len(messages) - confirmed)
+        self.last_batch_stats = {
+            'destination': destination,
+            'sent': len(messages),
+            'confirmed': confirmed,
+            'failed': len(messages) - confirmed,
+            'elapsed': elapsed,
+            'rate': confirmed / elapsed if elapsed > 0 else 0.0,
+        }
+        print(f"[{self.username}] Lote para {destination}: {confirmed}/{len(messages)} mensagens "
+              f"confirmadas em {elapsed:.3f}s ({self.last_batch_stats['rate']:.0f} msg/s)")
+        return results
     
-    def unsubscribe_from_topic(self, topic_name):
-        """Desinscreve-se de um tópico"""
-        self.subscribed_topics.discard(topic_name)
+    def send_file_to_user(self, target_username, path, chunk_size=DEFAULT_CHUNK_SIZE,
+                          window=DEFAULT_CONFIRM_WINDOW, timeout=DEFAULT_TRANSFER_TIMEOUT):
+        """Envia um arquivo em pedaços numerados para a fila de transferências do usuário.
+
+        O arquivo é mapeado em memória e lido em fatias, e no máximo
+        ``window`` pedaços aguardam confirmação do broker: o uso de memória
+        não depende do tamanho do arquivo. Retorna o id da transferência, ou
+        None se algum pedaço não for confirmado.
+        """
+        try:
+            size = os.path.getsize(path)
+        except OSError as e:
+            print(f"[{self.username}] Erro ao ler arquivo '{path}': {e}")
+            return None
+        return self._send_chunks(target_username, iter_file_chunks(path, chunk_size),
+                                 os.path.basename(path), size, window, timeout)
+    
+    def send_stream_to_user(self, target_username, stream, name='stream', chunk_size=DEFAULT_CHUNK_SIZE,
+                            window=DEFAULT_CONFIRM_WINDOW, timeout=DEFAULT_TRANSFER_TIMEOUT):
+        """Envia um iterável de bytes (tamanho desconhecido) como em ``send_file_to_user``"""
+        return self._send_chunks(target_username, iter_stream_chunks(stream, chunk_size),
+                                 name, None, window, timeout)
+    
+    def _send_chunks(self, target_username, chunks, name, size, window, timeout):
+        """Publica os pedaços num canal em modo confirm, sem reter mais que a janela"""
+        target_queue = transfer_queue_name(target_username)
+        transfer_id = new_transfer_id()
+        sent_bytes = 0
+        
+        def publishes():
+            nonlocal sent_bytes
+            for message_body, properties in iter_chunk_messages(self.username, transfer_id, chunks, name, size):
+                sent_bytes += len(message_body)
+                yield '', target_queue, message_body, properties
         
-        # Atualiza no broker manager se disponível
+        start = time.perf_counter()
+        try:
+            with pooled_confirm_publisher(window) as publisher:
+                declaration_cache.declare_queue(publisher.channel, target_queue)
+                results = publisher.publish_batch(publishes(), timeout)
+                if publisher.error is not None:
+                    raise publisher.error
+        except Exception as e:
+            if is_not_found_error(e):
+                declaration_cache.forget_queue(target_queue)
+            metrics.record_error('publish', 'queue', target_queue)
+            print(f"[{self.username}] Erro na transferência '{name}' para '{target_username}': {e}")
+            return None
+        elapsed = time.perf_counter() - start
+        
+        failed = results.count(False)
+        if failed or not results:
+            metrics.record_error('publish', 'queue', target_queue, failed or 1)
+            print(f"[{self.username}] Transferência '{name}' para '{target_username}': "
+                  f"{failed}/{len(results)} pedaços sem confirmação.")
+            return None
+        metrics.record_sent('queue', target_queue, sent_bytes, elapsed)
+        print(f"[{self.username}] Transferência '{name}' enviada para '{target_username}': "
+              f"{sent_bytes} bytes em {len(results)} pedaços ({elapsed:.3f}s, id {transfer_id}).")
+        return transfer_id
+    
+    def start_transfer_listener(self, directory, on_complete=None, executor=None,
+                                prefetch_count=DEFAULT_TRANSFER_PREFETCH):
+        """Recebe as transferências destinadas a este usuário, gravando-as em ``directory``.
+
+        Os pedaços são gravados no disco pelos workers do ``executor`` e
+        recebem ack depois de gravados; ``prefetch_count`` limita os pedaços
+        em memória. Ao concluir uma transferência, ``on_complete(resultado)``
+        é chamado com o caminho do arquivo (ou o erro de verificação).
+        """
+        queue_name = transfer_queue_name(self.username)
+        if self.reassembler is None or self.reassembler.directory != directory:
+            self.reassembler = ChunkReassembler(directory)
+        reassembler = self.reassembler
+        
+        def handler(method, properties, body):
+            result = reassembler.feed(properties, body)
+            metrics.record_received('queue', queue_name, len(body))
+            if result is None:
+                return
+            if result['ok']:
+                print(f"[{self.username}] Transferência '{result['name']}' recebida de "
+                      f"'{result['from']}': {result['path']}")
+            else:
+                metrics.record_error('transfer', 'queue', queue_name)
+                print(f"[{self.username}] Transferência '{result['name']}' de '{result['from']}' "
+                      f"com erro: {result['error']}")
+            if on_complete is not None:
+                on_complete(result)
+        
+        def setup(channel):
+            declaration_cache.declare_queue(channel, queue_name)
+        
+        return self._start_listener(self._listener_id('transfer', queue_name), queue_name, None, setup,
+                                    f"transferências em '{queue_name}'", handler, executor, prefetch_count)
+    
+    def stop_transfer_listener(self):
+        return self._stop_listeners('transfer', transfer_queue_name(self.username))
+    
+    def get_transfer_status(self):
+        """Transferências em andamento, com os pedaços faltantes e repetidos de cada uma"""
+        if self.reassembler is None:
+            return {}
+        return self.reassembler.status()
+    
+    def call(self, target_username, payload, timeout=DEFAULT_RPC_TIMEOUT):
+        """Chama o ``serve`` de outro usuário e retorna a resposta (None em caso de erro ou timeout)"""
+        future = self.call_async(target_username, payload, timeout)
+        try:
+            reply = future.result(timeout)
+        except RpcError as e:
+            print(f"[{self.username}] Erro no handler RPC de '{target_username}': {e}")
+            return None
+        except TimeoutError:
+            self.rpc_client.fail(future.correlation_id, TimeoutError())
+            print(f"[{self.username}] Sem resposta de '{target_username}' em {timeout}s.")
+            return None
+        except Exception as e:
+            print(f"[{self.username}] Erro na chamada RPC para '{target_username}': {e}")
+            return None
+        print(f"[{self.username}] Resposta de '{target_username}': {reply}")
+        return reply
+    
+    def call_async(self, target_username, payload, timeout=DEFAULT_RPC_TIMEOUT):
+        """Envia uma requisição RPC e retorna um Future com a resposta.
+
+        A requisição vai para a fila ``rpc_<usuário>`` pelo canal que consome
+        ``amq.rabbitmq.reply-to`` (direct reply-to do RabbitMQ): não há fila
+        de respostas a declarar, e muitas chamadas simultâneas compartilham
+        esse canal, distinguidas pelo ``correlation_id``. Requisições não
+        atendidas expiram no broker junto com o prazo da chamada. O Future
+        falha com TimeoutError, RpcError (erro no handler) ou o erro do envio.
+        """
+        target_queue = rpc_queue_name(target_username)
+        future = self.rpc_client.register(target_queue, timeout)
+        try:
+            listener_id = self._start_rpc_replies()
+            message_body, properties = self._build_message(payload)
+            properties.delivery_mode = 1  # Requisição transitória: só vale até o timeout
+            properties.reply_to = DIRECT_REPLY_TO
+            properties.correlation_id = future.correlation_id
+            properties.expiration = str(max(1, int(timeout * 1000)))
+            published = self.listener_manager.publish(listener_id, '', target_queue, message_body, properties)
+        except Exception as e:
+            self.rpc_client.fail(future.correlation_id, e)
+            return future
+        
+        def check_published(completed):
+            if completed.exception() is not None:
+                self.rpc_client.fail(future.correlation_id, completed.exception())
+        
+        published.add_done_callback(check_published)
+        metrics.inc('mom_messages_sent_total', kind='queue', name=target_queue)
+        metrics.inc('mom_bytes_sent_total', len(message_body), kind='queue', name=target_queue)
+        return future
+    
+    def _start_rpc_replies(self):
+        """Garante o consumidor de ``amq.rabbitmq.reply-to`` deste usuário"""
+        listener_id = self._listener_id('rpc', 'replies')
+        manager = self._get_listener_manager()
+        if listener_id not in manager.consumer_ids():
+            if self._start_listener(listener_id, DIRECT_REPLY_TO, self.rpc_client.on_reply, None,
+                                    "respostas RPC") is None:
+                raise RuntimeError("Consumidor de respostas RPC indisponível.")
+        return listener_id
+    
+    def serve(self, handler, executor=None, prefetch_count=0):
+        """Atende chamadas RPC na fila ``rpc_<usuário>``.
+
+        ``handler(request)`` recebe a requisição decodificada (``from``,
+        ``message``, ``timestamp``) e retorna a resposta, que é publicada no
+        ``reply_to`` com o mesmo ``correlation_id``. Roda no ``executor``,
+        como os handlers dos listeners; se ele falhar, quem chamou recebe o erro.
+        """
+        queue_name = rpc_queue_name(self.username)
+        
+        def setup(channel):
+            declaration_cache.declare_queue(channel, queue_name)
+        
+        return self._start_listener(self._listener_id('rpc', queue_name), queue_name, None, setup,
+                                    f"chamadas RPC na fila '{queue_name}'",
+                                    partial(run_rpc_handler, handler, self.username, queue_name),
+                                    executor, prefetch_count, reply_to_sender=True)
+    
+    def stop_serving(self):
+        """Para de atender chamadas RPC"""
+        return self._stop_listeners('rpc', rpc_queue_name(self.username))
+    
+    def subscribe_to_topic(self, topic_name, binding_key='', headers=None, match='all'):
+        """Inscreve-se em um tópico (subscriber).
+
+        Cria um binding durável do exchange para a fila ``user_<nome>``: as
+        mensagens do tópico chegam na fila do usuário mesmo enquanto ele está
+        offline, e um único consumidor dessa fila recebe todo o seu tráfego.
+        Com ``binding_key`` (ex.: ``noticias.esporte.*``) ou ``headers`` o
+        broker entrega apenas as mensagens que casam com o binding.
+        """
+        # O broker manager, se disponível, cria o binding e atualiza o registro
         if self.broker_manager:
-            self.broker_manager.unsubscribe_user_from_topic(self.username, topic_name)
+            if not self.broker_manager.subscribe_user_to_topic(self.username, topic_name,
+                                                               binding_key, headers, match):
+                print(f"[{self.username}] Erro ao se inscrever no tópico '{topic_name}'.")
+                return False
+        else:
+            try:
+                arguments = headers_binding_arguments(headers, match)
+                bind_queue(self.user_queue, topic_name, self._get_topic_type(topic_name),
+                           binding_key, arguments)
+                previous = self.topic_bindings.get(topic_name)
+                if previous is not None and previous != (binding_key, arguments):
+                    unbind_queue(self.user_queue, topic_name, *previous)
+                self.topic_bindings[topic_name] = (binding_key, arguments)
+            except Exception as e:
+                print(f"[{self.username}] Erro ao se inscrever no tópico '{topic_name}': {e}")
+                return False
         
+        self.subscribed_topics.add(topic_name)
+        print(f"[{self.username}] Inscrito no tópico '{topic_name}'.")
+        return True
+    
+    def unsubscribe_from_topic(self, topic_name):
+        """Desinscreve-se de um tópico (remove o binding da fila do usuário)"""
+        # O broker manager, se disponível, remove o binding e atualiza o registro
+        if self.broker_manager:
+            if not self.broker_manager.unsubscribe_user_from_topic(self.username, topic_name):
+                print(f"[{self.username}] Erro ao se desinscrever do tópico '{topic_name}'.")
+                return False
+        else:
+            try:
+                unbind_queue(self.user_queue, topic_name, *self.topic_bindings.pop(topic_name, ('', None)))
+            except Exception as e:
+                print(f"[{self.username}] Erro ao se desinscrever do tópico '{topic_name}': {e}")
+                return False
+        
+        self.subscribed_topics.discard(topic_name)
+        self.topic_listeners.discard(topic_name)
         print(f"[{self.username}] Desinscrito do tópico '{topic_name}'.")
         return True
     
-    def start_topic_listener(self, topic_name):
-        """Inicia um listener para um tópico específico"""
-        def listen_to_topic():
+    def _is_subscribed(self, topic_name):
+        """Indica se já existe um binding do tópico para a fila do usuário"""
+        if self.broker_manager:
+            return self.broker_manager.registry.get_subscription(self.username, topic_name) is not None
+        return topic_name in self.topic_bindings
+    
+    def _replay_start(self, topic_name, last, since, offset):
+        """``x-stream-offset`` inicial; para ``last`` procura antes o fim do log"""
+        tail = None
+        if last is not None and since is None and offset is None:
+            with pooled_channel() as channel:
+                tail = stream_tail(channel, history_queue_name(topic_name))
+        return stream_offset(last, since, offset, tail)
+    
+    def read_topic_history(self, topic_name, last=None, since=None, offset=None, binding_key=None,
+                           max_messages=DEFAULT_PREFETCH, timeout=DEFAULT_REPLAY_TIMEOUT):
+        """Lê mensagens retidas no histórico de um tópico, sem ficar ouvindo.
+
+        Começa pelas ``last`` mais recentes, pelas publicadas desde ``since``
+        (``time.time()``) ou a partir de ``offset`` (padrão: as últimas
+        ``max_messages``), e para em ``max_messages`` ou após ``timeout``
+        segundos sem mensagens. Em tópicos ``topic``, ``binding_key`` filtra
+        as mensagens como um binding. Cada mensagem traz ``offset``, que
+        também fica em ``get_topic_offset`` para retomar a leitura depois.
+        """
+        if last is None and since is None and offset is None:
+            last = max_messages
+        queue_name = history_queue_name(topic_name)
+        messages = []
+        try:
+            start = self._replay_start(topic_name, last, since, offset)
+            with pooled_channel() as channel:
+                channel.basic_qos(prefetch_count=max(1, min(max_messages, DEFAULT_REPLAY_PREFETCH)))
+                try:
+                    for method_frame, properties, body in channel.consume(
+                            queue_name, arguments={'x-stream-offset': start}, inactivity_timeout=timeout):
+                        if method_frame is None:
+                            break  # Fim do histórico retido
+                        channel.basic_ack(delivery_tag=method_frame.delivery_tag)
+                        self.topic_offsets[topic_name] = message_offset(properties)
+                        if binding_key is not None and not topic_matches(binding_key, method_frame.routing_key):
+                            continue
+                        message_data = decode_message(body, properties)
+                        metrics.record_received('topic', topic_name, len(body))
+                        message_data['topic'] = topic_name
+                        message_data['routing_key'] = method_frame.routing_key
+                        message_data['offset'] = self.topic_offsets[topic_name]
+                        messages.append(message_data)
+                        if len(messages) >= max_messages:
+                            break
+                finally:
+                    if channel.is_open:
+                        channel.cancel()
+                        # O canal volta ao pool: o próximo usuário não herda o prefetch
+                        channel.basic_qos(prefetch_count=0)
+        except Exception as e:
+            metrics.record_error('consume', 'topic', topic_name)
+            print(f"[{self.username}] Erro ao ler o histórico do tópico '{topic_name}': {e}")
+        print(f"[{self.username}] {len(messages)} mensagens lidas do histórico do tópico '{topic_name}'.")
+        return messages
+    
+    def start_topic_replay(self, topic_name, handler=None, last=None, since=None, offset=None,
+                           binding_key=None, executor=None, prefetch_count=DEFAULT_REPLAY_PREFETCH):
+        """Reproduz o histórico de um tópico e continua com as mensagens ao vivo, sem lacunas.
+
+        O consumidor lê a fila stream do tópico a partir de ``last``/``since``/
+        ``offset`` (como em ``read_topic_history``; sem eles, só as novas) e,
+        ao alcançar o fim do log, recebe as publicações seguintes pelo mesmo
+        consumidor. O último offset processado fica em ``get_topic_offset``:
+        após uma reconexão a leitura continua dali, e um cliente que o guarda
+        pode retomá-la depois com ``offset=guardado + 1``. Com ``handler`` as
+        mensagens são processadas no ``executor`` (um executor de processos
+        não atualiza o offset guardado). Use no lugar de
+        ``start_topic_listener`` para o tópico, ou as mensagens chegam duas vezes.
+        """
+        queue_name = history_queue_name(topic_name)
+        try:
+            start = self._replay_start(topic_name, last, since, offset)
+        except Exception as e:
+            print(f"[{self.username}] Erro ao ler o histórico do tópico '{topic_name}': {e}")
+            return None
+        self.topic_offsets.pop(topic_name, None)
+        offsets = self.topic_offsets
+        
+        def arguments():
+            # Na reconexão, continua após a última mensagem processada
+            if topic_name in offsets:
+                return {'x-stream-offset': offsets[topic_name] + 1}
+            return {'x-stream-offset': start}
+        
+        def callback(ch, method, properties, body):
+            offsets[topic_name] = message_offset(properties)
             try:
-                connection = get_rabbitmq_connection()
-                channel = connection.channel()
-                
-                # Declara o exchange
-                channel.exchange_declare(exchange=topic_name, exchange_type='fanout', durable=True)
-                
-                # Cria uma fila temporária exclusiva
-                result = channel.queue_declare(queue='', exclusive=True)
-                queue_name = result.method.queue
-                
-                # Vincula a fila ao exchange
-                channel.queue_bind(exchange=topic_name, queue=queue_name)
-                
-                def callback(ch, method, properties, body):
-                    try:
-                        message_data = json.loads(body.decode())
-                        if message_data['from'] != self.username:  # Não processa suas próprias mensagens
-                            print(f"[{self.username}] Mensagem recebida do tópico '{topic_name}': {message_data['message']} (de: {message_data['from']})")
-                    except Exception as e:
-                        print(f"[{self.username}] Erro ao processar mensagem do tópico: {e}")
-                
-                channel.basic_consume(queue=queue_name, on_message_callback=callback, auto_ack=True)
-                
-                print(f"[{self.username}] Ouvindo tópico '{topic_name}'. Para parar, pressione CTRL+C")
-                channel.start_consuming()
-                
+                if _is_own_topic_message(method, properties, self.username):
+                    return
+                if binding_key is not None and not topic_matches(binding_key, method.routing_key):
+                    return
+                message_data = decode_message(body, properties)
+                metrics.record_received('topic', topic_name, len(body), message_data)
+                print(f"[{self.username}] Mensagem recebida do tópico '{topic_name}' "
+                      f"(offset {offsets[topic_name]}): {message_data['message']} (de: {message_data['from']})")
             except Exception as e:
-                print(f"[{self.username}] Erro no listener do tópico '{topic_name}': {e}")
+                metrics.record_error('listener', 'topic', topic_name)
+                print(f"[{self.username}] Erro ao processar mensagem do histórico: {e}")
+            finally:
+                ch.basic_ack(delivery_tag=method.delivery_tag)
         
-        self.listener_thread = threading.Thread(target=listen_to_topic, daemon=True)
-        self.listener_thread.start()
-        self.listening = True
+        if handler is not None:
+            handler = partial(_run_replay_handler, handler, offsets, topic_name, binding_key,
+                              skip_from=self.username)
+        return self._start_listener(self._listener_id('history', topic_name), queue_name, callback, None,
+                                    f"histórico do tópico '{topic_name}'", handler, executor, prefetch_count,
+                                    auto_ack=False, arguments=arguments)
     
-    def stop_topic_listener(self):
-        """Para o listener de tópicos"""
-        self.listening = False
-        if self.listener_thread and self.listener_thread.is_alive():
-            print(f"[{self.username}] Parando listener de tópicos...")
+    def stop_topic_replay(self, topic_name=None):
+        """Para a reprodução de um tópico (ou de todos); o offset processado continua guardado"""
+        return self._stop_listeners('history', topic_name)
+    
+    def get_topic_offset(self, topic_name):
+        """Último offset do histórico processado neste tópico (None se nenhum)"""
+        return self.topic_offsets.get(topic_name)
+    
+    def _get_listener_manager(self):
+        """Retorna o gerenciador de listeners compartilhado (uma conexão, uma thread de I/O)"""
+        if self.listener_manager is None:
+            self.listener_manager = get_listener_manager()
+        return self.listener_manager
+    
+    def _listener_id(self, kind, name):
+        return f"{self.username}:{kind}:{name}"
+    
+    def start_topic_listener(self, topic_name, handler=None, executor=None, prefetch_count=0,
+                             binding_key=None, headers=None, match='all'):
+        """Inicia um listener para um tópico específico.
+
+        Inscreve o usuário no tópico (binding durável, filtrado por
+        ``binding_key``/``headers`` como em ``subscribe_to_topic``; sem eles,
+        uma inscrição existente é mantida) e garante um consumidor
+        na fila do usuário, que recebe as mensagens de todos os tópicos
+        inscritos. Sem ``handler`` as mensagens são exibidas na thread de I/O.
+        Com ``handler(message_data)`` elas são processadas no ``executor``
+        (threads ou processos), com prefetch limitado e ack manual após o
+        processamento; ``message_data['topic']`` indica o tópico de origem.
+
+        Se o consumidor da fila do usuário já existe, ele é reutilizado
+        quando a chamada não informa ``handler``/``executor``/``prefetch_count``
+        ou informa os mesmos com que ele foi iniciado. Com outros valores a
+        chamada não faz nada e retorna None: pare antes o consumidor
+        (``stop_queue_listener``) para trocá-los.
+        """
+        listener_id = self._listener_id('queue', self.user_queue)
+        manager = self._get_listener_manager()
+        running = listener_id in manager.consumer_ids()
+        options = (handler, executor, prefetch_count)
+        if running and options != (None, None, 0) and options != self._user_queue_options:
+            print(f"[{self.username}] O listener da fila '{self.user_queue}' já existe com outro "
+                  f"handler/executor/prefetch; pare-o antes de ouvir o tópico '{topic_name}' com estes.")
+            return None
+        
+        if binding_key is not None or headers or not self._is_subscribed(topic_name):
+            if not self.subscribe_to_topic(topic_name, binding_key or '', headers, match):
+                return None
+        
+        if not running:
+            if self.start_queue_listener(handler=handler, executor=executor,
+                                         prefetch_count=prefetch_count) is None:
+                return None
+            self._implicit_queue_listener = True
+        
+        self.topic_listeners.add(topic_name)
+        print(f"[{self.username}] Ouvindo tópico '{topic_name}' pela fila '{self.user_queue}'.")
+        return listener_id
     
-    def start_queue_listener(self, queue_name=None):
-        """Inicia um listener para uma fila específica (padrão: fila do usuário)"""
+    def stop_topic_listener(self, topic_name=None):
+        """Para de ouvir um tópico (ou todos, se nenhum for informado).
+
+        A inscrição continua ativa: as novas mensagens aguardam na fila do
+        usuário. Quando não resta tópico ouvido, o consumidor da fila é parado
+        se tiver sido iniciado por um listener de tópico.
+        """
+        if topic_name is None:
+            stopped = len(self.topic_listeners)
+            self.topic_listeners.clear()
+        else:
+            stopped = 1 if topic_name in self.topic_listeners else 0
+            self.topic_listeners.discard(topic_name)
+        
+        if not self.topic_listeners and self._implicit_queue_listener:
+            self._implicit_queue_listener = False
+            self.stop_queue_listener(self.user_queue)
+        return stopped
+    
+    def start_queue_listener(self, queue_name=None, handler=None, executor=None, prefetch_count=0):
+        """Inicia um listener para uma fila específica (padrão: fila do usuário).
+
+        Com ``handler`` funciona como em ``start_topic_listener``. Na fila do
+        usuário também chegam as mensagens dos tópicos inscritos.
+        """
         if queue_name is None:
             queue_name = self.user_queue
-            
-        def listen_to_queue():
+        
+        def setup(channel):
+            # Declara a fila
+            declaration_cache.declare_queue(channel, queue_name,
+                                            arguments=self._get_queue_arguments(queue_name))
+        
+        def callback(ch, method, properties, body):
+            if _is_own_topic_message(method, properties, self.username):
+                return  # Não processa suas próprias mensagens
+            kind, name = _delivery_source(method, queue_name)
             try:
-                connection = get_rabbitmq_connection()
-                channel = connection.channel()
-                
-                # Declara a fila
-                channel.queue_declare(queue=queue_name, durable=True)
-                
-                def callback(ch, method, properties, body):
-                    try:
-                        message_data = json.loads(body.decode())
-                        print(f"[{self.username}] Mensagem recebida da fila '{queue_name}': {message_data['message']} (de: {message_data['from']})")
-                    except Exception as e:
-                        print(f"[{self.username}] Erro ao processar mensagem da fila: {e}")
-                
-                channel.basic_consume(queue=queue_name, on_message_callback=callback, auto_ack=True)
-                
-                print(f"[{self.username}] Ouvindo fila '{queue_name}'. Para parar, pressione CTRL+C")
-                channel.start_consuming()
-                
+                message_data = decode_message(body, properties)
+                metrics.record_received(kind, name, len(body), message_data)
+                if not method.exchange:
+                    print(f"[{self.username}] Mensagem recebida da fila '{queue_name}': {message_data['message']} (de: {message_data['from']})")
+                else:
+                    print(f"[{self.username}] Mensagem recebida do tópico '{method.exchange}': {message_data['message']} (de: {message_data['from']})")
             except Exception as e:
-                print(f"[{self.username}] Erro no listener da fila '{queue_name}': {e}")
+                metrics.record_error('listener', kind, name)
+                print(f"[{self.username}] Erro ao processar mensagem da fila: {e}")
         
-        self.listener_thread = threading.Thread(target=listen_to_queue, daemon=True)
-        self.listener_thread.start()
+        listener_id = self._listener_id('queue', queue_name)
+        if queue_name == self.user_queue and listener_id not in self._get_listener_manager().consumer_ids():
+            # Conferidos por start_topic_listener ao reutilizar o consumidor
+            self._user_queue_options = (handler, executor, prefetch_count)
+        if handler is not None:
+            handler = partial(_run_handler, handler, skip_from=self.username, queue_name=queue_name)
+        return self._start_listener(listener_id, queue_name, callback, setup,
+                                    f"fila '{queue_name}'", handler, executor, prefetch_count)
+    
+    def stop_queue_listener(self, queue_name=None):
+        """Para o listener de uma fila (ou de todas as filas, se nenhuma for informada)"""
+        return self._stop_listeners('queue', queue_name)
+    
+    def stop_listeners(self):
+        """Para todos os listeners deste usuário"""
+        return self.stop_sharded_queue_listener() + self._stop_listeners(None, None)
+    
+    def _start_listener(self, listener_id, queue_name, callback, setup, description,
+                        handler=None, executor=None, prefetch_count=0, reply_to_sender=False, manager=None,
+                        auto_ack=True, arguments=None):
+        """Registra um consumidor no gerenciador de listeners (o compartilhado, por padrão)"""
+        manager = manager or self._get_listener_manager()
+        # Respostas RPC já são descartadas pelo correlation_id quando repetidas
+        dedup = self.dedup if queue_name != DIRECT_REPLY_TO else None
+        if listener_id in manager.consumer_ids():
+            print(f"[{self.username}] Já existe um listener para {description}.")
+            return listener_id
+        try:
+            if handler is not None:
+                manager.add_consumer(listener_id, queue_name, setup=setup, handler=handler,
+                                     executor=executor, prefetch_count=prefetch_count,
+                                     reply_to_sender=reply_to_sender, arguments=arguments, dedup=dedup)
+            else:
+                manager.add_consumer(listener_id, queue_name, callback, setup=setup, auto_ack=auto_ack,
+                                     prefetch_count=0 if auto_ack else prefetch_count, arguments=arguments,
+                                     dedup=dedup)
+        except Exception as e:
+            print(f"[{self.username}] Erro no listener para {description}: {e}")
+            return None
+        self.listener_thread = manager.thread
         self.listening = True
+        print(f"[{self.username}] Ouvindo {description}.")
+        return listener_id
+    
+    def _stop_listeners(self, kind, name):
+        """Cancela os consumidores deste usuário que correspondem a ``kind``/``name``"""
+        if self.listener_manager is None:
+            return 0
+        prefix = f"{self.username}:"
+        if kind is not None:
+            prefix += f"{kind}:"
+        stopped = 0
+        for listener_id in self.listener_manager.consumer_ids():
+            if not listener_id.startswith(prefix):
+                continue
+            if name is not None and listener_id != self._listener_id(kind, name):
+                continue
+            try:
+                if self.listener_manager.remove_consumer(listener_id):
+                    stopped += 1
+            except Exception as e:
+                print(f"[{self.username}] Erro ao parar listener '{listener_id}': {e}")
+        if self._listener_id('queue', self.user_queue) not in self.listener_manager.consumer_ids():
+            # Sem consumidor na fila do usuário não há tópicos sendo ouvidos
+            self.topic_listeners.clear()
+            self._implicit_queue_listener = False
+        if stopped:
+            print(f"[{self.username}] {stopped} listener(s) parado(s).")
+        self.listening = any(listener_id.startswith(f"{self.username}:")
+                             for listener_id in self.listener_manager.consumer_ids())
+        return stopped
+    
+    def get_listener_stats(self):
+        """Retorna as estatísticas por consumidor dos listeners deste usuário"""
+        if self.listener_manager is None:
+            return {}
+        prefix = f"{self.username}:"
+        return {listener_id: stats
+                for listener_id, stats in self.listener_manager.stats().items()
+                if listener_id.startswith(prefix)}
     
     def get_subscribed_topics(self):
         """Retorna a lista de tópicos inscritos"""